@@ -23,13 +23,35 @@ NOTES:
       Please do your testing there - otherwise,
       you might get inaccurate test failures!
 """
+import gc
+import json
 import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import weakref
 
 import unittest
+import numpy
+import pygame
 from hypothesis import given
 from hypothesis.strategies import integers
 
-from tree_data import FileSystemTree
+from tree_data import AbstractTree, FileSystemTree, NO_SUBTREES
+import batch_render
+import benchmarks
+import data_sources
+import fs_scan
+import fs_watch
+import instrumentation
+import layouts
+import population
+import raster
+import snapshot
+import text_render
+import treemap_visualiser
 
 
 # This should be the path to the "B" folder in the sample data.
@@ -93,6 +115,307 @@ class FileSystemTreeConstructorTest(unittest.TestCase):
         self.assertEqual(second.data_size, 10)
 
 
+class CompactNodeTest(unittest.TestCase):
+    def test_no_instance_dict(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        self.assertFalse(hasattr(tree, '__dict__'))
+
+    def test_leaves_share_subtrees(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        _sort_subtrees(tree)
+        self.assertIs(tree._subtrees[1]._subtrees, NO_SUBTREES)
+        with self.assertRaises(TypeError):
+            tree._subtrees[1]._subtrees.append(tree)
+
+    def test_add_subtree_to_leaf(self):
+        leaf = _SyntheticTree('leaf', [], 0)
+        leaf.add_subtree(_SyntheticTree('new', [], 5))
+        self.assertEqual(leaf.data_size, 5)
+        self.assertEqual(len(leaf._subtrees), 1)
+        self.assertEqual(NO_SUBTREES, [])
+
+    def test_colour_round_trip(self):
+        tree = _SyntheticTree('leaf', [], 1)
+        tree.colour = (1, 128, 255)
+        self.assertEqual(tree.colour, (1, 128, 255))
+
+    def test_memory_per_node(self):
+        # the measurement documented in the tree_data module docstring
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rng = random.Random(0)
+        for folder in range(20):
+            path = os.path.join(directory, 'folder{}'.format(folder))
+            os.mkdir(path)
+            for i in range(100):
+                # sparse files, so that nothing is written
+                with open(os.path.join(path, 'file{}.txt'.format(i)),
+                          'wb') as f:
+                    f.truncate(rng.randint(0, 2 ** 30))
+        nodes = 20 * 101 + 1
+        gc.collect()
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        before = tracemalloc.get_traced_memory()[0]
+        tree = FileSystemTree(directory)
+        gc.collect()
+        built = tracemalloc.get_traced_memory()[0]
+        tree.generate_treemap((0, 0, 1024, 700))
+        gc.collect()
+        laid_out = tracemalloc.get_traced_memory()[0]
+        self.assertLess((built - before) / nodes, 240)
+        self.assertLess((laid_out - before) / nodes, 400)
+
+
+class ParallelScanTest(unittest.TestCase):
+    def test_same_tree_as_serial_scan(self):
+        serial = FileSystemTree(EXAMPLE_PATH)
+        parallel = FileSystemTree(EXAMPLE_PATH, workers=4)
+        self.assertEqual(_tree_shape(parallel), _tree_shape(serial))
+        for subtree in parallel._subtrees:
+            self.assertIs(subtree._parent_tree, parallel)
+
+    def test_subtrees_sorted_by_name(self):
+        tree = FileSystemTree(EXAMPLE_PATH, workers=4)
+        self.assertEqual([subtree._root for subtree in tree._subtrees],
+                         ['A', 'f4.txt'])
+        self.assertEqual([leaf._root for leaf in tree._subtrees[0]._subtrees],
+                         ['f1.txt', 'f2.txt', 'f3.txt'])
+
+
+class LazyTreeTest(unittest.TestCase):
+    def test_placeholder_sizes(self):
+        tree = FileSystemTree(EXAMPLE_PATH, lazy_depth=0)
+        placeholder = tree._subtrees[0]
+        self.assertTrue(placeholder._lazy)
+        self.assertEqual(placeholder._root, 'A')
+        self.assertEqual(placeholder.data_size, 30)
+        self.assertEqual(placeholder._subtrees, [])
+        self.assertEqual(tree.data_size, 40)
+
+    def test_expand(self):
+        tree = FileSystemTree(EXAMPLE_PATH, lazy_depth=0)
+        tree._subtrees[0].expand()
+        self.assertFalse(tree._subtrees[0]._lazy)
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(EXAMPLE_PATH)))
+
+    def test_layout_expands_large_placeholders(self):
+        tree = FileSystemTree(EXAMPLE_PATH, lazy_depth=0)
+        self.assertEqual(len(tree.generate_treemap((0, 0, 4, 4))), 2)
+        self.assertTrue(tree._subtrees[0]._lazy)
+        self.assertEqual(len(tree.generate_treemap((0, 0, 100, 100))), 4)
+        self.assertFalse(tree._subtrees[0]._lazy)
+
+    def test_engines_expand_the_same_placeholders(self):
+        for rect, lod_area in [((0, 0, 4, 4), 0), ((0, 0, 100, 100), 0),
+                               ((0, 0, 1024, 700), 0),
+                               ((0, 0, 100, 100), 10000)]:
+            python = FileSystemTree('example-data', lazy_depth=0)
+            python.set_lod_area(lod_area)
+            numpy_tree = FileSystemTree('example-data', lazy_depth=0)
+            numpy_tree.set_lod_area(lod_area)
+            self.assertEqual(
+                [drawn for drawn, _ in numpy_tree.generate_treemap(rect,
+                                                                   'numpy')],
+                [drawn for drawn, _ in python.generate_treemap(rect)])
+            self.assertEqual(_tree_shape(numpy_tree), _tree_shape(python))
+
+    def test_expand_same_size_is_repainted(self):
+        tree = FileSystemTree(EXAMPLE_PATH, lazy_depth=0)
+        rect = (0, 0, 4, 4)
+        tree.generate_treemap(rect)
+        self.assertEqual(tree.get_leaf_count(), 1)
+        self.assertEqual(tree.largest_leaves(1)[0]._root, 'f4.txt')
+        placeholder = tree._subtrees[0]
+        placeholder.expand()
+        self.assertEqual(tree.data_size, 40)
+        self.assertNotEqual(list(tree.iter_treemap_changes(rect)), [])
+        self.assertEqual(tree.get_leaf_count(), 4)
+        self.assertEqual(tree.largest_leaves(1)[0]._root, 'f1.txt')
+        self.assertEqual(tree.largest_subtrees(1), [placeholder])
+
+    def test_snapshot_keeps_placeholders(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'B.snapshot')
+        snapshot.save_snapshot(FileSystemTree(EXAMPLE_PATH, lazy_depth=0),
+                               path)
+        loaded = snapshot.load_snapshot(path)
+        self.assertTrue(loaded._subtrees[0]._lazy)
+        self.assertFalse(loaded._subtrees[1]._lazy)
+        loaded._subtrees[0].expand()
+        self.assertEqual(_tree_shape(loaded),
+                         _tree_shape(FileSystemTree(EXAMPLE_PATH)))
+
+
+class RefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'B')
+        shutil.copytree(EXAMPLE_PATH, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_refresh_with_mtimes(self):
+        tree = FileSystemTree(self.path)
+        os.remove(os.path.join(self.path, 'A', 'f2.txt'))
+        os.makedirs(os.path.join(self.path, 'C', 'D'))
+        _write_file(os.path.join(self.path, 'C', 'D', 'f5.txt'), 7)
+        _bump_mtime(os.path.join(self.path, 'A'))
+        _bump_mtime(self.path)
+
+        tree.refresh()
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(self.path)))
+
+    def test_refresh_changed_folders(self):
+        tree = FileSystemTree(self.path)
+        _write_file(os.path.join(self.path, 'A', 'f1.txt'), 3)
+        _write_file(os.path.join(self.path, 'A', 'f0.txt'), 5)
+
+        tree.refresh([os.path.join(self.path, 'A')])
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(self.path)))
+        self.assertEqual(tree.data_size, 33)
+
+    def test_refresh_folder_starting_with_dots(self):
+        os.makedirs(os.path.join(self.path, '..cache'))
+        _bump_mtime(self.path)
+        tree = FileSystemTree(self.path)
+        folder = os.path.join(self.path, '..cache')
+        _write_file(os.path.join(folder, 'f7.txt'), 6)
+        tree.refresh([folder])
+        self.assertEqual(tree.data_size, 46)
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(self.path)))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+    def test_refresh_with_inotify(self):
+        tree = FileSystemTree(self.path)
+        with fs_watch.InotifyWatcher(self.path) as watcher:
+            os.makedirs(os.path.join(self.path, 'A', 'E'))
+            _write_file(os.path.join(self.path, 'A', 'E', 'f6.txt'), 4)
+            _write_file(os.path.join(self.path, 'f4.txt'), 1)
+            changed = watcher.read_changes()
+        # A/E may be missing: it was only watched once its creation was read
+        self.assertLessEqual({self.path, os.path.join(self.path, 'A')},
+                             changed)
+
+        tree.refresh(changed)
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(self.path)))
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'B.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        snapshot.save_snapshot(tree, self.path)
+        loaded = snapshot.load_snapshot(self.path)
+        self.assertEqual(_tree_shape(loaded), _tree_shape(tree))
+        self.assertEqual(loaded._path, EXAMPLE_PATH)
+        for subtree in loaded._subtrees:
+            self.assertIs(subtree._parent_tree, loaded)
+
+    def test_mapped_arrays(self):
+        snapshot.save_snapshot(FileSystemTree(EXAMPLE_PATH), self.path)
+        with snapshot.Snapshot(self.path) as mapped:
+            self.assertEqual(mapped.node_count, 6)
+            self.assertEqual(mapped.name(0), 'B')
+            self.assertEqual(mapped.size(0), 40)
+            self.assertEqual([mapped.name(i) for i in mapped.children(0)],
+                             ['A', 'f4.txt'])
+            self.assertEqual(mapped.parent(1), 0)
+            self.assertIsNone(mapped.mtime(2))
+
+    def test_empty_placeholders_stay_lazy(self):
+        directory = os.path.join(self.directory, 'C')
+        os.makedirs(os.path.join(directory, 'empty'))
+        shutil.copytree(EXAMPLE_PATH, os.path.join(directory, 'B'))
+        budget = fs_scan.ScanBudget(max_entries=1)
+        tree = FileSystemTree(directory, lazy_depth=0, budget=budget)
+        self.assertEqual([subtree._lazy for subtree in tree._subtrees],
+                         [True, True])
+        snapshot.save_snapshot(tree, self.path)
+        loaded = snapshot.load_snapshot(self.path)
+        self.assertEqual([subtree._lazy for subtree in loaded._subtrees],
+                         [True, True])
+        loaded._subtrees[0].expand()
+        self.assertEqual(loaded.data_size, 40)
+
+    def test_visualiser_ignores_other_snapshots(self):
+        snapshot.save_snapshot(FileSystemTree(EXAMPLE_PATH), self.path)
+        opened = treemap_visualiser._open_snapshot(
+            os.path.abspath(EXAMPLE_PATH), self.path)
+        self.assertTrue(opened._subtrees[0]._lazy)
+        _expand_all(opened)
+        self.assertEqual(_tree_shape(opened),
+                         _tree_shape(FileSystemTree(EXAMPLE_PATH)))
+        self.assertIsNone(treemap_visualiser._open_snapshot(
+            os.path.join(EXAMPLE_PATH, 'A'), self.path))
+        self.assertIsNone(treemap_visualiser._open_snapshot(
+            EXAMPLE_PATH, os.path.join(self.directory, 'missing')))
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertIsNone(treemap_visualiser._open_snapshot(EXAMPLE_PATH,
+                                                            self.path))
+
+    def test_lazy_tree(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        snapshot.save_snapshot(tree, self.path)
+        with snapshot.Snapshot(self.path) as mapped:
+            loaded = mapped.to_tree(lazy=True)
+            self.assertEqual(loaded.data_size, 40)
+            placeholder = loaded._subtrees[0]
+            self.assertTrue(placeholder._lazy)
+            self.assertEqual(placeholder.data_size, 30)
+            self.assertEqual(placeholder._subtrees, [])
+            rect = (0, 0, 100, 100)
+            self.assertEqual(
+                [drawn for drawn, _ in loaded.generate_treemap(rect)],
+                [drawn for drawn, _ in tree.generate_treemap(rect)])
+            self.assertFalse(placeholder._lazy)
+            self.assertIsNone(placeholder._extras)
+            self.assertEqual(_tree_shape(loaded), _tree_shape(tree))
+
+    def test_refresh_lazy_tree(self):
+        directory = os.path.join(self.directory, 'C')
+        for name in ('B', 'D'):
+            shutil.copytree(EXAMPLE_PATH, os.path.join(directory, name))
+        snapshot.save_snapshot(FileSystemTree(directory), self.path)
+        _write_file(os.path.join(directory, 'D', 'A', 'new.txt'), 7)
+        with snapshot.Snapshot(self.path) as mapped:
+            loaded = mapped.to_tree(lazy=True)
+            loaded.refresh()
+            unchanged, changed = loaded._subtrees
+            self.assertTrue(unchanged._lazy)
+            self.assertFalse(changed._lazy)
+            self.assertFalse(changed._subtrees[0]._lazy)
+            self.assertEqual(loaded.data_size, 87)
+            # what has not been built is copied from the old snapshot
+            other_path = os.path.join(self.directory, 'C.snapshot')
+            snapshot.save_snapshot(loaded, other_path)
+            self.assertTrue(unchanged._lazy)
+            _expand_all(loaded)
+        self.assertEqual(_tree_shape(loaded),
+                         _tree_shape(FileSystemTree(directory)))
+        self.assertEqual(_tree_shape(snapshot.load_snapshot(other_path)),
+                         _tree_shape(loaded))
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            snapshot.Snapshot(self.path)
+
+
 class GenerateTreemapTest(unittest.TestCase):
     @given(integers(min_value=100, max_value=1000),
            integers(min_value=100, max_value=1000),
@@ -143,6 +466,1247 @@ class GenerateTreemapTest(unittest.TestCase):
         self.assertEqual(rect_f4, (0, 750, 800, 250))
 
 
+class IterTreemapTest(unittest.TestCase):
+    def test_matches_generate_treemap(self):
+        tree = _random_tree(random.Random(148), 5)
+        self.assertEqual(list(tree.iter_treemap((0, 0, 800, 600))),
+                         tree.generate_treemap((0, 0, 800, 600)))
+
+    def test_deep_tree(self):
+        tree = _SyntheticTree('leaf', [], 10)
+        for _ in range(5000):
+            tree = _SyntheticTree('node', [tree])
+        rects = tree.generate_treemap((0, 0, 800, 600))
+        self.assertEqual(rects, [((0, 0, 800, 600), rects[0][1])])
+        self.assertEqual(len(tree.leaf_dictionary((0, 0, 800, 600))), 1)
+
+
+    def test_iter_leaves_min_size(self):
+        tree = _random_tree(random.Random(148), 5)
+        treemap = tree.generate_treemap((0, 0, 800, 600))
+        large = [(rect, leaf.colour) for rect, leaf
+                 in tree.iter_leaves((0, 0, 800, 600), (30, 20))]
+        self.assertEqual(large, [(rect, colour) for rect, colour in treemap
+                                 if rect[2] >= 30 and rect[3] >= 20])
+
+
+
+class ResizeTest(unittest.TestCase):
+    def test_repeated_steps_applied_at_once(self):
+        for method in ('increase_size', 'decrease_size'):
+            one_by_one = _SyntheticTree('leaf', [], 250)
+            parent = _SyntheticTree('node', [one_by_one])
+            at_once = _SyntheticTree('leaf', [], 250)
+            _SyntheticTree('node', [at_once])
+            for _ in range(300):
+                getattr(one_by_one, method)()
+            getattr(at_once, method)(300)
+            self.assertEqual(at_once.data_size, one_by_one.data_size)
+            self.assertEqual(at_once._parent_tree.data_size,
+                             parent.data_size)
+
+
+class DeleteTest(unittest.TestCase):
+    def test_deleted_subtrees_dropped(self):
+        leaves = [_SyntheticTree(str(i), [], 1) for i in range(10)]
+        tree = _SyntheticTree('node', leaves)
+        for leaf in leaves[:4]:
+            leaf.delete_node()
+        self.assertIs(tree._subtrees[0], leaves[0])
+        self.assertEqual(tree._tombstones, 4)
+        self.assertEqual(tree.data_size, 6)
+        leaves[4].delete_node()
+        self.assertEqual(tree._subtrees, leaves[5:])
+        self.assertEqual(tree.generate_treemap((0, 0, 60, 10))[0][0],
+                         (0, 0, 12, 10))
+
+    @given(integers(min_value=0, max_value=10000))
+    def test_delete_nodes_matches_delete_node(self, seed):
+        one_by_one = _random_tree(random.Random(seed), 4)
+        at_once = _random_tree(random.Random(seed), 4)
+        rng = random.Random(seed)
+        chosen = [rng.random() < 0.2 for _ in _all_nodes(one_by_one)]
+        for node, delete in zip(_all_nodes(one_by_one), chosen):
+            if delete:
+                node.delete_node()
+        at_once.delete_nodes([node for node, delete
+                              in zip(_all_nodes(at_once), chosen) if delete])
+        self.assertEqual(at_once.data_size, one_by_one.data_size)
+        screen = (0, 0, 300, 200)
+        self.assertEqual(
+            [rect for rect, _ in at_once.generate_treemap(screen)],
+            [rect for rect, _ in one_by_one.generate_treemap(screen)])
+
+    def test_clicks_in_a_frame_are_drawn_once(self):
+        leaves = [_SyntheticTree(str(i), [], 1) for i in range(4)]
+        tree = _SyntheticTree('node', leaves)
+        rect = treemap_visualiser.TREEMAP_RECT
+        screen = pygame.Surface(rect[2:])
+        for drawn, colour in tree.iter_treemap(rect):
+            screen.fill(colour, drawn)
+        changes = []
+        for x in (1, rect[2] - 1):
+            event = pygame.event.Event(pygame.MOUSEBUTTONUP, button=3,
+                                       pos=(x, 1))
+            treemap_visualiser._mouse_event(None, event, tree, None, changes)
+        self.assertEqual(tree._subtrees, leaves[1:3])
+        self.assertEqual(len(changes), 2)
+        for group in changes:
+            for drawn, colour in group:
+                screen.fill(colour, drawn)
+        expected = pygame.Surface(rect[2:])
+        for drawn, colour in tree.generate_treemap(rect):
+            expected.fill(colour, drawn)
+        self.assertEqual(pygame.image.tostring(screen, 'RGB'),
+                         pygame.image.tostring(expected, 'RGB'))
+
+
+class SizeBatchTest(unittest.TestCase):
+    def test_ancestors_updated_once(self):
+        leaves = [_SyntheticTree('leaf', [], 10) for _ in range(6)]
+        middle = _SyntheticTree('node', leaves[:3])
+        tree = _SyntheticTree('node', [middle] + leaves[3:])
+        batches = []
+        tree.add_listener(batches.append)
+        versions = (tree._version, middle._version)
+        with tree.batch() as batch:
+            for leaf in leaves:
+                leaf.offset_size(5)
+            leaves[0].offset_size(5)
+            self.assertEqual(tree.data_size, 60)
+        self.assertEqual(tree.data_size, 95)
+        self.assertEqual(middle.data_size, 50)
+        self.assertEqual((tree._version, middle._version),
+                         (versions[0] + 1, versions[1] + 1))
+        self.assertEqual(batches, [batch])
+        self.assertEqual(batch.resized[leaves[0]], 10)
+        self.assertEqual(batch.updated, [middle, tree])
+
+    def test_refresh_is_one_batch(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'B')
+        shutil.copytree(EXAMPLE_PATH, path)
+        tree = FileSystemTree(path)
+        batches = []
+        tree.add_listener(batches.append)
+        _write_file(os.path.join(path, 'A', 'f1.txt'), 3)
+        _write_file(os.path.join(path, 'A', 'f3.txt'), 4)
+        tree.refresh([os.path.join(path, 'A')])
+        tree.remove_listener(batches.append)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(tree.data_size, 22)
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(path)))
+
+    def test_batch_only_collects_its_own_tree(self):
+        leaf_a = _SyntheticTree('leaf', [], 10)
+        tree_a = _SyntheticTree('node', [leaf_a])
+        leaf_b = _SyntheticTree('leaf', [], 40)
+        tree_b = _SyntheticTree('node', [leaf_b])
+        with tree_a.batch() as batch:
+            leaf_b.offset_size(100)
+            self.assertEqual(tree_b.data_size, 140)
+            with tree_b.batch() as batch_b:
+                leaf_a.offset_size(5)
+                leaf_b.offset_size(1)
+                self.assertEqual(tree_b.data_size, 140)
+            self.assertEqual(tree_b.data_size, 141)
+            self.assertEqual(tree_a.data_size, 10)
+        self.assertEqual(tree_a.data_size, 15)
+        self.assertEqual(list(batch.resized), [leaf_a])
+        self.assertEqual(list(batch_b.resized), [leaf_b])
+        self.assertIsNone(tree_a._extras)
+        self.assertIsNone(tree_b._extras)
+
+    def test_listener_does_not_keep_tree(self):
+        tree = _SyntheticTree('node', [_SyntheticTree('leaf', [], 10)])
+        sizes = []
+
+        def listener(batch):
+            sizes.append(tree.data_size)
+        tree.add_listener(listener)
+        with tree.batch():
+            tree._subtrees[0].offset_size(5)
+        self.assertEqual(sizes, [15])
+        tree.remove_listener(listener)
+        self.assertIsNone(tree._extras)
+        # a listener that refers back to the tree it listens to
+        tree.add_listener(lambda batch, tree=tree: tree.data_size)
+        reference = weakref.ref(tree)
+        del tree
+        gc.collect()
+        self.assertIsNone(reference())
+
+
+class PopulationLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_world_bank_csv(self):
+        data = self._write('API.csv', (
+            '"Data Source","World Development Indicators",\n\n'
+            '"Last Updated Date","2016-10-01",\n\n'
+            '"Country Name","Country Code","Indicator Name","2013","2014",\n'
+            '"Canada","CAN","Population, total","35","36",\n'
+            '"World","WLD","Population, total","7000","7100",\n'
+            '"Chile","CHL","Population, total","17","",\n'
+            '"Mexico","MEX","Population, total","120","125",\n'))
+        metadata = self._write('Metadata.csv', (
+            '"Country Code","Region","IncomeGroup",\n'
+            '"CAN","North America","High income",\n'
+            '"MEX","Latin America & Caribbean","Upper middle income",\n'
+            '"WLD","","",\n'))
+        tree = population.load_world_bank_csv(data, metadata, 2014)
+        self.assertEqual(_tree_shape(tree), (
+            'World', 161,
+            (('North America', 36, (('Canada', 36, ()),)),
+             ('Latin America & Caribbean', 125, (('Mexico', 125, ()),)))))
+
+    def test_world_bank_json_streamed(self):
+        countries = self._write('countries.json', json.dumps([
+            {'page': 1},
+            [{'id': 'CAN', 'iso2Code': 'CA', 'name': 'Canada',
+              'region': {'value': 'North America'}},
+             {'id': 'WLD', 'iso2Code': '1W', 'name': 'World',
+              'region': {'value': 'Aggregates'}}]]))
+        data = self._write('population.json', json.dumps([
+            {'page': 1},
+            [{'country': {'id': '1W', 'value': 'World'}, 'value': '7000'},
+             {'country': {'id': 'CA', 'value': 'Canada'}, 'value': '35'},
+             {'country': {'id': 'XK', 'value': 'Kosovo'}, 'value': '2'},
+             {'country': {'id': 'ZZ', 'value': 'Nowhere'},
+              'value': None}]]))
+        tree = population.load_world_bank_json(data, countries)
+        self.assertEqual(_tree_shape(tree), (
+            'World', 37, (('North America', 35, (('Canada', 35, ()),)),
+                          ('Unknown region', 2, (('Kosovo', 2, ()),)))))
+
+    def test_json_objects_across_chunks(self):
+        values = [{'n': i, 's': 'x' * i} for i in range(20)]
+        path = self._write('values.json', json.dumps([{}, values]))
+        with open(path) as f:
+            self.assertEqual(
+                list(population._iter_json_objects(f, chunk_size=7)),
+                [{}] + values)
+
+    def test_csv_groups(self):
+        path = self._write('cities.csv', (
+            'Country,Province,City,Population\n'
+            'Canada,Ontario,Toronto,2700\n'
+            'Canada,Quebec,Montreal,1700\n'
+            'Canada,Ontario,Ottawa,900\n'
+            'France,Ile-de-France,Paris,2200\n'
+            'France,Ile-de-France,Nowhere,\n'))
+        tree = population.load_csv(path, 'City', 'Population',
+                                   ('Country', 'Province'))
+        ontario = ('Ontario', 3600, (('Toronto', 2700, ()),
+                                     ('Ottawa', 900, ())))
+        quebec = ('Quebec', 1700, (('Montreal', 1700, ()),))
+        france = ('France', 2200,
+                  (('Ile-de-France', 2200, (('Paris', 2200, ()),)),))
+        self.assertEqual(_tree_shape(tree), (
+            'World', 7500, (('Canada', 5300, (ontario, quebec)), france)))
+
+
+
+class DataSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixtures = os.path.join(self.directory, 'fixtures')
+        data_sources.FixtureSource.save(self.fixtures, {
+            population.WORLD_BANK_REGIONS: json.dumps([{}, [
+                {'id': 'CAN', 'iso2Code': 'CA', 'name': 'Canada',
+                 'region': {'value': 'North America'}}]]).encode(),
+            population.WORLD_BANK_POPULATIONS: json.dumps([{}, [
+                {'country': {'id': 'CA', 'value': 'Canada'},
+                 'value': '35'}]]).encode()})
+        self.fixture = _RecordingSource(self.fixtures)
+        self.requests = self.fixture.requests
+        self.source = data_sources.CachedSource(
+            self.fixture, os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_population_tree_from_fixtures(self):
+        source = population.DATA_SOURCE
+        population.DATA_SOURCE = self.source
+        try:
+            tree = population.PopulationTree(True)
+        finally:
+            population.DATA_SOURCE = source
+        self.assertEqual(_tree_shape(tree), (
+            'World', 35, (('North America', 35, (('Canada', 35, ()),)),)))
+
+    def test_fresh_response_not_requested_again(self):
+        url = population.WORLD_BANK_REGIONS
+        body = self.source.get(url)
+        self.assertEqual(self.source.get(url), body)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_stale_response_revalidated(self):
+        url = population.WORLD_BANK_REGIONS
+        body = self.source.get(url)
+        self.source.max_age = 0
+        self.assertEqual(self.source.get(url), body)
+        self.assertIn('If-None-Match', self.requests[-1])
+
+    def test_stale_response_used_offline(self):
+        url = population.WORLD_BANK_REGIONS
+        body = self.source.get(url)
+        shutil.rmtree(self.fixtures)
+        os.makedirs(self.fixtures)
+        with open(os.path.join(self.fixtures, 'index.json'), 'w') as f:
+            f.write('{}')
+        offline = data_sources.CachedSource(
+            data_sources.FixtureSource(self.fixtures), self.source.directory,
+            max_age=0)
+        self.assertEqual(offline.get(url), body)
+        with self.assertRaises(OSError):
+            offline.get(population.WORLD_BANK_BASE)
+
+class TextRenderTest(unittest.TestCase):
+    def setUp(self):
+        pygame.font.init()
+
+    def test_rendered_text_reused(self):
+        first = text_render.render_text('f1.txt', 'Consolas', 12, (0, 0, 0))
+        second = text_render.render_text('f1.txt', 'Consolas', 12, (0, 0, 0))
+        self.assertIs(first, second)
+        self.assertIs(text_render.get_font('Consolas', 12),
+                      text_render.get_font('Consolas', 12))
+
+    def test_undecodable_name(self):
+        surface = text_render.render_text('f\udcff', 'Consolas', 12,
+                                          (0, 0, 0))
+        self.assertGreater(surface.get_width(), 0)
+
+class LayoutCacheTest(unittest.TestCase):
+    def test_changes_repaint_treemap(self):
+        rng = random.Random(148)
+        screen = (0, 0, 60, 40)
+        for _ in range(20):
+            tree = _random_tree(rng, 4)
+            canvas = _paint({}, tree.iter_treemap(screen))
+            for _ in range(10):
+                leaves = [leaf for _, leaf in tree._iter_leaves(screen)]
+                if not leaves:
+                    break
+                leaf = rng.choice(leaves)
+                if rng.random() < 0.3:
+                    leaf.delete_node()
+                else:
+                    leaf.offset_size(rng.randint(1, 500))
+                if tree.data_size == 0:
+                    canvas = {}
+                canvas = _paint(canvas, tree.iter_treemap_changes(screen))
+                self.assertEqual(canvas,
+                                 _paint({}, tree.iter_treemap(screen)))
+
+    def test_clean_subtrees_skipped(self):
+        a1, a2 = _SyntheticTree('a1', [], 500), _SyntheticTree('a2', [], 500)
+        b1, b2 = _SyntheticTree('b1', [], 495), _SyntheticTree('b2', [], 495)
+        tree = _SyntheticTree('root', [_SyntheticTree('a', [a1, a2]),
+                                       _SyntheticTree('b', [b1, b2])])
+        screen = (0, 0, 100, 50)
+        self.assertEqual(len(list(tree.iter_treemap_changes(screen))), 4)
+        self.assertEqual(list(tree.iter_treemap_changes(screen)), [])
+
+        # neither a nor b2 moves, so only b1 is laid out again
+        b1.offset_size(10)
+        self.assertEqual(list(tree.iter_treemap_changes(screen)),
+                         [((50, 0, 50, 25), b1.colour)])
+
+
+class ReturnSelectedTreeTest(unittest.TestCase):
+    def test_matches_linear_scan(self):
+        rng = random.Random(2016)
+        for _ in range(20):
+            tree = _random_tree(rng, 4)
+            screen = (0, 0, rng.randint(0, 300), rng.randint(0, 300))
+            leaves = list(tree._iter_leaves(screen))
+            for _ in range(50):
+                point = (rng.randint(-1, 301), rng.randint(-1, 301))
+                expected = None
+                for rect, leaf in leaves:
+                    if rect[0] <= point[0] <= rect[0] + rect[2] and \
+                            rect[1] <= point[1] <= rect[1] + rect[3]:
+                        expected = leaf
+                        break
+                self.assertIs(tree.return_selected_tree(point, screen),
+                              expected)
+
+    def test_index_rebuilt_after_delete(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        _sort_subtrees(tree)
+        screen = (0, 0, 800, 1000)
+        folder_a = tree._subtrees[0]
+        f1 = tree.return_selected_tree((10, 10), screen)
+        self.assertIs(f1, folder_a._subtrees[0])
+
+        f1.delete_node()
+        # f2 and f3 now share all of A's width
+        f2 = tree.return_selected_tree((10, 10), screen)
+        # the deleted f1 is left in place as an empty tree
+        self.assertIs(f2, folder_a._subtrees[1])
+        self.assertEqual(f2._root, 'f2.txt')
+
+
+class LayoutEngineTest(unittest.TestCase):
+    def test_numpy_engine_example_data(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        self.assertEqual(tree.generate_treemap((0, 0, 800, 1000), 'numpy'),
+                         tree.generate_treemap((0, 0, 800, 1000)))
+
+    @given(integers(min_value=0, max_value=10000),
+           integers(min_value=0, max_value=1000),
+           integers(min_value=0, max_value=1000))
+    def test_numpy_engine_random_trees(self, seed, width, height):
+        tree = _random_tree(random.Random(seed), 4)
+        self.assertEqual(
+            tree.generate_treemap((5, 7, width, height), 'numpy'),
+            tree.generate_treemap((5, 7, width, height)))
+
+    def test_numpy_engine_flattens_once(self):
+        tree = _random_tree(random.Random(5), 4)
+        screen = (0, 0, 300, 200)
+        tree.generate_treemap(screen, 'numpy')
+        flat_tree = tree._extras['flat tree'][1]
+        tree.generate_treemap(screen, 'numpy')
+        self.assertIs(tree._extras['flat tree'][1], flat_tree)
+
+        leaf = _leaves(tree)[0]
+        leaf.offset_size(1000)
+        self.assertEqual(tree.generate_treemap(screen, 'numpy'),
+                         tree.generate_treemap(screen))
+        self.assertIsNot(tree._extras['flat tree'][1], flat_tree)
+        leaf.colour = (1, 2, 3)
+        self.assertIn((1, 2, 3), [colour for _, colour
+                                  in tree.generate_treemap(screen, 'numpy')])
+        self.assertEqual(tree.generate_treemap(screen, 'numpy'),
+                         tree.generate_treemap(screen))
+        tree.set_layout(layouts.SQUARIFIED)
+        with self.assertRaises(ValueError):
+            tree.generate_treemap(screen, 'numpy')
+
+    def test_unknown_engine(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        with self.assertRaises(ValueError):
+            tree.generate_treemap((0, 0, 800, 1000), 'fortran')
+
+
+class LayoutAlgorithmTest(unittest.TestCase):
+    def test_layout_does_not_keep_tree(self):
+        tree = _SyntheticTree('root', [_SyntheticTree('leaf', [], 1)])
+        tree.set_layout(layouts.SQUARIFIED)
+        self.assertIs(tree.get_layout(), layouts.SQUARIFIED)
+        tree.set_layout(layouts.SLICE_AND_DICE)
+        self.assertIsNone(tree._extras)
+        tree.set_layout(layouts.STRIP)
+        reference = weakref.ref(tree)
+        del tree
+        gc.collect()
+        self.assertIsNone(reference())
+
+    @given(integers(min_value=0, max_value=10000),
+           integers(min_value=0, max_value=60),
+           integers(min_value=0, max_value=60))
+    def test_leaves_tile_rectangle(self, seed, width, height):
+        rng = random.Random(seed)
+        for layout in layouts.LAYOUTS.values():
+            tree = _wide_random_tree(rng)
+            tree.set_layout(layout)
+            covered = {}
+            for (x, y, w, h), _ in tree.generate_treemap((2, 3, width,
+                                                          height)):
+                for pixel in [(i, j) for i in range(x, x + w)
+                              for j in range(y, y + h)]:
+                    covered[pixel] = covered.get(pixel, 0) + 1
+            self.assertEqual(len(covered),
+                             width * height if tree.data_size > 0 else 0)
+            self.assertEqual(set(covered.values()) - {1}, set())
+
+    @given(integers(min_value=0, max_value=10000),
+           integers(min_value=0, max_value=80),
+           integers(min_value=0, max_value=80))
+    def test_selected_tree_matches_linear_scan(self, seed, width, height):
+        rng = random.Random(seed)
+        for layout in layouts.LAYOUTS.values():
+            tree = _wide_random_tree(rng)
+            tree.set_layout(layout)
+            screen = (1, 2, width, height)
+            leaves = list(tree.iter_leaves(screen))
+            for _ in range(20):
+                point = (rng.randint(0, 82), rng.randint(0, 82))
+                expected = None
+                for rect, leaf in leaves:
+                    if rect[0] <= point[0] <= rect[0] + rect[2] and \
+                            rect[1] <= point[1] <= rect[1] + rect[3]:
+                        expected = leaf
+                        break
+                self.assertIs(tree.return_selected_tree(point, screen),
+                              expected)
+
+    def test_squarified_is_squarer(self):
+        def worst_ratio(layout):
+            tree = benchmarks.wide_tree(500)
+            tree.set_layout(layout)
+            return max(max(w, h) / max(min(w, h), 1) for (_, _, w, h), _
+                       in tree.generate_treemap((0, 0, 1000, 800)))
+        self.assertLess(worst_ratio(layouts.SQUARIFIED), 10)
+        self.assertLess(worst_ratio(layouts.STRIP),
+                        worst_ratio(layouts.SLICE_AND_DICE))
+
+    def test_strip_keeps_order(self):
+        tree = benchmarks.wide_tree(200)
+        tree.set_layout(layouts.STRIP)
+        self.assertEqual([leaf for _, leaf in tree.iter_leaves((0, 0, 400,
+                                                                300))],
+                         tree._subtrees)
+
+    def test_changing_layout_redraws_everything(self):
+        tree = benchmarks.deep_tree(64)
+        treemap = tree.generate_treemap((0, 0, 400, 300))
+        self.assertEqual(list(tree.iter_treemap_changes((0, 0, 400, 300))),
+                         [])
+        tree.set_layout(layouts.SQUARIFIED)
+        self.assertEqual(len(list(tree.iter_treemap_changes(
+            (0, 0, 400, 300)))), len(treemap))
+        tree.set_layout(layouts.SLICE_AND_DICE)
+        self.assertEqual(tree.generate_treemap((0, 0, 400, 300)), treemap)
+
+    def test_selected_tree_follows_layout(self):
+        tree = benchmarks.wide_tree(50)
+        tree.return_selected_tree((10, 10), (0, 0, 400, 300))
+        tree.set_layout(layouts.SQUARIFIED)
+        rect, leaf = next(iter(tree.iter_leaves((0, 0, 400, 300))))
+        self.assertIs(tree.return_selected_tree(
+            (rect[0] + rect[2] // 2, rect[1] + rect[3] // 2),
+            (0, 0, 400, 300)), leaf)
+
+    def test_numpy_engine_needs_slice_and_dice(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        tree.set_layout(layouts.STRIP)
+        with self.assertRaises(ValueError):
+            tree.generate_treemap((0, 0, 800, 1000), 'numpy')
+
+    def test_benchmark(self):
+        layout_time, query_time = benchmarks.time_layout(
+            benchmarks.deep_tree(100), layouts.SQUARIFIED, queries=10)
+        self.assertGreaterEqual(layout_time, 0)
+        self.assertGreaterEqual(query_time, 0)
+
+
+class LevelOfDetailTest(unittest.TestCase):
+    def test_small_subtrees_drawn_whole(self):
+        tree = benchmarks.deep_tree(4096)
+        tree.set_lod_area(100)
+        treemap = list(tree.iter_leaves((0, 0, 320, 240)))
+        self.assertLess(len(treemap), 4096)
+        for (x, y, width, height), node in treemap:
+            if node._subtrees != []:
+                self.assertLess(width * height, 100)
+        self.assertEqual(sum(node.data_size for _, node in treemap),
+                         tree.data_size)
+
+    def test_unseen_subtrees_change_nothing(self):
+        tree = benchmarks.wide_tree(3000)
+        tree = _SyntheticTree('root', [tree, benchmarks.deep_tree(3000)])
+        pixels = raster.rasterise_tree(tree, (0, 0, 200, 100))
+        tree.set_lod_area(1)
+        self.assertLess(len(tree.generate_treemap((0, 0, 200, 100))), 6000)
+        self.assertTrue((raster.rasterise_tree(tree, (0, 0, 200, 100)) ==
+                         pixels).all())
+
+    def test_lod_area_does_not_keep_tree(self):
+        tree = _SyntheticTree('root', [_SyntheticTree('leaf', [], 1)])
+        tree.set_lod_area(4)
+        self.assertEqual(tree.get_lod_area(), 4)
+        tree.set_lod_area(0)
+        self.assertIsNone(tree._extras)
+        tree.set_lod_area(4)
+        reference = weakref.ref(tree)
+        del tree
+        gc.collect()
+        self.assertIsNone(reference())
+
+    @given(integers(min_value=0, max_value=10000),
+           integers(min_value=0, max_value=300),
+           integers(min_value=0, max_value=300),
+           integers(min_value=0, max_value=500))
+    def test_numpy_engine(self, seed, width, height, min_area):
+        tree = _random_tree(random.Random(seed), 5)
+        tree.set_lod_area(min_area)
+        self.assertEqual(
+            tree.generate_treemap((5, 7, width, height), 'numpy'),
+            tree.generate_treemap((5, 7, width, height)))
+
+    def test_selected_tree_is_subtree_drawn(self):
+        rng = random.Random(20)
+        for _ in range(20):
+            tree = _random_tree(rng, 5)
+            tree.set_lod_area(rng.choice([1, 50, 400]))
+            screen = (0, 0, rng.randint(0, 100), rng.randint(0, 100))
+            drawn = list(tree.iter_leaves(screen))
+            for _ in range(50):
+                point = (rng.randint(0, 100), rng.randint(0, 100))
+                expected = None
+                for rect, node in drawn:
+                    if rect[0] <= point[0] <= rect[0] + rect[2] and \
+                            rect[1] <= point[1] <= rect[1] + rect[3]:
+                        expected = node
+                        break
+                self.assertIs(tree.return_selected_tree(point, screen),
+                              expected)
+
+    def test_changes_repaint_treemap(self):
+        rng = random.Random(1)
+        screen = (0, 0, 60, 40)
+        for _ in range(20):
+            tree = _random_tree(rng, 5)
+            canvas = _paint({}, tree.iter_treemap(screen))
+            for _ in range(10):
+                leaves = [node for node in _all_nodes(tree)
+                          if node._subtrees == [] and node.data_size > 0]
+                if not leaves:
+                    break
+                if rng.random() < 0.3:
+                    tree.set_lod_area(rng.choice([0, 1, 20, 200]))
+                else:
+                    rng.choice(leaves).offset_size(rng.randint(1, 500))
+                canvas = _paint(canvas, tree.iter_treemap_changes(screen))
+                self.assertEqual(canvas,
+                                 _paint({}, tree.iter_treemap(screen)))
+
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_generated_trees(self):
+        for shape, generate in benchmarks.SHAPES.items():
+            for leaves in [1, 2, 7, 8, 1000]:
+                tree = generate(leaves, 3)
+                sizes = [node.data_size for node in _all_nodes(tree)
+                         if node._subtrees == []]
+                self.assertEqual(len(sizes), leaves, shape)
+                self.assertEqual(sum(sizes), tree.data_size)
+                self.assertEqual(_tree_shape(generate(leaves, 3)),
+                                 _tree_shape(tree))
+
+    def test_skewed_tree_is_deep(self):
+        tree = benchmarks.skewed_tree(700)
+        depth = 0
+        while tree._subtrees != []:
+            tree = tree._subtrees[-1]
+            depth += 1
+        self.assertEqual(depth, 100)
+
+    def test_fixture(self):
+        root = benchmarks.write_fixture(self.directory, 200)
+        tree = FileSystemTree(root)
+        self.assertEqual(len([node for node in _all_nodes(tree)
+                              if node._subtrees == [] and
+                              node._root.startswith('f')]), 200)
+
+    def test_results_round_trip(self):
+        results = benchmarks.benchmark_tree('zipf', 100,
+                                            ('strip', 'slice-and-dice'))
+        results += benchmarks.benchmark_scan(50, (2,))
+        self.assertEqual(
+            {result['benchmark'] for result in results},
+            {'construct', 'generate_treemap', 'leaf_dictionary',
+             'return_selected_tree', 'offset_size', 'delete_node', 'scan',
+             'generate_treemap_warm', 'generate_treemap_numpy',
+             'generate_treemap_numpy_warm'})
+        path = os.path.join(self.directory, 'results.json')
+        benchmarks.write_results(results, path)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['results'], results)
+
+    def test_compare_results(self):
+        old = benchmarks.benchmark_tree('wide', 10, ('squarified',))
+        new = [dict(result) for result in old]
+        new[1]['seconds'] = old[1]['seconds'] * 2 + 1
+        new[2]['seconds'] = old[2]['seconds'] * 1.1
+        self.assertEqual(benchmarks.compare_results(old, new),
+                         [(old[1], new[1])])
+        self.assertEqual(benchmarks.compare_results(old, old[1:2] + new[3:]),
+                         [])
+
+
+class RasteriseTest(unittest.TestCase):
+    @given(integers(min_value=0, max_value=10000),
+           integers(min_value=0, max_value=200),
+           integers(min_value=0, max_value=200))
+    def test_matches_drawing_each_rectangle(self, seed, width, height):
+        tree = _random_tree(random.Random(seed), 4)
+        treemap = tree.generate_treemap((3, 2, width, height))
+        expected = numpy.zeros((width, height, 3), dtype=numpy.uint8)
+        for (x, y, w, h), colour in treemap:
+            expected[x - 3:x - 3 + w, y - 2:y - 2 + h] = colour
+        pixels = raster.rasterise([rect for rect, _ in treemap],
+                                  [colour for _, colour in treemap],
+                                  (3, 2, width, height))
+        self.assertTrue((pixels == expected).all())
+
+    def test_empty_and_clipped_rectangles(self):
+        pixels = raster.rasterise(
+            [(0, 0, 0, 5), (-2, -2, 4, 4), (3, 1, 5, 1)],
+            [(1, 1, 1), (2, 2, 2), (3, 3, 3)], (0, 0, 4, 3), (9, 9, 9))
+        self.assertEqual(pixels.shape, (4, 3, 3))
+        self.assertEqual(pixels[:, :, 0].tolist(),
+                         [[2, 2, 9], [2, 2, 9], [9, 9, 9], [9, 3, 9]])
+
+
+class BatchRenderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_image_matches_rasterised_treemap(self):
+        output = os.path.join(self.directory, 'B.png')
+        tree = FileSystemTree(EXAMPLE_PATH)
+        batch_render.render_tree(tree, output, (40, 30))
+        image = pygame.surfarray.array3d(pygame.image.load(output))
+        expected = raster.rasterise_tree(tree, (0, 0, 40, 30))
+        self.assertTrue((image == expected).all())
+
+    def test_jobs_in_process_pool(self):
+        roots = [EXAMPLE_PATH, os.path.join(EXAMPLE_PATH, 'A'),
+                 os.path.join(self.directory, 'missing')]
+        jobs = [batch_render.RenderJob(
+            root, os.path.join(self.directory, batch_render.output_name(root)),
+            (20, 10)) for root in roots]
+        results = dict((job.root, result) for job, result
+                       in batch_render.run_jobs(jobs, processes=2))
+        self.assertEqual(set(results), set(roots))
+        self.assertIsInstance(results[roots[2]], OSError)
+        for job in jobs[:2]:
+            self.assertGreaterEqual(results[job.root]['total'], 0)
+            self.assertTrue(os.path.isfile(job.output))
+
+
+class PathIndexTest(unittest.TestCase):
+    def test_get_path_and_find_path(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        leaf = tree.find_path('B\\A\\f2.txt')
+        self.assertEqual(leaf._root, 'f2.txt')
+        self.assertEqual(leaf.get_path(), 'B\\A\\f2.txt')
+        self.assertIs(tree.find_path(['B', 'A', 'f2.txt']), leaf)
+        self.assertIs(tree.find_path('B'), tree)
+        self.assertIsNone(tree.find_path('B\\A\\missing'))
+        self.assertIsNone(tree.find_path('C\\A'))
+        self.assertIs(leaf._parent_tree.find_path('A\\f2.txt'), leaf)
+
+    def test_index_does_not_keep_tree(self):
+        tree = _SyntheticTree('root', [_SyntheticTree('leaf', [], 1)])
+        leaf = tree.find_path(['root', 'leaf'])
+        self.assertIs(leaf._path_index(), tree._extras['path index'])
+        reference = weakref.ref(tree)
+        del tree, leaf
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_find_path_on_disk(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        path = os.path.abspath(os.path.join(EXAMPLE_PATH, 'A', 'f1.txt'))
+        self.assertIs(tree.find_path(path),
+                      tree.find_path(['B', 'A', 'f1.txt']))
+        self.assertIs(tree.find_path(os.path.abspath(EXAMPLE_PATH)), tree)
+        self.assertIsNone(tree.find_path(os.path.abspath('example-data')))
+
+    def test_index_follows_changes(self):
+        rng = random.Random(3)
+        for _ in range(30):
+            tree = _random_tree(rng, 4)
+            tree.find_path(['node'])
+            for _ in range(10):
+                nodes = [node for node in _all_nodes(tree)
+                         if not node.is_empty() and node is not tree]
+                if not nodes:
+                    break
+                node = rng.choice(nodes)
+                if rng.random() < 0.6:
+                    node.delete_node()
+                elif node._subtrees != []:
+                    node.add_subtree(_random_tree(rng, 2),
+                                     rng.randint(0, len(node._subtrees)))
+                for node in _all_nodes(tree):
+                    if not node.is_empty():
+                        names = _path_names(node)
+                        self.assertIs(tree.find_path(names),
+                                      _find_by_scan(tree, names))
+
+    def test_refresh_updates_index(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'B')
+        shutil.copytree(EXAMPLE_PATH, path)
+        tree = FileSystemTree(path)
+        self.assertIsNotNone(tree.find_path(['B', 'A', 'f2.txt']))
+        os.remove(os.path.join(path, 'A', 'f2.txt'))
+        _write_file(os.path.join(path, 'A', 'f5.txt'), 3)
+        tree.refresh([os.path.join(path, 'A')])
+        self.assertIsNone(tree.find_path(['B', 'A', 'f2.txt']))
+        self.assertEqual(tree.find_path(['B', 'A', 'f5.txt']).data_size, 3)
+
+
+class LargestTest(unittest.TestCase):
+    def test_statistics_follow_changes(self):
+        rng = random.Random(4)
+        for _ in range(30):
+            tree = _random_tree(rng, 4)
+            for _ in range(10):
+                leaves = _leaves(tree)
+                self.assertEqual(tree.get_leaf_count(), len(leaves))
+                self.assertEqual(tree.get_max_leaf_size(), max(
+                    [leaf.data_size for leaf in leaves] + [0]))
+                nodes = [node for node in _all_nodes(tree)
+                         if not node.is_empty() and node is not tree]
+                if not nodes:
+                    break
+                choice = rng.random()
+                if choice < 0.3:
+                    rng.choice(nodes).delete_node()
+                elif choice < 0.5:
+                    with tree.batch():
+                        for node in rng.sample(nodes, min(3, len(nodes))):
+                            if node._subtrees == []:
+                                node.offset_size(rng.randint(
+                                    -node.data_size, 1000))
+                elif choice < 0.7:
+                    parent = rng.choice(nodes)
+                    if parent._subtrees != []:
+                        parent.add_subtree(_random_tree(rng, 2))
+                else:
+                    node = rng.choice(nodes)
+                    if node._subtrees == []:
+                        node.offset_size(rng.randint(-node.data_size, 1000))
+
+    def test_largest_leaves(self):
+        rng = random.Random(5)
+        for _ in range(30):
+            tree = _random_tree(rng, 5)
+            sizes = sorted((leaf.data_size for leaf in _leaves(tree)),
+                           reverse=True)
+            for k in [0, 1, 3, 20]:
+                largest = tree.largest_leaves(k)
+                self.assertEqual([leaf.data_size for leaf in largest],
+                                 sizes[:k])
+                for leaf in largest:
+                    self.assertEqual(leaf._subtrees, [])
+
+    def test_largest_subtrees(self):
+        rng = random.Random(6)
+        for _ in range(30):
+            tree = _random_tree(rng, 5)
+            sizes = sorted((node.data_size for node in _all_nodes(tree)
+                            if node._subtrees != [] and node is not tree),
+                           reverse=True)
+            for k in [0, 1, 3, 20]:
+                self.assertEqual([node.data_size for node
+                                  in tree.largest_subtrees(k)], sizes[:k])
+
+    def test_search_is_pruned(self):
+        tree = benchmarks.deep_tree(2 ** 14)
+        tree.get_leaf_count()
+        stats = instrumentation.STATS
+        stats.enabled = True
+        self.addCleanup(stats.reset)
+        try:
+            largest = tree.largest_leaves(10)
+        finally:
+            stats.enabled = False
+        self.assertEqual(largest[0].data_size, tree.get_max_leaf_size())
+        # 10 paths of depth 14, each visiting both subtrees of every node
+        self.assertLessEqual(stats.counters['top-k visited'].last,
+                             10 * 2 * 15)
+
+    def test_batch_that_cancels_out_repaints(self):
+        tree = benchmarks.wide_tree(10)
+        tree = _SyntheticTree('root', [tree, benchmarks.wide_tree(3)])
+        screen = (0, 0, 200, 100)
+        canvas = _paint({}, tree.iter_treemap(screen))
+        leaves = tree._subtrees[0]._subtrees
+        moved = leaves[3].data_size - 1
+        with tree.batch():
+            leaves[0].offset_size(moved)
+            leaves[3].offset_size(-moved)
+        # the numpy engine keeps no cached layout
+        self.assertTrue(
+            _paint(canvas, tree.iter_treemap_changes(screen)) ==
+            _paint({}, tree.generate_treemap(screen, 'numpy')))
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        instrumentation.STATS.reset()
+        instrumentation.STATS.enabled = True
+
+    def tearDown(self):
+        instrumentation.STATS.enabled = False
+        instrumentation.STATS.reset()
+        shutil.rmtree(self.directory)
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram()
+        for value in [0, 1, 3, 5, 100]:
+            histogram.add(value)
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.mean(), 109 / 5)
+        self.assertEqual((histogram.last, histogram.max), (100, 100))
+        self.assertEqual(histogram.percentile(0.5), 4)
+        self.assertEqual(histogram.percentile(1), 100)
+
+    def test_disabled_stats_keep_nothing(self):
+        stats = instrumentation.Stats()
+        with stats.timer('phase'):
+            stats.count('nodes', 5)
+        self.assertEqual((stats.timings, stats.counters), ({}, {}))
+
+    def test_tree_operations_are_counted(self):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        treemap = tree.generate_treemap((0, 0, 800, 1000))
+        tree.return_selected_tree((10, 10), (0, 0, 800, 1000))
+        stats = instrumentation.STATS
+        self.assertEqual(set(stats.timings), {
+            'scan', 'build tree', 'generate_treemap', 'return_selected_tree'})
+        self.assertEqual(stats.counters['rects emitted'].last, len(treemap))
+        self.assertEqual(stats.counters['nodes visited'].last,
+                         len(_all_nodes(tree)))
+        self.assertGreater(stats.counters['hit test depth'].last, 0)
+
+    def test_batch_render_stats(self):
+        path = os.path.join(self.directory, 'stats.json')
+        self.assertEqual(batch_render.main(
+            ['--output-dir', self.directory, '--width', '20', '--height',
+             '10', '--processes', '1', '--stats', path, EXAMPLE_PATH,
+             os.path.join(EXAMPLE_PATH, 'A')]), 0)
+        with open(path) as f:
+            saved = json.load(f)
+        self.assertEqual(saved['timings']['scan']['count'], 2)
+        self.assertEqual(saved['timings']['rasterise']['count'], 2)
+        stats = instrumentation.Stats()
+        stats.merge(saved)
+        stats.merge(saved)
+        self.assertEqual(stats.to_dict()['counters']['rects emitted']['total'],
+                         2 * saved['counters']['rects emitted']['total'])
+
+
+class LinkSafeScanTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'B')
+        shutil.copytree(EXAMPLE_PATH, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_symlink_loop_is_not_followed(self):
+        os.symlink(self.path, os.path.join(self.path, 'A', 'loop'))
+        for tree in [FileSystemTree(self.path),
+                     FileSystemTree(self.path, workers=4)]:
+            loop = tree.find_path(['B', 'A', 'loop'])
+            self.assertEqual(loop._subtrees, [])
+            self.assertIsNotNone(loop._mtime)
+            self.assertEqual(tree.data_size, 40)
+        lazy = FileSystemTree(self.path, lazy_depth=0)
+        self.assertEqual(lazy.data_size, 40)
+
+    def test_symlinked_sibling_is_counted_once(self):
+        os.symlink(os.path.join(self.path, 'A'),
+                   os.path.join(self.path, 'link'))
+        for tree in [FileSystemTree(self.path),
+                     FileSystemTree(self.path, workers=4),
+                     FileSystemTree(self.path, lazy_depth=0)]:
+            self.assertEqual(tree.data_size, 40)
+            self.assertEqual(
+                sorted(subtree.data_size for subtree in tree._subtrees),
+                [0, 10, 30])
+        # the directory itself comes first in order, so it is counted
+        for tree in [FileSystemTree(self.path),
+                     FileSystemTree(self.path, lazy_depth=0)]:
+            self.assertEqual(tree.find_path(['B', 'A']).data_size, 30)
+            self.assertEqual(tree.find_path(['B', 'link']).data_size, 0)
+
+    def test_hard_links_are_sized_once(self):
+        os.link(os.path.join(self.path, 'A', 'f1.txt'),
+                os.path.join(self.path, 'link.txt'))
+        serial = FileSystemTree(self.path)
+        self.assertEqual(serial.data_size, 40)
+        # the first link in path order keeps the size
+        self.assertEqual(serial.find_path(['B', 'link.txt']).data_size, 15)
+        self.assertEqual(serial.find_path(['B', 'A', 'f1.txt']).data_size, 0)
+        self.assertEqual(_tree_shape(FileSystemTree(self.path, workers=4)),
+                         _tree_shape(serial))
+        self.assertEqual(FileSystemTree(self.path, lazy_depth=0).data_size,
+                         40)
+
+    def test_hard_links_stay_sized_once(self):
+        os.link(os.path.join(self.path, 'A', 'f1.txt'),
+                os.path.join(self.path, 'link.txt'))
+        folders = [self.path, os.path.join(self.path, 'A')]
+        tree = FileSystemTree(self.path)
+        for _ in range(2):
+            for folder in folders:
+                _bump_mtime(folder)
+            tree.refresh()
+            self.assertEqual(tree.data_size, 40)
+            tree.refresh(folders)
+            self.assertEqual(tree.data_size, 40)
+
+        lazy = FileSystemTree(self.path, lazy_depth=0)
+        lazy.find_path(['B', 'A']).expand()
+        self.assertEqual(lazy.data_size, 40)
+        self.assertEqual(_tree_shape(lazy), _tree_shape(tree))
+
+    def test_device_kept_for_later_reads(self):
+        tree = FileSystemTree(self.path, one_file_system=True)
+        self.assertEqual(tree._scan_state()[0], os.stat(self.path).st_dev)
+        lazy = FileSystemTree(self.path, lazy_depth=0)
+        self.assertIsNone(lazy.find_path(['B', 'A'])._scan_state()[0])
+
+    def test_broken_symlink(self):
+        os.symlink(os.path.join(self.path, 'missing'),
+                   os.path.join(self.path, 'A', 'dangling'))
+        tree = FileSystemTree(self.path)
+        self.assertEqual(tree.find_path(['B', 'A', 'dangling']).data_size, 0)
+        self.assertEqual(tree.data_size, 40)
+
+    def test_other_device_is_not_read(self):
+        device = os.stat(self.path).st_dev
+        self.assertEqual(len(fs_scan.read_directory(self.path,
+                                                    device).entries), 2)
+        self.assertEqual(fs_scan.read_directory(self.path,
+                                                device + 1).entries, [])
+        tree = FileSystemTree(self.path, one_file_system=True)
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(self.path)))
+
+    def test_budget_leaves_partial_tree(self):
+        budget = fs_scan.ScanBudget(max_entries=1)
+        tree = FileSystemTree(self.path, workers=4, budget=budget)
+        self.assertTrue(budget.exhausted)
+        self.assertEqual(budget.entries, 2)
+        placeholder = tree.find_path(['B', 'A'])
+        self.assertTrue(placeholder._lazy)
+        self.assertEqual(tree.data_size, 10)
+
+        tree.refresh()
+        self.assertEqual(tree.data_size, 40)
+        placeholder.expand()
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(self.path)))
+
+    def test_budget_already_exhausted(self):
+        budget = fs_scan.ScanBudget(max_entries=1)
+        FileSystemTree(self.path, budget=budget)
+        self.assertTrue(budget.exhausted)
+        tree = FileSystemTree(self.path, workers=4, budget=budget)
+        self.assertEqual([subtree._root for subtree in tree._subtrees],
+                         ['A', 'f4.txt'])
+        self.assertTrue(tree._subtrees[0]._lazy)
+        self.assertEqual(tree.data_size, 10)
+
+    def test_budget_not_exhausted(self):
+        budget = fs_scan.ScanBudget(max_entries=100, max_seconds=60)
+        tree = FileSystemTree(self.path, budget=budget)
+        self.assertFalse(budget.exhausted)
+        self.assertEqual(budget.entries, 5)
+        self.assertEqual(_tree_shape(tree),
+                         _tree_shape(FileSystemTree(self.path)))
+
+
+##############################################################################
+# Helpers to build synthetic trees
+##############################################################################
+class _SyntheticTree(AbstractTree):
+    """A minimal concrete AbstractTree used to build test trees."""
+    def get_separator(self):
+        return '/'
+
+
+def _random_tree(rng, depth):
+    """Return a random tree of at most the given depth.
+
+    Some of the leaves have data_size 0, and some subtrees are empty.
+
+    @type rng: random.Random
+    @type depth: int
+    @rtype: _SyntheticTree
+    """
+    if depth == 0 or rng.random() < 0.3:
+        if rng.random() < 0.05:
+            return _SyntheticTree(None, [])
+        return _SyntheticTree('leaf', [], rng.choice([0, 1, 7, 100, 12345]))
+    subtrees = [_random_tree(rng, depth - 1)
+                for _ in range(rng.randint(1, 5))]
+    return _SyntheticTree('node', subtrees)
+
+
+def _wide_random_tree(rng):
+    """Return a random tree of depth 2 with many subtrees per node.
+
+    Some of the leaves have data_size 0, and some subtrees are empty.
+
+    @type rng: random.Random
+    @rtype: _SyntheticTree
+    """
+    def leaf():
+        if rng.random() < 0.05:
+            return _SyntheticTree(None, [])
+        return _SyntheticTree('leaf', [], rng.choice(
+            [0, 1, 7, 100, rng.randint(1, 100000)]))
+    return _SyntheticTree('node', [
+        _SyntheticTree('node', [leaf() for _ in range(rng.randint(1, 30))])
+        if rng.random() < 0.3 else leaf()
+        for _ in range(rng.randint(1, 30))])
+
+
+def _leaves(tree):
+    """Return every non-empty leaf of <tree>.
+
+    @type tree: AbstractTree
+    @rtype: list[AbstractTree]
+    """
+    return [node for node in _all_nodes(tree)
+            if node._subtrees == [] and not node.is_empty()]
+
+
+def _path_names(tree):
+    """Return the names of the trees from the root of <tree> down to it.
+
+    @type tree: AbstractTree
+    @rtype: list[object]
+    """
+    names = []
+    while tree is not None:
+        names.append(tree._root)
+        tree = tree._parent_tree
+    return names[::-1]
+
+
+def _find_by_scan(tree, names):
+    """Return the tree at the path <names> below <tree>, taking the first
+    non-empty subtree with each name, or None if there is none.
+
+    @type tree: AbstractTree
+    @type names: list[object]
+    @rtype: AbstractTree | None
+    """
+    if tree._root != names[0]:
+        return None
+    for name in names[1:]:
+        for subtree in tree._subtrees:
+            if subtree._root == name and not subtree.is_empty():
+                tree = subtree
+                break
+        else:
+            return None
+    return tree
+
+
+class _RecordingSource(data_sources.FixtureSource):
+    """A FixtureSource that records the headers of every request."""
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.requests = []
+
+    def fetch(self, url, headers=None):
+        self.requests.append(headers)
+        return super().fetch(url, headers)
+
+
+def _tree_shape(tree):
+    """Return the names and sizes of <tree> as nested tuples.
+
+    @type tree: AbstractTree
+    @rtype: tuple
+    """
+    return (tree._root, tree.data_size,
+            tuple(_tree_shape(subtree) for subtree in tree._subtrees))
+
+
+def _expand_all(tree):
+    """Expand every placeholder in <tree>, and the placeholders they hold.
+
+    @type tree: AbstractTree
+    @rtype: None
+    """
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        node.expand()
+        pending.extend(node._subtrees)
+
+
+def _all_nodes(tree):
+    """Return every node of <tree>, in pre-order.
+
+    @type tree: AbstractTree
+    @rtype: list[AbstractTree]
+    """
+    nodes = [tree]
+    for subtree in tree._subtrees:
+        nodes.extend(_all_nodes(subtree))
+    return nodes
+
+
+def _write_file(path, size):
+    """Write a file of <size> bytes at <path>.
+
+    @type path: str
+    @type size: int
+    @rtype: None
+    """
+    with open(path, 'w') as f:
+        f.write('x' * size)
+
+
+def _bump_mtime(path):
+    """Move the modification time of <path> one second into the future.
+
+    This makes sure a change is seen even on file systems whose timestamps
+    are too coarse to tell apart two changes made in quick succession.
+
+    @type path: str
+    @rtype: None
+    """
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def _paint(canvas, rects):
+    """Paint <rects> onto <canvas>, a dict from pixels to colours.
+
+    @type canvas: dict[(int, int), (int, int, int)]
+    @type rects: iterator[((int, int, int, int), (int, int, int))]
+    @rtype: dict[(int, int), (int, int, int)]
+    """
+    canvas = dict(canvas)
+    for (x, y, width, height), colour in rects:
+        for i in range(x, x + width):
+            for j in range(y, y + height):
+                canvas[(i, j)] = colour
+    return canvas
+
+
 ##############################################################################
 # Helper to sort subtrees alphabetically
 ##############################################################################
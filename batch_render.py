@@ -0,0 +1,225 @@
+"""Assignment 2: Batch Treemap Rendering
+
+=== Module Description ===
+This module renders treemaps straight to image files, without opening a
+window, so that they can be produced by scheduled jobs.
+
+Each root is scanned, laid out and rasterised (see raster) by a separate
+worker process, so several roots are processed at once, and the time spent
+on each step of each job is reported as the jobs finish. With --stats, the
+statistics of every job (see instrumentation) are added up and saved to a
+JSON file.
+
+Run it from the command line, e.g.
+
+    python batch_render.py --output-dir maps --width 1920 --height 1080 \\
+        /home /var /srv/projects
+
+which writes one PNG per root into maps/.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pygame
+
+from instrumentation import STATS, Stats
+from layouts import LAYOUTS
+from raster import rasterise_tree
+from tree_data import FileSystemTree, LAYOUT_ENGINES
+
+
+class RenderJob:
+    """A request to render the treemap of one file or folder.
+
+    === Public Attributes ===
+    @type root: str
+        The path of the file or folder to render.
+    @type output: str
+        The path of the image file to write.
+    @type size: (int, int)
+        The width and height of the image, in pixels.
+    @type scan_workers: int
+        The number of threads used to read the folder (see fs_scan).
+    @type engine: str
+        The layout engine to use; one of tree_data.LAYOUT_ENGINES.
+    @type layout: str
+        The name of the layout to use; one of layouts.LAYOUTS.
+    @type lod_area: int
+        The LOD area of the tree (see AbstractTree.set_lod_area).
+    @type stats: bool
+        Whether to keep statistics of the job (see instrumentation).
+    """
+    def __init__(self, root, output, size, scan_workers=1, engine='python',
+                 layout='slice-and-dice', lod_area=1, stats=False):
+        """Initialize a new RenderJob.
+
+        @type self: RenderJob
+        @type root: str
+        @type output: str
+        @type size: (int, int)
+        @type scan_workers: int
+        @type engine: str
+        @type layout: str
+        @type lod_area: int
+        @type stats: bool
+        @rtype: None
+        """
+        self.root = root
+        self.output = output
+        self.size = size
+        self.scan_workers = scan_workers
+        self.engine = engine
+        self.layout = layout
+        self.lod_area = lod_area
+        self.stats = stats
+
+
+def render_tree(tree, output, size, engine='python'):
+    """Write the treemap of <tree> to the image file <output>.
+
+    The format of the image is chosen by pygame from the extension of
+    <output>. No display is needed.
+
+    @type tree: AbstractTree
+    @type output: str
+    @type size: (int, int)
+    @type engine: str
+    @rtype: None
+    """
+    pixels = rasterise_tree(tree, (0, 0) + tuple(size), engine)
+    pygame.image.save(pygame.surfarray.make_surface(pixels), output)
+
+
+def run_job(job):
+    """Render <job>, and return the time spent on each step, in seconds.
+
+    The returned dictionary has a 'scan' entry for reading the file system,
+    a 'render' entry for the layout and the writing of the image, and a
+    'total' entry. If job.stats is True, it also has a 'stats' entry, with
+    the statistics of the job as returned by instrumentation.Stats.to_dict.
+
+    @type job: RenderJob
+    @rtype: dict[str, float | dict]
+    """
+    if job.stats:
+        STATS.reset()
+        STATS.enabled = True
+    start = time.perf_counter()
+    tree = FileSystemTree(job.root, job.scan_workers)
+    tree.set_layout(LAYOUTS[job.layout])
+    tree.set_lod_area(job.lod_area)
+    scanned = time.perf_counter()
+    render_tree(tree, job.output, job.size, job.engine)
+    rendered = time.perf_counter()
+    result = {'scan': scanned - start, 'render': rendered - scanned,
+              'total': rendered - start}
+    if job.stats:
+        result['stats'] = STATS.to_dict()
+    return result
+
+
+def run_jobs(jobs, processes=None):
+    """Run every job in <jobs>, yielding the results as jobs finish.
+
+    Each yielded tuple contains a job and either the timings returned by
+    run_job or the exception the job raised, so that one unreadable root
+    does not stop the others. Up to <processes> jobs run at once, each in
+    its own process; None means one process per CPU.
+
+    @type jobs: list[RenderJob]
+    @type processes: int | None
+    @rtype: iterator[(RenderJob, dict[str, float | dict] | Exception)]
+    """
+    if processes == 1:
+        for job in jobs:
+            try:
+                yield job, run_job(job)
+            except Exception as error:
+                yield job, error
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as error:
+                yield futures[future], error
+
+
+def output_name(root):
+    """Return the name of the image file for <root>.
+
+    The name is made from the whole absolute path, so that roots with the
+    same last component (e.g. several 'src' folders) do not overwrite each
+    other's images.
+
+    @type root: str
+    @rtype: str
+    """
+    path = os.path.abspath(root).strip(os.sep)
+    return (path.replace(os.sep, '_') or 'root') + '.png'
+
+
+def main(argv=None):
+    """Render the roots given on the command line, and report timings.
+
+    Return the exit status: 0 if every job succeeded, 1 otherwise.
+
+    @type argv: list[str] | None
+    @rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        description='Render treemaps of files and folders to PNG images.')
+    parser.add_argument('roots', nargs='+', metavar='root',
+                        help='a file or folder to render')
+    parser.add_argument('--output-dir', default='.',
+                        help='the folder to write the images to')
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='the number of roots rendered at once '
+                             '(default: the number of CPUs)')
+    parser.add_argument('--scan-workers', type=int, default=1,
+                        help='the number of threads scanning each root')
+    parser.add_argument('--engine', choices=LAYOUT_ENGINES,
+                        default='python')
+    parser.add_argument('--layout', choices=sorted(LAYOUTS),
+                        default='slice-and-dice')
+    parser.add_argument('--lod-area', type=int, default=1,
+                        help='draw subtrees covering fewer pixels than this '
+                             'as a single rectangle')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='save the statistics of the jobs to this JSON '
+                             'file')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [RenderJob(root, os.path.join(args.output_dir, output_name(root)),
+                      (args.width, args.height), args.scan_workers,
+                      args.engine, args.layout, args.lod_area,
+                      args.stats is not None)
+            for root in args.roots]
+
+    stats = Stats()
+    failed = False
+    for job, result in run_jobs(jobs, args.processes):
+        if isinstance(result, Exception):
+            failed = True
+            print('{}: failed: {}'.format(job.root, result), file=sys.stderr)
+        else:
+            print('{}: scan {:.3f}s, render {:.3f}s, total {:.3f}s -> {}'
+                  .format(job.root, result['scan'], result['render'],
+                          result['total'], job.output))
+            if args.stats is not None:
+                stats.merge(result['stats'])
+    if args.stats is not None:
+        stats.dump(args.stats)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,477 @@
+"""Assignment 2: Benchmarks
+
+=== Module Description ===
+This module measures how the hot paths of the treemap scale with the size
+and shape of the tree, so that changes that make them slower are noticed.
+
+Trees are generated from a seed, so every run measures the same trees:
+
+  - wide: a single folder holding N leaves, where the cost of each layout's
+    partition of one large node dominates;
+  - deep: a complete binary tree, so that N leaves are spread over log2(N)
+    levels and the cost per node dominates;
+  - skewed: a spine of folders, each holding a few leaves and the next
+    folder, so that the depth grows linearly with N and every operation
+    that walks up to the root is as slow as it gets;
+  - zipf: a tree shaped like a real file system, with heavy-tailed
+    (Zipf-like) file sizes and folder sizes, and files at every level.
+
+For each tree, the suite times its construction (AbstractTree.__init__ for
+every node), and then, for each layout (see layouts), generate_treemap from
+a cold cache, leaf_dictionary, and a batch of return_selected_tree queries.
+With the slice-and-dice layout, it also times generate_treemap with a warm
+cache, and with the 'numpy' engine, both cold (which includes flattening
+the tree) and warm.
+It then times a batch of offset_size calls and a batch of delete_node calls
+on random leaves. Finally it writes a folder of files to the disk (see
+write_fixture) and times reading it as a FileSystemTree.
+
+Run it from the command line, e.g.
+
+    python benchmarks.py --leaves 1000 100000 1000000 --output new.json
+    python benchmarks.py --compare old.json new.json
+
+The first command prints each result as it is measured, and saves them all
+to new.json; the second lists the benchmarks that are more than
+REGRESSION_TOLERANCE slower in new.json than in old.json, and exits with
+status 1 if there are any.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from layouts import LAYOUTS, SLICE_AND_DICE
+from tree_data import AbstractTree, FileSystemTree
+
+
+# The rectangle the trees are laid out in.
+BENCHMARK_RECT = (0, 0, 1024, 768)
+
+# The number of return_selected_tree queries timed for each tree.
+QUERY_COUNT = 1000
+
+# The number of offset_size and of delete_node calls timed for each tree.
+UPDATE_COUNT = 1000
+
+# The number of files written for the FileSystemTree benchmark.
+SCAN_FILES = 10000
+
+# How much slower (as a fraction) a benchmark must be to be a regression.
+REGRESSION_TOLERANCE = 0.25
+
+
+class BenchmarkTree(AbstractTree):
+    """A tree of generated sizes, used for benchmarking."""
+    __slots__ = ()
+
+    def get_separator(self):
+        """Return the string used to separate nodes in the string
+        representation of a path from the tree root to a leaf.
+
+        @type self: BenchmarkTree
+        @rtype: str
+        """
+        return '/'
+
+
+def wide_tree(leaves, seed=0):
+    """Return a tree made of a root with <leaves> leaves of random sizes.
+
+    @type leaves: int
+    @type seed: int
+    @rtype: BenchmarkTree
+    """
+    rng = random.Random(seed)
+    return BenchmarkTree('root', [BenchmarkTree(str(i), [],
+                                                rng.randint(1, 10 ** 6))
+                                  for i in range(leaves)])
+
+
+def deep_tree(leaves, seed=0):
+    """Return a complete binary tree with <leaves> leaves of random sizes.
+
+    @type leaves: int
+    @type seed: int
+    @rtype: BenchmarkTree
+    """
+    rng = random.Random(seed)
+    level = [BenchmarkTree(str(i), [], rng.randint(1, 10 ** 6))
+             for i in range(leaves)]
+    # pair up the nodes of each level, from the leaves up
+    while len(level) > 1:
+        level = [BenchmarkTree('node', level[i:i + 2])
+                 for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def skewed_tree(leaves, seed=0, fan_out=8):
+    """Return a spine of folders holding <leaves> leaves of random sizes.
+
+    Every folder holds <fan_out> - 1 leaves and the next folder, except for
+    the last one, which holds the remaining leaves.
+
+    @type leaves: int
+    @type seed: int
+    @type fan_out: int
+    @rtype: BenchmarkTree
+    """
+    rng = random.Random(seed)
+    sizes = [rng.randint(1, 10 ** 6) for _ in range(leaves)]
+    # build the spine from its far end, so that each folder can be given
+    # the next one as a subtree
+    end = len(sizes)
+    start = max(0, end - fan_out)
+    tree = BenchmarkTree('node', [BenchmarkTree(str(i), [], sizes[i])
+                                  for i in range(start, end)])
+    while start > 0:
+        end, start = start, max(0, start - fan_out + 1)
+        tree = BenchmarkTree('node', [BenchmarkTree(str(i), [], sizes[i])
+                                      for i in range(start, end)] + [tree])
+    return tree
+
+
+def zipf_tree(leaves, seed=0):
+    """Return a tree with <leaves> leaves shaped like a real file system.
+
+    File sizes and the number of entries of each folder follow Pareto
+    distributions, so that most files are small, most folders hold a few
+    entries, and a few of each are very large. Some files are kept out of
+    each level of folders, so that files occur at every depth.
+
+    @type leaves: int
+    @type seed: int
+    @rtype: BenchmarkTree
+    """
+    rng = random.Random(seed)
+    level = [BenchmarkTree(str(i), [], int(1000 * rng.paretovariate(1.2)))
+             for i in range(leaves)]
+    # group the nodes of each level into folders, from the leaves up
+    while len(level) > 1:
+        grouped = []
+        index = 0
+        while index < len(level):
+            if level[index]._subtrees == [] and rng.random() < 0.2:
+                # a file in a folder further up
+                grouped.append(level[index])
+                index += 1
+                continue
+            count = min(int(2 * rng.paretovariate(0.8)), 10000)
+            grouped.append(BenchmarkTree('folder',
+                                         level[index:index + count]))
+            index += count
+        level = grouped
+    return level[0]
+
+
+# The tree generators, by shape.
+SHAPES = {'wide': wide_tree, 'deep': deep_tree, 'skewed': skewed_tree,
+          'zipf': zipf_tree}
+
+
+def write_fixture(directory, files, seed=0):
+    """Write <files> files of random sizes into a new tree of folders under
+    <directory>, and return the path of its root.
+
+    The files are sparse, so they take up little space on the disk whatever
+    their sizes.
+
+    @type directory: str
+    @type files: int
+    @type seed: int
+    @rtype: str
+    """
+    rng = random.Random(seed)
+    root = os.path.join(directory, 'fixture')
+    folders = [root]
+    os.mkdir(root)
+    for i in range(files):
+        if rng.random() < 0.05:
+            # a new folder, inside one of the earlier ones
+            folder = os.path.join(rng.choice(folders), 'd{}'.format(i))
+            os.mkdir(folder)
+            folders.append(folder)
+        path = os.path.join(rng.choice(folders), 'f{}'.format(i))
+        with open(path, 'wb') as f:
+            f.truncate(int(1000 * rng.paretovariate(1.2)))
+    return root
+
+
+def time_layout(tree, layout, rect=BENCHMARK_RECT, queries=QUERY_COUNT,
+                seed=0, lod_area=0):
+    """Return the seconds taken to lay out <tree> with <layout> in <rect>,
+    and to answer <queries> return_selected_tree queries at random points.
+
+    @type tree: AbstractTree
+    @type layout: SliceAndDiceLayout | SquarifiedLayout | StripLayout
+    @type rect: (int, int, int, int)
+    @type queries: int
+    @type seed: int
+    @type lod_area: int
+    @rtype: (float, float)
+    """
+    rng = random.Random(seed)
+    points = [(rng.randint(rect[0], rect[0] + rect[2]),
+               rng.randint(rect[1], rect[1] + rect[3]))
+              for _ in range(queries)]
+    tree.set_layout(layout)
+    tree.set_lod_area(lod_area)
+    start = time.perf_counter()
+    tree.generate_treemap(rect)
+    laid_out = time.perf_counter()
+    for point in points:
+        tree.return_selected_tree(point, rect)
+    queried = time.perf_counter()
+    return laid_out - start, queried - laid_out
+
+
+def time_engines(tree, rect=BENCHMARK_RECT):
+    """Return the seconds taken by generate_treemap on <tree>, laid out with
+    the slice-and-dice layout in <rect>.
+
+    The returned dictionary maps the name of each benchmark to its time:
+    'generate_treemap_warm' for a second call with the 'python' engine,
+    and 'generate_treemap_numpy' and 'generate_treemap_numpy_warm' for a
+    first and a second call with the 'numpy' engine. Only the first 'numpy'
+    call flattens the tree (see numpy_layout.flatten).
+
+    @type tree: AbstractTree
+    @type rect: (int, int, int, int)
+    @rtype: dict[str, float]
+    """
+    tree.set_layout(SLICE_AND_DICE)
+    tree.generate_treemap(rect)
+    times = {}
+    for name, engine in [('generate_treemap_warm', 'python'),
+                         ('generate_treemap_numpy', 'numpy'),
+                         ('generate_treemap_numpy_warm', 'numpy')]:
+        start = time.perf_counter()
+        tree.generate_treemap(rect, engine)
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def benchmark_tree(shape, leaves, layouts=tuple(sorted(LAYOUTS)), seed=0,
+                   lod_area=0):
+    """Time every operation on the <shape> tree with <leaves> leaves, and
+    return the results.
+
+    Each result is a dictionary with the name of the 'benchmark', the
+    'shape' and number of 'leaves' of the tree, the 'layout' used (None for
+    operations that do not lay the tree out), the 'count' of operations
+    timed, and the 'seconds' they took.
+
+    @type shape: str
+    @type leaves: int
+    @type layouts: tuple[str]
+    @type seed: int
+    @type lod_area: int
+    @rtype: list[dict]
+    """
+    def result(benchmark, layout, count, seconds):
+        return {'benchmark': benchmark, 'shape': shape, 'leaves': leaves,
+                'layout': layout, 'count': count, 'seconds': seconds}
+
+    start = time.perf_counter()
+    tree = SHAPES[shape](leaves, seed)
+    results = [result('construct', None, 1, time.perf_counter() - start)]
+
+    for name in layouts:
+        layout_time, query_time = time_layout(tree, LAYOUTS[name],
+                                              seed=seed, lod_area=lod_area)
+        start = time.perf_counter()
+        tree.leaf_dictionary(BENCHMARK_RECT)
+        dictionary_time = time.perf_counter() - start
+        results.extend([
+            result('generate_treemap', name, 1, layout_time),
+            result('leaf_dictionary', name, 1, dictionary_time),
+            result('return_selected_tree', name, QUERY_COUNT, query_time)])
+        if LAYOUTS[name] is SLICE_AND_DICE:
+            results.extend(result(benchmark, name, 1, seconds)
+                           for benchmark, seconds
+                           in sorted(time_engines(tree).items()))
+
+    rng = random.Random(seed)
+    chosen = rng.sample(_leaves(tree), min(UPDATE_COUNT, leaves))
+    start = time.perf_counter()
+    for leaf in chosen:
+        leaf.offset_size(rng.randint(1, 1000))
+    results.append(result('offset_size', None, len(chosen),
+                          time.perf_counter() - start))
+    start = time.perf_counter()
+    for leaf in chosen:
+        leaf.delete_node()
+    results.append(result('delete_node', None, len(chosen),
+                          time.perf_counter() - start))
+    return results
+
+
+def benchmark_scan(files=SCAN_FILES, workers=(1, 8), seed=0):
+    """Time reading a fixture of <files> files (see write_fixture) as a
+    FileSystemTree, with each number of threads in <workers>, and return
+    the results, as benchmark_tree does.
+
+    The operating system caches the folders after the first read, so every
+    read after the first one is timed with a warm cache.
+
+    @type files: int
+    @type workers: tuple[int]
+    @type seed: int
+    @rtype: list[dict]
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        root = write_fixture(directory, files, seed)
+        FileSystemTree(root)
+        results = []
+        for count in workers:
+            start = time.perf_counter()
+            FileSystemTree(root, count)
+            results.append({'benchmark': 'scan', 'shape': 'fixture',
+                            'leaves': files, 'layout': None,
+                            'workers': count, 'count': 1,
+                            'seconds': time.perf_counter() - start})
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def write_results(results, path):
+    """Save <results> to the JSON file at <path>, along with the versions of
+    Python and of the platform they were measured on.
+
+    @type results: list[dict]
+    @type path: str
+    @rtype: None
+    """
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'time': time.time(),
+                   'results': results}, f, indent=1)
+
+
+def compare_results(old, new, tolerance=REGRESSION_TOLERANCE):
+    """Return the results in <new> that are more than <tolerance> slower
+    than the same benchmark in <old>.
+
+    Each returned tuple contains the result in <old> and the result in
+    <new>. Benchmarks found in only one of them are ignored.
+
+    @type old: list[dict]
+    @type new: list[dict]
+    @type tolerance: float
+    @rtype: list[(dict, dict)]
+    """
+    before = {_key(result): result for result in old}
+    return [(before[_key(result)], result) for result in new
+            if _key(result) in before and result['seconds'] >
+            before[_key(result)]['seconds'] * (1 + tolerance)]
+
+
+def _key(result):
+    """Return what identifies the benchmark <result> is a result of.
+
+    @type result: dict
+    @rtype: tuple
+    """
+    return (result['benchmark'], result['shape'], result['leaves'],
+            result['layout'], result.get('workers'))
+
+
+def _leaves(tree):
+    """Return every leaf of <tree>.
+
+    @type tree: AbstractTree
+    @rtype: list[AbstractTree]
+    """
+    leaves = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node._subtrees == []:
+            leaves.append(node)
+        else:
+            stack.extend(node._subtrees)
+    return leaves
+
+
+def _describe(result):
+    """Return a line describing <result>.
+
+    @type result: dict
+    @rtype: str
+    """
+    if 'workers' in result:
+        setting = '{} threads'.format(result['workers'])
+    else:
+        setting = result['layout'] or '-'
+    return '{:<20} {:<8} {:>8} {:<16} {:>6} {:>10.4f}s'.format(
+        result['benchmark'], result['shape'], result['leaves'], setting,
+        result['count'], result['seconds'])
+
+
+def main(argv=None):
+    """Run the benchmarks given on the command line, or compare two saved
+    runs, and return the exit status.
+
+    @type argv: list[str] | None
+    @rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        description='Time the hot paths of the treemap on generated trees.')
+    parser.add_argument('--leaves', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='the numbers of leaves of the trees')
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES),
+                        default=sorted(SHAPES))
+    parser.add_argument('--layouts', nargs='+', choices=sorted(LAYOUTS),
+                        default=sorted(LAYOUTS))
+    parser.add_argument('--lod-area', type=int, default=0,
+                        help='draw subtrees covering fewer pixels than this '
+                             'as a single rectangle')
+    parser.add_argument('--scan-files', type=int, default=SCAN_FILES,
+                        help='the number of files of the scan fixture '
+                             '(0 to skip the scan benchmark)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='the JSON file to save results to')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='list the regressions between two saved runs '
+                             'instead of running the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as f:
+                runs.append(json.load(f)['results'])
+        old, new = runs
+        regressions = compare_results(old, new)
+        for before, after in regressions:
+            print('{} (was {:.4f}s)'.format(_describe(after),
+                                           before['seconds']))
+        return 1 if regressions else 0
+
+    results = []
+    for shape in args.shapes:
+        for leaves in args.leaves:
+            for result in benchmark_tree(shape, leaves, tuple(args.layouts),
+                                         args.seed, args.lod_area):
+                print(_describe(result))
+                results.append(result)
+    if args.scan_files > 0:
+        for result in benchmark_scan(args.scan_files, seed=args.seed):
+            print(_describe(result))
+            results.append(result)
+    if args.output:
+        write_results(results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""Assignment 2: Data Sources
+
+=== Module Description ===
+This module contains the sources population.py downloads its JSON data
+from. Every source has the same two methods: fetch(url, headers), which
+returns the status, headers and body of a response, and get(url), which
+returns just the body.
+
+HttpSource makes real requests, with a timeout and a few retries.
+FixtureSource serves responses saved in a folder, so that the population
+treemap can be used, and tested, without a network connection.
+CachedSource sits in front of either of them and keeps every response on
+the disk:
+
+  - bodies are stored under the SHA-256 hash of their contents, so that a
+    body shared by several URLs (or fetched again unchanged) is stored once;
+  - a small JSON record per URL gives the hash of its body, the time it was
+    fetched, and its ETag and Last-Modified headers.
+
+A cached response younger than CachedSource.max_age is used without any
+request. An older one is revalidated with a conditional request, which
+costs no download if it has not changed, and is still used if the request
+fails, e.g. when offline.
+"""
+import hashlib
+import json
+import os
+import socket
+import time
+import urllib.error
+import urllib.request as request
+
+
+class HttpSource:
+    """A source that downloads responses over HTTP.
+
+    === Public Attributes ===
+    @type timeout: float
+        The number of seconds to wait for a response.
+    @type retries: int
+        The number of times a request is retried after a network error or
+        a server error (5xx).
+    @type backoff: float
+        The number of seconds to wait before the first retry; the wait
+        doubles after every retry.
+    """
+    def __init__(self, timeout=10.0, retries=2, backoff=0.5):
+        """Initialize a new HttpSource.
+
+        @type self: HttpSource
+        @type timeout: float
+        @type retries: int
+        @type backoff: float
+        @rtype: None
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def fetch(self, url, headers=None):
+        """Request <url>, and return the status, headers and body.
+
+        A 304 (Not Modified) response to a conditional request is returned
+        like any other response, with an empty body. Raise OSError (e.g.,
+        urllib.error.URLError) if the request fails after every retry.
+
+        @type self: HttpSource
+        @type url: str
+        @type headers: dict[str, str] | None
+        @rtype: (int, dict[str, str], bytes)
+        """
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                req = request.Request(url, headers=headers or {})
+                with request.urlopen(req, timeout=self.timeout) as response:
+                    return (response.status, dict(response.headers),
+                            response.read())
+            except urllib.error.HTTPError as error:
+                if error.code == 304:
+                    return 304, dict(error.headers), b''
+                if error.code < 500 or attempt == self.retries:
+                    raise
+            except (urllib.error.URLError, socket.timeout):
+                if attempt == self.retries:
+                    raise
+            time.sleep(delay)
+            delay *= 2
+
+    def get(self, url):
+        """Return the body of the response to <url>.
+
+        @type self: HttpSource
+        @type url: str
+        @rtype: bytes
+        """
+        return self.fetch(url)[2]
+
+
+class FixtureSource:
+    """A source that serves responses saved in a folder.
+
+    The folder contains an index.json file, mapping every URL it can serve
+    to the name of a file in the folder holding the body of its response.
+    Each response is given an ETag (the hash of its body), and conditional
+    requests are answered like an HTTP server would.
+
+    === Private Attributes ===
+    @type _directory: str
+        The folder holding the responses.
+    @type _files: dict[str, str]
+        The contents of index.json.
+    """
+    def __init__(self, directory):
+        """Initialize a source serving the responses saved in <directory>.
+
+        @type self: FixtureSource
+        @type directory: str
+        @rtype: None
+        """
+        self._directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            self._files = json.load(f)
+
+    def fetch(self, url, headers=None):
+        """Return the status, headers and body of the saved response to
+        <url>.
+
+        Raise urllib.error.URLError if no response to <url> is saved.
+
+        @type self: FixtureSource
+        @type url: str
+        @type headers: dict[str, str] | None
+        @rtype: (int, dict[str, str], bytes)
+        """
+        if url not in self._files:
+            raise urllib.error.URLError('No saved response for ' + url)
+        with open(os.path.join(self._directory, self._files[url]), 'rb') as f:
+            body = f.read()
+        etag = '"{}"'.format(hashlib.sha256(body).hexdigest())
+        if (headers or {}).get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'ETag': etag}, body
+
+    def get(self, url):
+        """Return the body of the saved response to <url>.
+
+        @type self: FixtureSource
+        @type url: str
+        @rtype: bytes
+        """
+        return self.fetch(url)[2]
+
+    @staticmethod
+    def save(directory, responses):
+        """Save <responses> to <directory>, for a FixtureSource to serve.
+
+        <responses> maps URLs to the bodies of their responses.
+
+        @type directory: str
+        @type responses: dict[str, bytes]
+        @rtype: None
+        """
+        os.makedirs(directory, exist_ok=True)
+        files = {}
+        for url, body in responses.items():
+            name = hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json'
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(body)
+            files[url] = name
+        with open(os.path.join(directory, 'index.json'), 'w') as f:
+            json.dump(files, f, indent=1, sort_keys=True)
+
+
+class CachedSource:
+    """A source that keeps the responses of another source on the disk.
+
+    === Public Attributes ===
+    @type source: HttpSource | FixtureSource
+        The source responses are requested from.
+    @type directory: str
+        The folder the cache is kept in.
+    @type max_age: float
+        The number of seconds a cached response is used for without being
+        revalidated.
+    """
+    def __init__(self, source, directory, max_age=24 * 60 * 60):
+        """Initialize a new CachedSource.
+
+        @type self: CachedSource
+        @type source: HttpSource | FixtureSource
+        @type directory: str
+        @type max_age: float
+        @rtype: None
+        """
+        self.source = source
+        self.directory = directory
+        self.max_age = max_age
+
+    def fetch(self, url, headers=None):
+        """Return the status, headers and body of the response to <url>,
+        from the cache if possible.
+
+        <headers> are only sent if a request is made. Raise OSError if
+        there is no cached response and the request fails.
+
+        @type self: CachedSource
+        @type url: str
+        @type headers: dict[str, str] | None
+        @rtype: (int, dict[str, str], bytes)
+        """
+        record = self._read_record(url)
+        if record is not None and time.time() - record['fetched'] < \
+                self.max_age:
+            return 200, record['headers'], self._read_body(record)
+
+        request_headers = dict(headers or {})
+        if record is not None:
+            # only download the response again if it has changed
+            if 'ETag' in record['headers']:
+                request_headers['If-None-Match'] = record['headers']['ETag']
+            if 'Last-Modified' in record['headers']:
+                request_headers['If-Modified-Since'] = \
+                    record['headers']['Last-Modified']
+        try:
+            status, response_headers, body = self.source.fetch(
+                url, request_headers)
+        except OSError:
+            if record is None:
+                raise
+            # offline: a stale response is better than none
+            return 200, record['headers'], self._read_body(record)
+
+        if status == 304 and record is not None:
+            body = self._read_body(record)
+            response_headers = record['headers']
+        self._write(url, response_headers, body)
+        return 200, response_headers, body
+
+    def get(self, url):
+        """Return the body of the response to <url>, from the cache if
+        possible.
+
+        @type self: CachedSource
+        @type url: str
+        @rtype: bytes
+        """
+        return self.fetch(url)[2]
+
+    def _record_path(self, url):
+        """Return the path of the record of <url>.
+
+        @type self: CachedSource
+        @type url: str
+        @rtype: str
+        """
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.directory, 'urls', name)
+
+    def _body_path(self, digest):
+        """Return the path of the body whose SHA-256 hash is <digest>.
+
+        @type self: CachedSource
+        @type digest: str
+        @rtype: str
+        """
+        return os.path.join(self.directory, 'bodies', digest)
+
+    def _read_record(self, url):
+        """Return the record of <url>, or None if it is not cached.
+
+        @type self: CachedSource
+        @type url: str
+        @rtype: dict | None
+        """
+        try:
+            with open(self._record_path(url)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(self._body_path(record['sha256'])):
+            return None
+        return record
+
+    def _read_body(self, record):
+        """Return the cached body described by <record>.
+
+        @type self: CachedSource
+        @type record: dict
+        @rtype: bytes
+        """
+        with open(self._body_path(record['sha256']), 'rb') as f:
+            return f.read()
+
+    def _write(self, url, headers, body):
+        """Store the response to <url> in the cache.
+
+        Both files are written under a temporary name and then renamed, so
+        that an interrupted write never leaves a corrupt cache behind.
+
+        @type self: CachedSource
+        @type url: str
+        @type headers: dict[str, str]
+        @type body: bytes
+        @rtype: None
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        body_path = self._body_path(digest)
+        if not os.path.isfile(body_path):
+            _write_atomically(body_path, body)
+        # header names are not case-sensitive
+        kept = {name: value for key, value in headers.items()
+                for name in ('ETag', 'Last-Modified')
+                if key.lower() == name.lower()}
+        record = {'url': url, 'sha256': digest, 'fetched': time.time(),
+                  'headers': kept}
+        _write_atomically(self._record_path(url),
+                          json.dumps(record).encode('utf-8'))
+
+
+def _write_atomically(path, data):
+    """Write <data> to the file at <path>, creating its folder if needed.
+
+    @type path: str
+    @type data: bytes
+    @rtype: None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'wb') as f:
+        f.write(data)
+    os.replace(temporary_path, path)
+
+
+def default_cache_directory():
+    """Return the folder the population data is cached in by default.
+
+    @rtype: str
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'treemap')
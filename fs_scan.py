@@ -0,0 +1,391 @@
+"""Assignment 2: File System Scanning
+
+=== Module Description ===
+This module contains the code that reads the contents of a folder from the
+disk, for use by FileSystemTree.
+
+Every directory is read with a single os.scandir call. The type of each
+entry comes from the directory listing itself, so the only other system
+call needed per entry is one stat of each regular file, to get its size.
+
+Directories can be read by a bounded pool of threads, which keeps several
+requests in flight at once; this matters most on network file systems and
+fast SSDs, where a single thread spends most of its time waiting. Entries
+are always sorted by name, so the result does not depend on the number of
+threads or on the order in which the operating system lists them.
+
+summarize makes the same pass over the disk, but only adds up sizes, for
+the placeholder folders of a lazily read FileSystemTree.
+
+Every file and directory is identified by its (device, inode) pair, so
+that the same physical file or directory reached by several paths is not
+counted twice:
+
+  - a file with several hard links is sized only once, at the first of its
+    paths (in sorted order); its other links are given a size of 0;
+  - a directory reached again, through a symbolic link to a directory
+    above it or elsewhere in the scan, is read as an empty directory
+    instead of being counted twice, or followed around a loop.
+
+A scan can also be kept to the file system of the folder it starts from,
+and limited by a ScanBudget to a number of entries or of seconds, after
+which it stops and leaves the rest of the folder unread.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class DirectoryListing:
+    """The contents of a single directory.
+
+    === Public Attributes ===
+    @type path: str
+        The path of the directory.
+    @type entries: list[(str, bool, int)]
+        The (name, is_directory, size) of every entry of the directory,
+        sorted by name. The size of a directory entry is 0.
+    @type mtime: int
+        The modification time of the directory, in nanoseconds, read just
+        before its entries were.
+    @type identity: (int, int) | None
+        The (device, inode) of the directory, or None if it is not known.
+    @type links: list[(int, (int, int))]
+        The index in entries and the (device, inode) of every file entry
+        with more than one hard link.
+    """
+    def __init__(self, path, entries, mtime, identity=None, links=None):
+        """Initialize a new DirectoryListing.
+
+        @type self: DirectoryListing
+        @type path: str
+        @type entries: list[(str, bool, int)]
+        @type mtime: int
+        @type identity: (int, int) | None
+        @type links: list[(int, (int, int))] | None
+        @rtype: None
+        """
+        self.path = path
+        self.entries = entries
+        self.mtime = mtime
+        self.identity = identity
+        self.links = links if links is not None else []
+
+    def emptied(self):
+        """Return a listing of this directory without any entries.
+
+        @type self: DirectoryListing
+        @rtype: DirectoryListing
+        """
+        return DirectoryListing(self.path, [], self.mtime, self.identity)
+
+    def subdirectories(self):
+        """Return the paths of the subdirectories of this directory.
+
+        @type self: DirectoryListing
+        @rtype: list[str]
+        """
+        return [os.path.join(self.path, name)
+                for name, is_directory, _ in self.entries if is_directory]
+
+
+class ScanBudget:
+    """A limit on the amount of work done by a scan.
+
+    A scan charges the entries of each directory it reads to its budget,
+    and stops reading new directories once the budget is exhausted. The
+    directories read so far are kept, so the result is a partial tree.
+
+    === Public Attributes ===
+    @type max_entries: int | None
+        The number of entries after which to stop, or None for no limit.
+    @type max_seconds: float | None
+        The number of seconds after which to stop, counted from the first
+        charge, or None for no limit.
+    @type entries: int
+        The number of entries charged so far.
+    @type exhausted: bool
+        Whether a limit was reached, so that some directories were left
+        unread.
+
+    === Private Attributes ===
+    @type _deadline: float | None
+        The time.monotonic() at which the budget runs out, or None if it
+        has not been charged yet.
+    """
+    def __init__(self, max_entries=None, max_seconds=None):
+        """Initialize a new ScanBudget.
+
+        @type self: ScanBudget
+        @type max_entries: int | None
+        @type max_seconds: float | None
+        @rtype: None
+        """
+        self.max_entries = max_entries
+        self.max_seconds = max_seconds
+        self.entries = 0
+        self.exhausted = False
+        self._deadline = None
+
+    def charge(self, listing):
+        """Charge the entries of <listing> to this budget, and return
+        whether the scan may go on to read more directories.
+
+        @type self: ScanBudget
+        @type listing: DirectoryListing
+        @rtype: bool
+        """
+        now = time.monotonic()
+        if self._deadline is None and self.max_seconds is not None:
+            self._deadline = now + self.max_seconds
+        self.entries += len(listing.entries)
+        if (self.max_entries is not None and
+                self.entries >= self.max_entries) or \
+                (self._deadline is not None and now >= self._deadline):
+            self.exhausted = True
+        return not self.exhausted
+
+
+def read_directory(path, device=None):
+    """Return the listing of the directory at <path>.
+
+    Like os.path.isdir and os.path.getsize, symbolic links are followed. A
+    symbolic link to nothing is listed as a file of size 0, and an entry
+    removed while the directory is being read is left out.
+
+    If <device> is not None and the directory is on another device (i.e.,
+    it is the mount point of another file system), its entries are not
+    read and the listing is empty.
+
+    @type path: str
+    @type device: int | None
+    @rtype: DirectoryListing
+    """
+    # read the mtime first, so that a change made while the directory is
+    # being read is noticed by the next refresh
+    status = os.stat(path)
+    mtime = status.st_mtime_ns
+    identity = (status.st_dev, status.st_ino)
+    if device is not None and status.st_dev != device:
+        return DirectoryListing(path, [], mtime, identity)
+    entries = []
+    links = []
+    with os.scandir(path) as directory:
+        for entry in directory:
+            if entry.is_dir():
+                entries.append((entry.name, True, 0))
+                continue
+            try:
+                status = entry.stat()
+            except FileNotFoundError:
+                if entry.is_symlink():
+                    entries.append((entry.name, False, 0))
+                continue
+            if status.st_nlink > 1:
+                links.append((entry.name, (status.st_dev, status.st_ino)))
+            entries.append((entry.name, False, status.st_size))
+    entries.sort()
+    if links:
+        indices = {name: index
+                   for index, (name, _, _) in enumerate(entries)}
+        links = sorted((indices[name], file_id) for name, file_id in links)
+    return DirectoryListing(path, entries, mtime, identity, links)
+
+
+def _walk(roots, workers, visit, device=None, budget=None):
+    """Read every directory reachable from <roots>.
+
+    <roots> contains (path, tag) pairs. After each directory is read,
+    visit(listing, tag) is called, and returns the (path, tag) pairs of the
+    directories to read next. Calls to visit are always made from the
+    calling thread. <device> is passed on to read_directory.
+
+    With a single worker, directories are read depth first, each root and
+    each directory returned by visit in the order given. With several, the
+    order depends on how long each directory takes to read.
+
+    No more directories are read once <budget> is exhausted, but those
+    already being read by other threads are still visited.
+
+    @type roots: list[(str, object)]
+    @type workers: int
+    @type visit: (DirectoryListing, object) -> list[(str, object)]
+    @type device: int | None
+    @type budget: ScanBudget | None
+    @rtype: None
+    """
+    if budget is not None and budget.exhausted:
+        return
+    if workers <= 1:
+        # reversed, so that the first of them is at the end of the stack
+        pending = list(reversed(roots))
+        while pending and not (budget is not None and budget.exhausted):
+            path, tag = pending.pop()
+            pending.extend(reversed(visit(read_directory(path, device),
+                                          tag)))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tags = {}
+        for path, tag in roots:
+            tags[pool.submit(read_directory, path, device)] = tag
+        pending = set(tags)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for path, tag in visit(future.result(), tags.pop(future)):
+                    next_future = pool.submit(read_directory, path, device)
+                    tags[next_future] = tag
+                    pending.add(next_future)
+
+
+def scan(path, workers=1, max_depth=None, device=None, budget=None,
+         seen=None):
+    """Return the listings of <path> and of every directory below it.
+
+    The returned dictionary maps the path of each directory to its listing.
+    When <workers> is greater than 1, up to that many directories are read
+    at the same time, each by a separate thread.
+
+    If <max_depth> is not None, only directories at most <max_depth> levels
+    below <path> are read (<path> itself is at depth 0). If <device> is not
+    None, directories on other devices are listed as empty. If <budget> is
+    not None, no more directories are read once it is exhausted; <path>
+    itself is always read, even with a budget exhausted by an earlier scan.
+
+    <seen> records the path at which each directory, and each file with
+    several hard links, is counted, by (device, inode); it is updated with
+    those found here. Pass the same <seen> to every scan of the same tree,
+    so that reading a folder again does not count its contents again.
+
+    A directory already counted at another path, such as one reached again
+    through a symbolic link, is listed as empty. With a single worker, a
+    directory reached by several paths is therefore read at the first of
+    them, in depth-first order with the entries of each directory in order
+    of name; with several, at whichever is read first. A file with several
+    hard links keeps its size at the first of its links in order of path,
+    and every other link is given a size of 0.
+
+    Precondition: <path> is a directory, and workers >= 1.
+
+    @type path: str
+    @type workers: int
+    @type max_depth: int | None
+    @type device: int | None
+    @type budget: ScanBudget | None
+    @type seen: dict[(int, int), str] | None
+    @rtype: dict[str, DirectoryListing]
+    """
+    listings = {}
+    seen = {} if seen is None else seen
+    checked = set()
+
+    def visit(listing, depth):
+        if not _claim(seen, checked, listing.identity, listing.path):
+            # read already, e.g. through a symbolic link to a folder above
+            # it or next to it
+            listings[listing.path] = listing.emptied()
+            return []
+        listings[listing.path] = listing
+        if budget is not None and not budget.charge(listing):
+            return []
+        if max_depth is not None and depth >= max_depth:
+            return []
+        return [(subdirectory, depth + 1)
+                for subdirectory in listing.subdirectories()]
+
+    _walk(visit(read_directory(path, device), 0), workers, visit, device,
+          budget)
+    # in order of path, so that the link that keeps its size does not
+    # depend on the order in which the directories were read
+    for folder in sorted(listings):
+        listing = listings[folder]
+        for index, file_id in listing.links:
+            name = listing.entries[index][0]
+            if not _claim(seen, checked, file_id,
+                          os.path.join(folder, name)):
+                listing.entries[index] = (name, False, 0)
+    return listings
+
+
+def _claim(seen, checked, identity, path):
+    """Return whether the file or directory <identity> is counted at <path>,
+    and record in <seen> that it is, if so.
+
+    It is, unless <seen> has it counted at another path that still leads to
+    it. That path is looked up on the disk once per scan; <checked> holds
+    the identities whose path in <seen> was set or looked up by this scan.
+
+    @type seen: dict[(int, int), str]
+    @type checked: set[(int, int)]
+    @type identity: (int, int)
+    @type path: str
+    @rtype: bool
+    """
+    counted_at = seen.get(identity)
+    if counted_at is not None and counted_at != path:
+        if identity in checked:
+            return False
+        checked.add(identity)
+        try:
+            status = os.stat(counted_at)
+        except OSError:
+            # moved or deleted since
+            status = None
+        if status is not None and (status.st_dev, status.st_ino) == identity:
+            return False
+    seen[identity] = path
+    checked.add(identity)
+    return True
+
+
+def summarize(paths, workers=1, device=None, budget=None, seen=None):
+    """Return the total size and the modification time of each directory.
+
+    The returned dictionary maps each of <paths> to the total size of all
+    the files below it, and to its own modification time. No listing is
+    kept once it has been added up, so this uses much less memory than
+    scan does.
+
+    <device>, <budget> and <seen> are used as by scan: a directory or file
+    already counted at another path adds nothing to the total. A directory
+    or file reached by several paths is counted at the first of them to be
+    read: in order (depth first, with <paths> and the entries of each
+    directory in order) with a single worker, and in an order that depends
+    on the time taken to read each directory with several. A directory left
+    unread because <budget> is exhausted adds nothing to the total, and one
+    of <paths> that is left unread has a modification time of 0.
+
+    Precondition: every path in <paths> is a directory, and workers >= 1.
+
+    @type paths: list[str]
+    @type workers: int
+    @type device: int | None
+    @type budget: ScanBudget | None
+    @type seen: dict[(int, int), str] | None
+    @rtype: dict[str, (int, int)]
+    """
+    sizes = {path: 0 for path in paths}
+    mtimes = {path: 0 for path in paths}
+    seen = {} if seen is None else seen
+    checked = set()
+
+    def visit(listing, root):
+        if listing.path == root:
+            mtimes[root] = listing.mtime
+        if not _claim(seen, checked, listing.identity, listing.path):
+            # read already, through another path
+            return []
+        sizes[root] += sum(size for _, _, size in listing.entries)
+        for index, file_id in listing.links:
+            name, _, size = listing.entries[index]
+            if not _claim(seen, checked, file_id,
+                          os.path.join(listing.path, name)):
+                sizes[root] -= size
+        if budget is not None and not budget.charge(listing):
+            return []
+        return [(subdirectory, root)
+                for subdirectory in listing.subdirectories()]
+
+    _walk([(path, path) for path in paths], workers, visit, device, budget)
+    return {path: (sizes[path], mtimes[path]) for path in paths}
@@ -0,0 +1,186 @@
+"""Assignment 2: File System Change Notifications
+
+=== Module Description ===
+This module contains InotifyWatcher, which uses the Linux inotify interface
+to find out which folders below a path have changed, so that
+FileSystemTree.refresh only needs to read those folders again.
+
+inotify is only available on Linux. On other systems, creating an
+InotifyWatcher raises OSError, and FileSystemTree.refresh can still be used
+without it (it then compares folder modification times instead).
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+
+# Flags from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# The events that mean that the contents of a watched folder have changed.
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+
+# The fixed-size header of a struct inotify_event: wd, mask, cookie, len.
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """A watch on a folder and every folder below it.
+
+    === Private Attributes ===
+    @type _libc: ctypes.CDLL
+        The C library providing the inotify functions.
+    @type _fd: int
+        The inotify file descriptor.
+    @type _paths: dict[int, str]
+        The path of the folder watched by each watch descriptor.
+    """
+    def __init__(self, path):
+        """Start watching the folder at <path> and every folder below it.
+
+        Raise OSError if inotify is not available, or if the system limit
+        on the number of watches is reached.
+
+        @type self: InotifyWatcher
+        @type path: str
+        @rtype: None
+        """
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._paths = {}
+        self.watch_tree(path)
+
+    def watch_tree(self, path):
+        """Watch the folder at <path> and every folder below it.
+
+        @type self: InotifyWatcher
+        @type path: str
+        @rtype: None
+        """
+        pending = [path]
+        while pending:
+            folder = pending.pop()
+            if not self._add_watch(folder):
+                continue
+            try:
+                with os.scandir(folder) as entries:
+                    pending.extend(entry.path for entry in entries
+                                   if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                # removed before it could be read
+                pass
+
+    def _add_watch(self, path):
+        """Watch the folder at <path>, and return True if it was found.
+
+        @type self: InotifyWatcher
+        @type path: str
+        @rtype: bool
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path),
+                                          WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(error, 'inotify_add_watch failed', path)
+        self._paths[wd] = path
+        return True
+
+    def _unwatch_below(self, path):
+        """Stop watching the folder at <path> and every folder below it.
+
+        @type self: InotifyWatcher
+        @type path: str
+        @rtype: None
+        """
+        prefix = os.path.join(path, '')
+        for wd, folder in list(self._paths.items()):
+            if folder == path or folder.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._paths[wd]
+
+    def read_changes(self):
+        """Return the folders that changed since the last call.
+
+        The returned set contains the path of every watched folder in which
+        an entry was created, deleted, moved or modified. Folders that are
+        created are watched from then on.
+
+        Return None if the kernel dropped events because too many were
+        queued; in that case every folder must be assumed to have changed.
+
+        @type self: InotifyWatcher
+        @rtype: set[str] | None
+        """
+        changed = set()
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                start = offset + _EVENT_HEADER.size
+                name = os.fsdecode(data[start:start + length].rstrip(b'\0'))
+                offset = start + length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif mask & IN_IGNORED:
+                    self._paths.pop(wd, None)
+                elif wd in self._paths:
+                    folder = self._paths[wd]
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        changed.add(os.path.dirname(folder))
+                    else:
+                        changed.add(folder)
+                    if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                        self._unwatch_below(os.path.join(folder, name))
+                    elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                        self.watch_tree(os.path.join(folder, name))
+        if overflowed:
+            return None
+        return changed
+
+    def close(self):
+        """Stop watching, and release the inotify file descriptor.
+
+        @type self: InotifyWatcher
+        @rtype: None
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+            self._paths = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
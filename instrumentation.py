@@ -0,0 +1,274 @@
+"""Assignment 2: Instrumentation
+
+=== Module Description ===
+This module keeps statistics about where the time of the treemap goes, so
+that a slow frame can be traced to the phase responsible for it: scanning,
+layout, rasterisation, text, or sending the frame to the window.
+
+The slow paths of the other modules report to the shared Stats object
+STATS:
+
+  - STATS.timer(phase) times a block of code, in milliseconds;
+  - STATS.count(name, n) adds n to a counter, such as the number of nodes
+    visited or rectangles emitted by a layout.
+
+Both keep a Histogram of the values they were given, so that the last
+value, the mean and the worst case can all be read back.
+
+Instrumentation is off by default, and then costs a single attribute check
+per call. Turn it on with STATS.enabled = True (the visualiser does so
+while its statistics overlay is shown), and save the statistics of a
+headless run to a JSON file with STATS.dump(path).
+"""
+import json
+import math
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class Histogram:
+    """The distribution of a series of non-negative values.
+
+    Values are counted in buckets whose bounds are powers of 2, so a
+    histogram takes the same small space however many values it is given,
+    and percentiles are exact to within a factor of 2.
+
+    === Public Attributes ===
+    @type count: int
+        The number of values.
+    @type total: float
+        The sum of the values.
+    @type last: float
+        The last value, or 0 if there are none.
+    @type max: float
+        The largest value, or 0 if there are none.
+    @type buckets: dict[float, int]
+        The number of values below each bound (and at least half of it), by
+        bound. Values of 0 are counted under the bound 0.
+    """
+    def __init__(self):
+        """Initialize an empty Histogram.
+
+        @type self: Histogram
+        @rtype: None
+        """
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, value):
+        """Add <value> to this histogram.
+
+        @type self: Histogram
+        @type value: float
+        @rtype: None
+        """
+        self.count += 1
+        self.total += value
+        self.last = value
+        self.max = max(self.max, value)
+        bound = math.ldexp(1, math.frexp(value)[1]) if value > 0 else 0
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+
+    def mean(self):
+        """Return the mean of the values, or 0 if there are none.
+
+        @type self: Histogram
+        @rtype: float
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        """Return a bound below which at least <fraction> of the values lie.
+
+        @type self: Histogram
+        @type fraction: float
+        @rtype: float
+        """
+        seen = 0
+        for bound in sorted(self.buckets):
+            seen += self.buckets[bound]
+            if seen >= fraction * self.count:
+                return min(bound, self.max)
+        return 0.0
+
+    def merge(self, other):
+        """Add the values of <other> to this histogram.
+
+        @type self: Histogram
+        @type other: Histogram
+        @rtype: None
+        """
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.last = other.last
+        self.max = max(self.max, other.max)
+        for bound, count in other.buckets.items():
+            self.buckets[bound] = self.buckets.get(bound, 0) + count
+
+    def to_dict(self):
+        """Return this histogram as a dictionary that can be saved as JSON.
+
+        @type self: Histogram
+        @rtype: dict
+        """
+        return {'count': self.count, 'total': self.total, 'last': self.last,
+                'max': self.max, 'mean': self.mean(),
+                'p50': self.percentile(0.5), 'p99': self.percentile(0.99),
+                'buckets': [[bound, count] for bound, count
+                            in sorted(self.buckets.items())]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return the histogram saved as <data> by to_dict.
+
+        @type cls: type
+        @type data: dict
+        @rtype: Histogram
+        """
+        histogram = cls()
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.last = data['last']
+        histogram.max = data['max']
+        histogram.buckets = {bound: count for bound, count in data['buckets']}
+        return histogram
+
+
+class Stats:
+    """Counters and timings of the phases of the treemap.
+
+    === Public Attributes ===
+    @type enabled: bool
+        Whether statistics are being kept; when False, timer and count do
+        nothing.
+    @type timings: dict[str, Histogram]
+        The milliseconds taken by each phase, by name.
+    @type counters: dict[str, Histogram]
+        The amounts counted at each call of count, by name; the total of a
+        counter is the total of its histogram.
+    """
+    def __init__(self, enabled=False):
+        """Initialize a new Stats with no statistics.
+
+        @type self: Stats
+        @type enabled: bool
+        @rtype: None
+        """
+        self.enabled = enabled
+        self.timings = {}
+        self.counters = {}
+
+    def timer(self, phase):
+        """Return a context manager timing the phase <phase>.
+
+        @type self: Stats
+        @type phase: str
+        @rtype: contextmanager
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._timer(phase)
+
+    @contextmanager
+    def _timer(self, phase):
+        """Time the block of the with statement as the phase <phase>.
+
+        @type self: Stats
+        @type phase: str
+        @rtype: contextmanager
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, (time.perf_counter() - start) * 1000)
+
+    def record(self, phase, milliseconds):
+        """Record that the phase <phase> took <milliseconds>.
+
+        @type self: Stats
+        @type phase: str
+        @type milliseconds: float
+        @rtype: None
+        """
+        if self.enabled:
+            self.timings.setdefault(phase, Histogram()).add(milliseconds)
+
+    def count(self, name, amount=1):
+        """Add <amount> to the counter <name>.
+
+        @type self: Stats
+        @type name: str
+        @type amount: int
+        @rtype: None
+        """
+        if self.enabled:
+            self.counters.setdefault(name, Histogram()).add(amount)
+
+    def reset(self):
+        """Forget every statistic kept so far.
+
+        @type self: Stats
+        @rtype: None
+        """
+        self.timings = {}
+        self.counters = {}
+
+    def merge(self, data):
+        """Add the statistics saved as <data> by to_dict to these ones.
+
+        @type self: Stats
+        @type data: dict
+        @rtype: None
+        """
+        for name, own in (('timings', self.timings),
+                          ('counters', self.counters)):
+            for key, histogram in data[name].items():
+                own.setdefault(key, Histogram()).merge(
+                    Histogram.from_dict(histogram))
+
+    def to_dict(self):
+        """Return these statistics as a dictionary that can be saved as
+        JSON.
+
+        @type self: Stats
+        @rtype: dict
+        """
+        return {'timings': {phase: histogram.to_dict() for phase, histogram
+                            in sorted(self.timings.items())},
+                'counters': {name: histogram.to_dict() for name, histogram
+                             in sorted(self.counters.items())}}
+
+    def dump(self, path):
+        """Save these statistics to the JSON file at <path>.
+
+        @type self: Stats
+        @type path: str
+        @rtype: None
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def summary(self):
+        """Return a line describing each timing and counter, for display.
+
+        Each line gives the last value, the mean and the maximum.
+
+        @type self: Stats
+        @rtype: list[str]
+        """
+        lines = ['{:<20} {:>8.1f} ms  mean {:>7.1f}  max {:>7.1f}'.format(
+            phase, histogram.last, histogram.mean(), histogram.max)
+                 for phase, histogram in sorted(self.timings.items())]
+        lines.extend('{:<20} {:>8d}     mean {:>7.0f}  max {:>7d}'.format(
+            name, int(histogram.last), histogram.mean(), int(histogram.max))
+                     for name, histogram in sorted(self.counters.items()))
+        return lines
+
+
+# The statistics kept by every module of the treemap.
+STATS = Stats()
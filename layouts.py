@@ -0,0 +1,270 @@
+"""Assignment 2: Treemap Layouts
+
+=== Module Description ===
+This module contains the layout algorithms that decide how the rectangle of
+a tree is shared between its subtrees. The same layout is used to draw a
+treemap and to find the leaf under the mouse (see spatial_index), so the two
+always agree.
+
+Every layout has a name and a single method,
+partition(subtrees, total, rect), which returns the (subtree, rectangle)
+pairs of the subtrees that get a rectangle, in the order they are drawn in,
+and the rows they were placed in. A row is a band across the top, or a
+column down the left side, of what is left of <rect> once the rows before
+it have been placed, and its rectangles are side by side along it. The
+rectangles of the subtrees tile <rect> exactly, and never overlap.
+
+  - SLICE_AND_DICE splits the rectangle along its longer side, in the order
+    of the subtrees. It is the fastest layout, O(n) for n subtrees, but a
+    folder with many files becomes a row of thin slivers.
+  - SQUARIFIED sorts the subtrees by size and fills the rectangle with rows
+    of them, laid along its shorter side, starting a new row as soon as
+    adding a subtree would make the row's rectangles less square. It gives
+    the squarest rectangles, but does not keep the subtrees in order. The
+    sort makes it O(n log n); building the rows is O(n).
+  - STRIP keeps the subtrees in order, and fills the rectangle with rows of
+    them parallel to its longer side, using the same rule as SQUARIFIED to
+    end each row. It is O(n).
+
+SQUARIFIED and STRIP give no rectangle to subtrees of size 0. Each row
+gets a thickness, and each rectangle in a row a length, proportional to
+their sizes and rounded down; the last row and the last rectangle of each
+row take whatever is left, so that no pixels are lost.
+
+LAYOUTS maps the name of each layout to the layout.
+"""
+
+
+class SliceAndDiceLayout:
+    """The slice-and-dice layout.
+
+    === Public Attributes ===
+    @type name: str
+        The name of this layout.
+    """
+    name = 'slice-and-dice'
+
+    def partition(self, subtrees, total, rect):
+        """Share <rect> between <subtrees>, in proportion to their
+        data_size.
+
+        The rectangle is split vertically if it is wider than it is tall,
+        and horizontally otherwise. Each subtree gets a share proportional
+        to its size, rounded down, except for the last subtree of non-zero
+        size, which takes whatever is left. Subtrees after it get nothing.
+        The subtrees that get a rectangle make up a single row.
+
+        Return the (subtree, rectangle) pairs, and, for each row, the
+        number of pairs up to its end and whether it is a band across the
+        top of what is left of <rect> (rather than a column down its left
+        side).
+
+        Precondition: <total> is the sum of the data_size of <subtrees>, and
+        is greater than 0.
+
+        @type self: SliceAndDiceLayout
+        @type subtrees: list[AbstractTree]
+        @type total: int
+        @type rect: (int, int, int, int)
+        @rtype: (list[(AbstractTree, (int, int, int, int))], list[(int, bool)])
+        """
+        last_index = len(subtrees) - 1
+        while subtrees[last_index].data_size == 0:
+            last_index -= 1
+        x, y, width, height = rect
+        # width > height: split vertically. Otherwise split horizontally.
+        vertical = width > height
+        length = width if vertical else height
+        result = []
+        offset = 0
+        for index in range(last_index + 1):
+            subtree = subtrees[index]
+            if index < last_index:
+                share = int(length * subtree.data_size / total)
+            else:
+                share = length - offset
+            if vertical:
+                result.append((subtree, (x + offset, y, share, height)))
+            else:
+                result.append((subtree, (x, y + offset, width, share)))
+            offset += share
+        return result, [(len(result), vertical)]
+
+
+class SquarifiedLayout:
+    """The squarified layout.
+
+    === Public Attributes ===
+    @type name: str
+        The name of this layout.
+    """
+    name = 'squarified'
+
+    def partition(self, subtrees, total, rect):
+        """Share <rect> between <subtrees>, in proportion to their
+        data_size, and return the result as SliceAndDiceLayout.partition
+        does.
+
+        The largest subtrees come first, and each row is laid along the
+        shorter side of what is left of <rect>.
+
+        Precondition: <total> is the sum of the data_size of <subtrees>, and
+        is greater than 0.
+
+        @type self: SquarifiedLayout
+        @type subtrees: list[AbstractTree]
+        @type total: int
+        @type rect: (int, int, int, int)
+        @rtype: (list[(AbstractTree, (int, int, int, int))], list[(int, bool)])
+        """
+        items = sorted(((subtree, subtree.data_size) for subtree in subtrees
+                        if subtree.data_size > 0), key=lambda item: -item[1])
+        return _fill_rows(items, total, rect, None)
+
+
+class StripLayout:
+    """The strip layout.
+
+    === Public Attributes ===
+    @type name: str
+        The name of this layout.
+    """
+    name = 'strip'
+
+    def partition(self, subtrees, total, rect):
+        """Share <rect> between <subtrees>, in proportion to their
+        data_size, and return the result as SliceAndDiceLayout.partition
+        does.
+
+        The subtrees keep their order, and every row is parallel to the
+        longer side of <rect>.
+
+        Precondition: <total> is the sum of the data_size of <subtrees>, and
+        is greater than 0.
+
+        @type self: StripLayout
+        @type subtrees: list[AbstractTree]
+        @type total: int
+        @type rect: (int, int, int, int)
+        @rtype: (list[(AbstractTree, (int, int, int, int))], list[(int, bool)])
+        """
+        items = [(subtree, subtree.data_size) for subtree in subtrees
+                 if subtree.data_size > 0]
+        return _fill_rows(items, total, rect, rect[2] >= rect[3])
+
+
+SLICE_AND_DICE = SliceAndDiceLayout()
+SQUARIFIED = SquarifiedLayout()
+STRIP = StripLayout()
+
+LAYOUTS = {layout.name: layout
+           for layout in (SLICE_AND_DICE, SQUARIFIED, STRIP)}
+
+
+def _fill_rows(items, total, rect, across):
+    """Lay out <items> in rows filling <rect>, in the order of <items>, and
+    return the result as SliceAndDiceLayout.partition does.
+
+    <items> contains (subtree, size) pairs, all with a size greater than 0,
+    whose sizes add up to <total>. If <across> is None, each row is laid
+    along the shorter side of what is left of <rect>, at its left or top.
+    Otherwise every row is a band across the top of what is left (if
+    <across> is True), or a column down its left side (if <across> is
+    False).
+
+    @type items: list[(AbstractTree, int)]
+    @type total: int
+    @type rect: (int, int, int, int)
+    @type across: bool | None
+    @rtype: (list[(AbstractTree, (int, int, int, int))], list[(int, bool)])
+    """
+    remaining = total
+    cells, rows = [], []
+    start = 0
+    while start < len(items):
+        x, y, width, height = rect
+        row_across = width < height if across is None else across
+        end = _row_end(items, start, width if row_across else height,
+                       width * height, remaining)
+        row_total = sum(size for _, size in items[start:end])
+        # the last row gets all of what is left, as row_total == remaining
+        if row_across:
+            thickness = height * row_total // remaining
+            length, position = width, x
+        else:
+            thickness = width * row_total // remaining
+            length, position = height, y
+        offset = 0
+        for subtree, size in items[start:end]:
+            offset += size
+            # rounding the running total keeps the rectangles adjacent
+            end_position = (x if row_across else y) + \
+                length * offset // row_total
+            if row_across:
+                cells.append((subtree, (position, y,
+                                        end_position - position, thickness)))
+            else:
+                cells.append((subtree, (x, position, thickness,
+                                        end_position - position)))
+            position = end_position
+        rows.append((len(cells), row_across))
+        if row_across:
+            rect = (x, y + thickness, width, height - thickness)
+        else:
+            rect = (x + thickness, y, width - thickness, height)
+        remaining -= row_total
+        start = end
+    return cells, rows
+
+
+def _row_end(items, start, length, area, remaining):
+    """Return the end of the row of <items> starting at <start>.
+
+    The row is laid along a side of length <length> of a rectangle of area
+    <area>, which is shared by the items of total size <remaining> from
+    <start> on. Items are added to the row as long as that does not make
+    its least square rectangle (the one with the largest ratio between its
+    longer and shorter sides) less square, so each item costs O(1).
+
+    @type items: list[(AbstractTree, int)]
+    @type start: int
+    @type length: int
+    @type area: int
+    @type remaining: int
+    @rtype: int
+    """
+    if length == 0 or area == 0:
+        # nothing can be seen; put every item in one row
+        return len(items)
+    # an item of size s in a row of total size S laid along <length> has
+    # sides in the ratio s * scale / S ** 2
+    scale = length * length * remaining / area
+    row_total = smallest = largest = items[start][1]
+    worst = _worst_ratio(scale, row_total, smallest, largest)
+    end = start + 1
+    while end < len(items):
+        size = items[end][1]
+        ratio = _worst_ratio(scale, row_total + size, min(smallest, size),
+                             max(largest, size))
+        if ratio > worst:
+            break
+        row_total += size
+        smallest = min(smallest, size)
+        largest = max(largest, size)
+        worst = ratio
+        end += 1
+    return end
+
+
+def _worst_ratio(scale, row_total, smallest, largest):
+    """Return the largest ratio between the longer and shorter sides of the
+    rectangles of a row.
+
+    @type scale: float
+    @type row_total: int
+    @type smallest: int
+    @type largest: int
+    @rtype: float
+    """
+    squared = row_total * row_total
+    return max(scale * largest / squared, squared / (scale * smallest))
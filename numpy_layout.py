@@ -0,0 +1,299 @@
+"""Assignment 2: Vectorised Treemap Layout
+
+=== Module Description ===
+This module contains an alternative layout engine for the slice-and-dice
+treemap algorithm implemented by AbstractTree.generate_treemap.
+
+Instead of making one Python call per node, the tree is flattened once into
+contiguous arrays (parent index, child offsets, data_size, colour), and then
+every level of the tree is split with a handful of batched NumPy operations.
+Flattening visits every node in Python, so it costs several times more than
+the layout itself; flatten keeps the arrays with the tree, and builds them
+again only once the tree has changed.
+
+The rectangles produced are identical to those of the recursive
+implementation, including its truncation of every partition to an int and
+the adjustment of the last non-empty subtree so that the widths (or heights)
+add up to the full rectangle. The arithmetic is done in double precision,
+exactly like the recursive implementation, so the results agree as long as
+each product of a rectangle side and a data_size is below 2 ** 53.
+
+Placeholder leaves (see FileSystemTree) are expanded when they are laid out
+in a large enough rectangle, as the recursive implementation does; the tree
+is then flattened again and laid out once more, until no placeholder is left
+to expand.
+
+Only the slice-and-dice layout is implemented; trees given another layout
+(see AbstractTree.set_layout) must use the 'python' engine.
+"""
+import numpy as np
+
+from layouts import SLICE_AND_DICE
+from tree_data import LAZY_EXPAND_AREA
+
+
+class FlatTree:
+    """A flattened, array-based copy of the structure of an AbstractTree.
+
+    Nodes are numbered in breadth-first order, so the subtrees of every node
+    occupy a contiguous range of indices, and so does every level of the tree.
+
+    The flattened copy does not follow later changes to the tree it was
+    built from; use flatten to get a FlatTree that is up to date.
+
+    === Public Attributes ===
+    @type nodes: list[AbstractTree]
+        The tree nodes, in breadth-first order.
+    @type parent: numpy.ndarray
+        The index of the parent of each node, or -1 for the root.
+    @type first_child: numpy.ndarray
+        The index of the first subtree of each node.
+    @type child_count: numpy.ndarray
+        The number of subtrees of each node.
+    @type data_size: numpy.ndarray
+        The data_size of each node.
+    @type colours: numpy.ndarray
+        An (N, 3) array with the colour of each node.
+    @type levels: list[(int, int)]
+        The (start, end) range of node indices of each level of the tree.
+
+    === Private Attributes ===
+    @type _visible: numpy.ndarray
+        Whether each node is a non-empty tree with data_size > 0.
+    @type _lazy: numpy.ndarray
+        Whether each node is a placeholder that has not been expanded.
+    @type _preorder: numpy.ndarray
+        The position of each node in a pre-order traversal of the tree.
+    """
+    def __init__(self, tree):
+        """Flatten <tree> into arrays.
+
+        Raise ValueError if <tree> uses a layout other than slice-and-dice.
+
+        @type self: FlatTree
+        @type tree: AbstractTree
+        @rtype: None
+        """
+        if tree.get_layout() is not SLICE_AND_DICE:
+            raise ValueError('The numpy engine only supports the {} layout, '
+                             'not {}'.format(SLICE_AND_DICE.name,
+                                             tree.get_layout().name))
+        nodes = [tree]
+        parent = [np.full(1, -1, dtype=np.int64)]
+        child_count = []
+        self.levels = []
+        # breadth-first traversal, one whole level at a time
+        level = [tree]
+        while level:
+            start = len(nodes) - len(level)
+            self.levels.append((start, len(nodes)))
+            counts = [len(node._subtrees) for node in level]
+            child_count.extend(counts)
+            level = [subtree for node in level for subtree in node._subtrees]
+            nodes.extend(level)
+            parent.append(np.repeat(np.arange(start, start + len(counts)),
+                                    counts))
+
+        self.nodes = nodes
+        self.parent = np.concatenate(parent)
+        self.child_count = np.array(child_count, dtype=np.int64)
+        self.first_child = np.cumsum(self.child_count) - self.child_count + 1
+        self.data_size = np.array([node.data_size for node in nodes],
+                                  dtype=np.float64)
+        self.colours = np.array([node.colour for node in nodes],
+                                dtype=np.uint8).reshape(-1, 3)
+
+        non_empty = np.array([not node.is_empty() for node in nodes])
+        self._visible = non_empty & (self.data_size > 0)
+        self._lazy = np.fromiter((node._lazy for node in nodes), dtype=bool,
+                                 count=len(nodes))
+        self._preorder = self._compute_preorder()
+
+    def _compute_preorder(self):
+        """Return the pre-order position of every node.
+
+        The position of a subtree is one past the position of its parent,
+        plus the number of nodes in all of its earlier siblings.
+
+        @type self: FlatTree
+        @rtype: numpy.ndarray
+        """
+        count = np.ones(len(self.nodes), dtype=np.int64)
+        for start, end in reversed(self.levels[1:]):
+            np.add.at(count, self.parent[start:end], count[start:end])
+
+        preorder = np.zeros(len(self.nodes), dtype=np.int64)
+        for start, end in self.levels[1:]:
+            parents = self.parent[start:end]
+            before = _exclusive_group_cumsum(count[start:end],
+                                             self.first_child[parents] - start)
+            preorder[start:end] = preorder[parents] + 1 + before
+        return preorder
+
+    def layout_leaves(self, rect, min_area=0):
+        """Run the treemap algorithm and return the visible leaves.
+
+        Return the indices (into self.nodes) of every non-empty leaf with
+        data_size > 0, in the same order as AbstractTree.generate_treemap,
+        together with an (N, 4) array of their (x, y, width, height).
+        Subtrees whose rectangle covers fewer than <min_area> pixels are
+        returned in place of their leaves (see AbstractTree.set_lod_area).
+
+        @type self: FlatTree
+        @type rect: (int, int, int, int)
+        @type min_area: int
+        @rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        rects = np.zeros((len(self.nodes), 4), dtype=np.int64)
+        rects[0] = rect
+        reached = np.zeros(len(self.nodes), dtype=bool)
+        reached[0] = self._visible[0]
+
+        for start, end in self.levels[1:]:
+            self._split_level(start, end, rects, reached, min_area)
+
+        shown = (self.child_count == 0) | \
+            (rects[:, 2] * rects[:, 3] < min_area)
+        leaves = np.flatnonzero(reached & shown)
+        leaves = leaves[np.argsort(self._preorder[leaves], kind='stable')]
+        return leaves, rects[leaves]
+
+    def layout(self, rect, min_area=0):
+        """Run the treemap algorithm and return the rectangles and colours.
+
+        This is the array equivalent of AbstractTree.generate_treemap: row i
+        of the first array is the (x, y, width, height) of the i-th rectangle
+        that generate_treemap would return, and row i of the second array is
+        its (r, g, b) colour. <min_area> is the LOD area, as in layout_leaves.
+
+        @type self: FlatTree
+        @type rect: (int, int, int, int)
+        @type min_area: int
+        @rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        leaves, rects = self.layout_leaves(rect, min_area)
+        return rects, self.colours[leaves]
+
+    def _split_level(self, start, end, rects, reached, min_area=0):
+        """Partition the rectangles of one level among their subtrees.
+
+        Fill in the rectangles of nodes <start> to <end> (one whole level),
+        and mark the ones the recursive algorithm would visit as reached.
+        Subtrees of parents covering fewer than <min_area> pixels are not
+        reached.
+
+        @type self: FlatTree
+        @type start: int
+        @type end: int
+        @type rects: numpy.ndarray
+        @type reached: numpy.ndarray
+        @type min_area: int
+        @rtype: None
+        """
+        parents = self.parent[start:end]
+        position = np.arange(start, end) - self.first_child[parents]
+        group_start = self.first_child[parents] - start
+        sizes = self.data_size[start:end]
+
+        # index of the last subtree with data_size > 0 among its siblings
+        last = np.full(end - start, -1, dtype=np.int64)
+        nonzero = sizes > 0
+        np.maximum.at(last, group_start[nonzero], position[nonzero])
+        last = last[group_start]
+
+        parent_rects = rects[parents]
+        vertical = parent_rects[:, 2] > parent_rects[:, 3]
+        length = np.where(vertical, parent_rects[:, 2], parent_rects[:, 3])
+
+        # int() truncation of each share, except for the last non-empty one
+        total = self.data_size[parents]
+        share = np.zeros(end - start)
+        np.divide(length * sizes, total, out=share, where=total > 0)
+        share = np.floor(share)
+        share = np.where(position < last, share, 0).astype(np.int64)
+        offset = _exclusive_group_cumsum(share, group_start)
+        share = np.where(position == last, length - offset, share)
+
+        # subtrees after the last non-empty one are never visited, and
+        # neither are those of parents drawn as a whole
+        reached[start:end] = (reached[parents] & (position <= last)
+                              & self._visible[start:end]
+                              & (parent_rects[:, 2] * parent_rects[:, 3]
+                                 >= min_area))
+
+        level_rects = parent_rects.copy()
+        level_rects[:, 0] += np.where(vertical, offset, 0)
+        level_rects[:, 1] += np.where(vertical, 0, offset)
+        level_rects[:, 2] = np.where(vertical, share, parent_rects[:, 2])
+        level_rects[:, 3] = np.where(vertical, parent_rects[:, 3], share)
+        rects[start:end] = level_rects
+
+
+def _exclusive_group_cumsum(values, group_start):
+    """Return the sum of the earlier values within each group.
+
+    The values are arranged in contiguous groups, and group_start[i] is the
+    position of the first value in the group containing values[i].
+
+    @type values: numpy.ndarray
+    @type group_start: numpy.ndarray
+    @rtype: numpy.ndarray
+    """
+    exclusive = np.cumsum(values) - values
+    return exclusive - exclusive[group_start]
+
+
+def flatten(tree):
+    """Return a FlatTree of <tree>.
+
+    The FlatTree is kept with <tree>, along with the _version of <tree> it
+    was built at, and is only built again once <tree> has changed.
+
+    Raise ValueError if <tree> uses a layout other than slice-and-dice.
+
+    @type tree: AbstractTree
+    @rtype: FlatTree
+    """
+    cached = tree._get_extra('flat tree')
+    if cached is not None and cached[0] == tree._version and \
+            tree.get_layout() is SLICE_AND_DICE:
+        return cached[1]
+    flat_tree = FlatTree(tree)
+    tree._set_extra('flat tree', (tree._version, flat_tree))
+    return flat_tree
+
+
+def layout_tree(tree, rect):
+    """Run the treemap algorithm on <tree>, and return its FlatTree
+    together with the visible leaves, as returned by its layout_leaves.
+
+    Every placeholder that is laid out in a rectangle large enough to show
+    its subtrees (see AbstractTree._expand_to_fit) is expanded first, so
+    that the leaves are those of generate_treemap with the 'python' engine.
+
+    @type tree: AbstractTree
+    @type rect: (int, int, int, int)
+    @rtype: (FlatTree, numpy.ndarray, numpy.ndarray)
+    """
+    min_area = tree.get_lod_area()
+    while True:
+        flat_tree = flatten(tree)
+        leaves, rects = flat_tree.layout_leaves(rect, min_area)
+        large = rects[:, 2] * rects[:, 3] >= max(LAZY_EXPAND_AREA, min_area)
+        placeholders = leaves[flat_tree._lazy[leaves] & large]
+        if len(placeholders) == 0:
+            return flat_tree, leaves, rects
+        # expanding changes the tree, so it is flattened again
+        for index in placeholders.tolist():
+            flat_tree.nodes[index].expand()
+
+
+def generate_treemap_arrays(tree, rect):
+    """Return the treemap of <tree> as a rectangle array and a colour array.
+
+    @type tree: AbstractTree
+    @type rect: (int, int, int, int)
+    @rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    flat_tree, leaves, rects = layout_tree(tree, rect)
+    return rects, flat_tree.colours[leaves]
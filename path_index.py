@@ -0,0 +1,151 @@
+"""Assignment 2: Path Index
+
+=== Module Description ===
+This module contains an index used to find the node of a tree at a given
+path (e.g., the path of a file), without searching the subtrees of every
+folder along the way.
+
+The index maps each (parent, name) pair to the subtree of the parent with
+that name. Finding the node at a path therefore costs one dictionary lookup
+per name in the path, however many subtrees each folder has, and the index
+holds one entry per node rather than a copy of the full path of every node.
+
+The index is built the first time a path is looked up in a tree (see
+AbstractTree.find_path), and kept up to date from then on: subtrees added
+with add_subtree or expanded from placeholders are added to it, and
+deleted subtrees are removed from it along with everything below them.
+Going the other way, from a node to its path, only needs the names of its
+ancestors (see AbstractTree.get_path).
+"""
+
+
+class PathIndex:
+    """An index of the nodes of a tree, by the names along their paths.
+
+    If several subtrees of a node have the same name, the first of them (in
+    the order of the subtrees) is found.
+
+    === Public Attributes ===
+    @type tree: AbstractTree
+        The tree that was indexed.
+
+    === Private Attributes ===
+    @type _children: dict[(AbstractTree, object), AbstractTree]
+        The subtree of each indexed node with each name, by node and name.
+    @type _shared: set[(AbstractTree, object)]
+        The keys of _children shared by several subtrees of the same node.
+        Only these need a search of the subtrees when one is added or
+        removed.
+    """
+    def __init__(self, tree):
+        """Initialize an index of every node of <tree>.
+
+        @type self: PathIndex
+        @type tree: AbstractTree
+        @rtype: None
+        """
+        self.tree = tree
+        self._children = {}
+        self._shared = set()
+        self._add_below(tree)
+
+    def find(self, tree, names):
+        """Return the node at the end of the path <names>, starting at
+        <tree>, or None if there is no such node.
+
+        The first name is the name of <tree> itself.
+
+        Precondition: <tree> is <self.tree> or one of its indexed subtrees.
+
+        @type self: PathIndex
+        @type tree: AbstractTree
+        @type names: list[object]
+        @rtype: AbstractTree | None
+        """
+        if not names or tree.is_empty() or names[0] != tree._root:
+            return None
+        for name in names[1:]:
+            tree = self._children.get((tree, name))
+            if tree is None:
+                return None
+        return tree
+
+    def add(self, tree):
+        """Add <tree>, which has just become a subtree of an indexed node,
+        and every node below it to this index.
+
+        @type self: PathIndex
+        @type tree: AbstractTree
+        @rtype: None
+        """
+        key = (tree._parent_tree, tree._root)
+        if key in self._children:
+            # it may have been inserted before the subtree found so far
+            self._shared.add(key)
+            self._children[key] = self._first_subtree(key)
+        else:
+            self._children[key] = tree
+        self._add_below(tree)
+
+    def remove(self, tree):
+        """Remove <tree>, which is about to be deleted, and every node below
+        it from this index.
+
+        @type self: PathIndex
+        @type tree: AbstractTree
+        @rtype: None
+        """
+        key = (tree._parent_tree, tree._root)
+        if key in self._shared:
+            # another subtree of the same name may be found instead
+            replacement = self._first_subtree(key, tree)
+            if replacement is None:
+                self._shared.discard(key)
+                del self._children[key]
+            else:
+                self._children[key] = replacement
+        elif self._children.get(key) is tree:
+            del self._children[key]
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            for subtree in node._subtrees:
+                key = (node, subtree._root)
+                self._children.pop(key, None)
+                self._shared.discard(key)
+                stack.append(subtree)
+
+    def _first_subtree(self, key, excluded=None):
+        """Return the first non-empty subtree of key[0] named key[1], other
+        than <excluded>, or None if there is none.
+
+        @type self: PathIndex
+        @type key: (AbstractTree, object)
+        @type excluded: AbstractTree | None
+        @rtype: AbstractTree | None
+        """
+        parent, name = key
+        for subtree in parent._subtrees:
+            if subtree._root == name and subtree is not excluded and \
+                    not subtree.is_empty():
+                return subtree
+        return None
+
+    def _add_below(self, tree):
+        """Add every node below <tree> to this index.
+
+        @type self: PathIndex
+        @type tree: AbstractTree
+        @rtype: None
+        """
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            for subtree in node._subtrees:
+                if not subtree.is_empty():
+                    key = (node, subtree._root)
+                    if key in self._children:
+                        self._shared.add(key)
+                    else:
+                        self._children[key] = subtree
+                    stack.append(subtree)
@@ -16,6 +16,13 @@ tool to get a nice interactive graphical representation of this data.
 NOTE: You'll need an Internet connection to access the World Bank API
 to get started working on this assignment.
 
+Population trees can also be loaded from local files: World Bank bulk CSV
+exports (load_world_bank_csv), saved World Bank API responses
+(load_world_bank_json), or any CSV file of named values in nested groups,
+such as city or district populations (load_csv). These read their input one
+record at a time and build the tree in a single linear pass, so they can
+handle files with millions of rows.
+
 Recommended steps:
 1. Read through all docstrings in this files once. There's a lot to take in,
    so don't feel like you need to understand it all the first time.
@@ -33,11 +40,11 @@ Recommended steps:
    create the region and country nodes directly, without trying to access
    the World Bank API again).
 """
-#TODO get separator
+import csv
 import json
-import urllib.request as request
 
-from tree_dataold import AbstractTree
+from data_sources import CachedSource, HttpSource, default_cache_directory
+from tree_data import AbstractTree
 
 
 # Constants for the World Bank API urls.
@@ -50,6 +57,18 @@ WORLD_BANK_REGIONS = (
     WORLD_BANK_BASE + '?format=json&date=2014:2014&per_page=310'
 )
 
+# Where the World Bank data is requested from. Responses are kept on the
+# disk and reused for a day, so only the first run needs a connection. To
+# work offline from saved responses, replace this with
+# CachedSource(FixtureSource(folder), ...) or just FixtureSource(folder).
+DATA_SOURCE = CachedSource(HttpSource(), default_cache_directory())
+
+# The region the World Bank gives to aggregates such as 'World'.
+AGGREGATES_REGION = 'Aggregates'
+
+# The region of countries whose region is not known.
+UNKNOWN_REGION = 'Unknown region'
+
 
 class PopulationTree(AbstractTree):
     """A tree representation of country population data.
@@ -64,6 +83,8 @@ class PopulationTree(AbstractTree):
 
     See https://datahelpdesk.worldbank.org/ for details about this API.
     """
+    __slots__ = ()
+
     def __init__(self, world, root=None, subtrees=None, data_size=0):
         """Initialize a new PopulationTree.
 
@@ -95,6 +116,7 @@ class PopulationTree(AbstractTree):
         """
         return ","
 
+
 def _load_data():
     """Create a list of trees corresponding to different world regions.
 
@@ -106,105 +128,324 @@ def _load_data():
     # Get data from World Bank API.
     country_populations = _get_population_data()
     regions = _get_region_data()
-    country_list = []
-    PopulationTree_list = []
-    #TODO expand for loops. Make it look cleaner
-    for country in country_populations:
-        if country_populations[country] is not None:
-            pop_size = int(country_populations[country])
-            leaf = PopulationTree(False, country, None, pop_size)
-            country_list.append(leaf)
-    for region in regions:
-        region_country = []
-        #TODO inefficient
-        for country in regions[region]:
-            for countree in country_list:
-                if countree._root == country:
-                    region_country.append(countree)
-                    country_list.remove(countree)
-        region_tree = PopulationTree(False, region, region_country)
-        PopulationTree_list.append(region_tree)
-
-    return PopulationTree_list
-
-    # TODO: create PopulationTree objects for each country and region.
-    # Be sure to read the docstring of the PopulationTree constructor to see
-    # how to call it.
-    # You'll want to complete the two helpers called above first (otherwise
-    # this function won't run).
-    # You can complete this functions *without* using recursion.
-    # Remember that each region tree has only two levels:
-    #   - a root storing the name of the region
-    #   - zero or more leaves, each representing a country in the region
-
+    return _build_subtrees(_region_records(country_populations, regions))
 
 
 def _get_population_data():
     """Return country population data from the World Bank.
 
-    The return value is a dictionary, where the keys are country names,
-    and the values are the corresponding populations of those countries.
+    The return value is a list of (code, name, population) tuples, one for
+    every country or aggregate (e.g., 'World') in the response, where code
+    is its ISO 3166 alpha-2 code.
 
     Ignore all countries that do not have any population data,
     or population data that cannot be read as an int.
 
-    @rtype: dict[str, int]
+    @rtype: list[(str, str, int)]
     """
-    # We are doing some pre-processing of the data for you.
     # The first element returned is ignored because it's just metadata.
-    # The second element's first 47 elements are ignored because they aren't
-    # countries.
+    # Aggregates are told apart from countries by the region data, not by
+    # their position in the response.
     _, population_data = _get_json_data(WORLD_BANK_POPULATIONS)
-    population_data = population_data[47:]
-    countries = {}
-    for data in population_data:
-        countries[data['country']['value']] = data['value']
-
-    # The following line is a good place to put a breakpoint, so that you can
-    # pause the program and use the debugger to inspect the contents of
-    # population_data.
-
-    return countries
+    return list(_population_records(population_data))
 
 
 def _get_region_data():
     """Return country region data from the World Bank.
 
-    The return value is a dictionary, where the keys are region names,
-    and the values a list of country names contained in that region.
-
-    Ignore all regions that do not contain any countries.
+    The return value maps the ISO 3166 alpha-2 and alpha-3 codes and the
+    name of every country to the name of its region, and those of every
+    aggregate (e.g., 'World', 'High income') to None.
 
-    @rtype: dict[str, list[str]]
+    @rtype: dict[str, str | None]
     """
     # We ignore the first component of the returned JSON, which is metadata.
     _, country_data = _get_json_data(WORLD_BANK_REGIONS)
+    return _index_countries(country_data)
 
-    # The following line is a good place to put a breakpoint to help inspect
-    # the contents of country_data.
-    regions = {}
 
-    for data in country_data:
-        if 'name' in data:
-            if data['region']['value'] not in regions:
-                regions[data['region']['value']]  = [data['name']]
-            else:
-                regions[data['region']['value']].append(data['name'])
+def _population_records(population_data):
+    """Yield the (code, name, population) of every World Bank population
+    record in <population_data> that has a population.
+
+    @type population_data: iterable[dict]
+    @rtype: iterator[(str, str, int)]
+    """
+    for data in population_data:
+        if 'country' not in data:
+            # e.g., the metadata of a page of results
+            continue
+        size = _parse_size(data.get('value'))
+        if size is not None:
+            yield data['country']['id'], data['country']['value'], size
+
+
+def _index_countries(country_data):
+    """Return a dictionary from the codes and names of the countries in
+    <country_data> to their regions, in one pass over the data.
 
+    <country_data> contains records of the World Bank countries API.
+    Aggregates are mapped to None.
+
+    @type country_data: iterable[dict]
+    @rtype: dict[str, str | None]
+    """
+    regions = {}
+    for data in country_data:
+        if 'name' not in data:
+            continue
+        region = data['region']['value'].strip()
+        if region in ('', AGGREGATES_REGION):
+            region = None
+        for key in (data.get('iso2Code'), data.get('id'), data['name']):
+            if key:
+                regions[key] = region
     return regions
 
 
+def _region_records(country_populations, regions):
+    """Yield a ((region, country), population) record for every country.
+
+    Countries are looked up by code, then by name. Aggregates are skipped,
+    and countries without a known region are put in UNKNOWN_REGION rather
+    than dropped.
+
+    @type country_populations: iterable[(str, str, int)]
+    @type regions: dict[str, str | None]
+    @rtype: iterator[((str, str), int)]
+    """
+    for code, name, size in country_populations:
+        if code in regions:
+            region = regions[code]
+        else:
+            region = regions.get(name, UNKNOWN_REGION)
+        if region is not None:
+            yield (region, name), size
+
+
+def _parse_size(value):
+    """Return <value> as a non-negative int, or None if it isn't one.
+
+    @type value: object
+    @rtype: int | None
+    """
+    if value is None:
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        try:
+            size = int(float(value))
+        except (TypeError, ValueError, OverflowError):
+            return None
+    return size if size >= 0 else None
+
+
+def _build_subtrees(records):
+    """Return the subtrees of a tree holding <records>.
+
+    Each record is a (path, size) tuple, where path is a tuple of names:
+    the names of the groups (e.g., region, country, district) the leaf
+    belongs to, from the outermost, followed by the name of the leaf. The
+    records are read once, one at a time, and every node is created once,
+    so this takes linear time. Groups and leaves keep the order in which
+    they first appear in the records.
+
+    @type records: iterable[(tuple[str], int)]
+    @rtype: list[PopulationTree]
+    """
+    # every group is a [subgroups, leaves] pair until it is built
+    top = [{}, []]
+    for path, size in records:
+        group = top
+        for name in path[:-1]:
+            subgroups = group[0]
+            if name not in subgroups:
+                subgroups[name] = [{}, []]
+            group = subgroups[name]
+        group[1].append(PopulationTree(False, path[-1], None, size))
+
+    # build the groups bottom-up, with an explicit stack
+    built = {}
+    stack = [(None, top, False)]
+    while stack:
+        name, group, expanded = stack.pop()
+        if not expanded:
+            stack.append((name, group, True))
+            stack.extend((subname, subgroup, False)
+                         for subname, subgroup in group[0].items())
+            continue
+        subtrees = [built.pop(id(subgroup)) for subgroup in group[0].values()]
+        subtrees.extend(group[1])
+        if group is top:
+            return subtrees
+        built[id(group)] = PopulationTree(False, name, subtrees)
+
+
+def build_population_tree(records, root='World'):
+    """Return a PopulationTree holding <records>, with <root> at its root.
+
+    See _build_subtrees for the format of <records>, which can be any
+    iterable, e.g., a generator reading a file one line at a time.
+
+    @type records: iterable[(tuple[str], int)]
+    @type root: str
+    @rtype: PopulationTree
+    """
+    return PopulationTree(False, root, _build_subtrees(records))
+
+
+def load_csv(path, name_column, size_column, group_columns=(),
+             root='World'):
+    """Return a PopulationTree holding the rows of the CSV file at <path>.
+
+    Every row becomes a leaf named after its <name_column>, with the size
+    in its <size_column>, inside nested groups named after its
+    <group_columns> (outermost first); e.g., group_columns=('Country',
+    'Province') for a file of city populations. Rows without a size are
+    skipped. Lines before the header row are skipped too, as in the bulk
+    CSV exports of the World Bank.
+
+    The file is read one row at a time, so it can hold millions of rows.
+
+    @type path: str
+    @type name_column: str
+    @type size_column: str
+    @type group_columns: tuple[str]
+    @type root: str
+    @rtype: PopulationTree
+    """
+    columns = tuple(group_columns) + (name_column, size_column)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = _read_csv_rows(f, columns)
+        return build_population_tree(
+            ((row[:-1], size) for row in rows
+             for size in [_parse_size(row[-1])] if size is not None),
+            root)
+
+
+def load_world_bank_csv(data_path, metadata_path, year):
+    """Return a PopulationTree for <year> from a World Bank bulk CSV export.
+
+    <data_path> is the data file of the export (API_SP.POP.TOTL_...csv),
+    and <metadata_path> is its country metadata file
+    (Metadata_Country_API_...csv), which gives the region of each country.
+    Aggregates, which have no region, are skipped.
+
+    @type data_path: str
+    @type metadata_path: str
+    @type year: int | str
+    @rtype: PopulationTree
+    """
+    with open(metadata_path, newline='', encoding='utf-8-sig') as f:
+        regions = {code: region or None for code, region
+                   in _read_csv_rows(f, ('Country Code', 'Region'))}
+    with open(data_path, newline='', encoding='utf-8-sig') as f:
+        rows = _read_csv_rows(f, ('Country Code', 'Country Name', str(year)))
+        return build_population_tree(_region_records(
+            ((code, name, size) for code, name, value in rows
+             for size in [_parse_size(value)] if size is not None),
+            regions))
+
+
+def load_world_bank_json(data_path, countries_path):
+    """Return a PopulationTree from World Bank API responses saved to files.
+
+    <data_path> holds the response of the population indicator API (e.g.,
+    from WORLD_BANK_POPULATIONS), and <countries_path> that of the countries
+    API (e.g., from WORLD_BANK_REGIONS). Either file may also hold one
+    record per line instead. The population file is read in chunks, one
+    record at a time, so it can be much larger than the memory available.
+
+    @type data_path: str
+    @type countries_path: str
+    @rtype: PopulationTree
+    """
+    with open(countries_path, encoding='utf-8') as f:
+        regions = _index_countries(_iter_json_objects(f))
+    with open(data_path, encoding='utf-8') as f:
+        return build_population_tree(_region_records(
+            _population_records(_iter_json_objects(f)), regions))
+
+
+def _read_csv_rows(f, columns):
+    """Yield the values of <columns> in every row of the CSV file <f>.
+
+    The header is the first row containing all of <columns>; the rows
+    before it are skipped.
+
+    @type f: file
+    @type columns: tuple[str]
+    @rtype: iterator[tuple[str]]
+    """
+    reader = csv.reader(f)
+    for header in reader:
+        if all(column in header for column in columns):
+            break
+    else:
+        raise ValueError('No header with the columns {}'.format(columns))
+    indices = [header.index(column) for column in columns]
+    for row in reader:
+        if len(row) == len(header):
+            yield tuple(row[index] for index in indices)
+
+
+def _iter_json_objects(f, chunk_size=65536):
+    """Yield the JSON objects in the file <f>, reading it in chunks.
+
+    The objects may be the elements of an array, of an array nested in an
+    array (like the responses of the World Bank API), or on lines of their
+    own. Only one object is decoded at a time.
+
+    @type f: file
+    @type chunk_size: int
+    @rtype: iterator[object]
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    at_end = False
+    while True:
+        # skip the array brackets and separators between objects
+        start = 0
+        while start < len(buffer) and buffer[start] in ' \t\r\n,[]':
+            start += 1
+        buffer = buffer[start:]
+        if not buffer:
+            if at_end:
+                return
+            chunk = f.read(chunk_size)
+            at_end = not chunk
+            buffer = chunk
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except ValueError:
+            if at_end:
+                raise
+            # the object continues in the next chunk
+            chunk = f.read(chunk_size)
+            at_end = not chunk
+            buffer += chunk
+            continue
+        if end == len(buffer) and not at_end and not isinstance(value, dict):
+            # a number may continue in the next chunk
+            chunk = f.read(chunk_size)
+            at_end = not chunk
+            buffer += chunk
+            continue
+        yield value
+        buffer = buffer[end:]
+
 
 def _get_json_data(url):
     """Return a dictionary representing the JSON response from the given url.
 
-    You should not modify this function.
+    The response is requested from DATA_SOURCE.
 
     @type url: str
     @rtype: Dict
     """
-    response = request.urlopen(url)
-    return json.loads(response.read().decode())
+    return json.loads(DATA_SOURCE.get(url).decode())
 
 
 
@@ -0,0 +1,95 @@
+"""Assignment 2: Treemap Rasterisation
+
+=== Module Description ===
+This module turns the rectangles of a treemap into pixels in bulk, instead
+of making one pygame.draw.rect call per leaf.
+
+The rectangles of a treemap never overlap, so each one can be painted by
+adding its label (its position in the list, plus one) at its top-left and
+bottom-right corners of a difference image, and subtracting it at the other
+two corners. A running sum over both axes then gives every pixel the label
+of the rectangle covering it, or 0 if none does, and a single table lookup
+gives its colour. The cost is a few NumPy passes over the pixels, plus O(1)
+work per rectangle, however many rectangles there are.
+
+Rectangles follow the same rules as pygame.draw.rect: (x, y, width, height)
+covers the pixels x to x + width - 1 and y to y + height - 1. A rectangle
+less than one pixel wide or high covers no pixels, so the many tiny leaves
+of a large tree cost nothing beyond their share of the corner updates; the
+area they would have covered is already given to their last non-empty
+sibling by the treemap algorithm.
+"""
+import numpy as np
+
+from instrumentation import STATS
+from numpy_layout import generate_treemap_arrays
+
+
+def rasterise(rects, colours, area, background=(0, 0, 0)):
+    """Return the pixels of the treemap rectangles <rects> inside <area>.
+
+    <rects> and <colours> are either lists of the tuples produced by
+    AbstractTree.generate_treemap, or the arrays produced by
+    numpy_layout.FlatTree.layout. The result is a (width, height, 3) array
+    of the colours of the pixels of <area>, indexed by x and then y like the
+    arrays of pygame.surfarray. Pixels not covered by any rectangle are
+    given the <background> colour; the parts of rectangles outside <area>
+    are ignored.
+
+    Precondition: no two rectangles in <rects> overlap.
+
+    @type rects: list[(int, int, int, int)] | numpy.ndarray
+    @type colours: list[(int, int, int)] | numpy.ndarray
+    @type area: (int, int, int, int)
+    @type background: (int, int, int)
+    @rtype: numpy.ndarray
+    """
+    left, top, width, height = area
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    x0 = np.clip(rects[:, 0] - left, 0, width)
+    y0 = np.clip(rects[:, 1] - top, 0, height)
+    x1 = np.clip(rects[:, 0] + rects[:, 2] - left, x0, width)
+    y1 = np.clip(rects[:, 1] + rects[:, 3] - top, y0, height)
+
+    # the corners of every rectangle in the (width + 1, height + 1)
+    # difference image; empty rectangles cancel themselves out
+    labels = np.arange(1, len(rects) + 1, dtype=np.float64)
+    corners = np.concatenate([x0 * (height + 1) + y0,
+                              x1 * (height + 1) + y1,
+                              x0 * (height + 1) + y1,
+                              x1 * (height + 1) + y0])
+    weights = np.concatenate([labels, labels, -labels, -labels])
+    image = np.bincount(corners, weights,
+                        minlength=(width + 1) * (height + 1))
+    image = image.reshape(width + 1, height + 1)
+    np.cumsum(image, axis=0, out=image)
+    np.cumsum(image, axis=1, out=image)
+
+    palette = np.empty((len(rects) + 1, 3), dtype=np.uint8)
+    palette[0] = background
+    palette[1:] = np.asarray(colours, dtype=np.uint8).reshape(-1, 3)
+    return palette[image[:width, :height].astype(np.intp)]
+
+
+def rasterise_tree(tree, area, engine='python'):
+    """Lay out <tree> in <area> and return its pixels, as rasterise does.
+
+    With the 'numpy' engine the arrays of the layout are used as they are,
+    without building a tuple per rectangle. The two steps are timed as the
+    'layout' and 'rasterise' phases (see instrumentation).
+
+    @type tree: AbstractTree
+    @type area: (int, int, int, int)
+    @type engine: str
+    @rtype: numpy.ndarray
+    """
+    with STATS.timer('layout'):
+        if engine == 'numpy':
+            rects, colours = generate_treemap_arrays(tree, area)
+        else:
+            rects, colours = [], []
+            for rect, colour in tree.iter_treemap(area, engine):
+                rects.append(rect)
+                colours.append(colour)
+    with STATS.timer('rasterise'):
+        return rasterise(rects, colours, area)
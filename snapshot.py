@@ -0,0 +1,371 @@
+"""Assignment 2: Tree Snapshots
+
+=== Module Description ===
+This module saves a FileSystemTree to a compact binary file, and loads it
+back, so that a folder does not need to be scanned again every time the
+visualiser is started.
+
+A snapshot file contains, in order:
+  - a 40-byte header: the magic bytes, the byte order of the arrays, the
+    number of nodes N, the size of the string table, and the length of the
+    root path;
+  - five arrays of 64-bit integers: the parent of each node (-1 for the
+    root), its data_size, its folder modification time (-1 for files), the
+    index of its first subtree (N + 1 entries), and the offset of its name
+    in the string table (N + 1 entries);
+  - one byte per node: 1 if it is a placeholder for a folder that has not
+    been read yet, and 0 otherwise;
+  - the string table, holding every name encoded as UTF-8, back to back;
+  - the path the tree was read from.
+
+Nodes are stored in breadth-first order, so the subtrees of node i are the
+nodes first_child[i] to first_child[i + 1] - 1.
+
+A Snapshot maps the file into memory and reads the arrays in place, so
+opening one takes the same short time whatever the size of the tree, and
+several processes viewing the same snapshot share a single copy of it in
+the operating system's page cache. Snapshot.to_tree can also build the tree
+lazily: only the nodes that are expanded (e.g., by being laid out in a large
+enough rectangle) are ever built, so that a snapshot of millions of nodes
+can be shown at once.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from tree_data import FileSystemTree
+
+
+MAGIC = b'TREEMAP2'
+_HEADER = struct.Struct('<8sB7xQQQ')
+_BYTE_ORDERS = ('little', 'big')
+
+
+def save_snapshot(tree, path):
+    """Save <tree> to a snapshot file at <path>.
+
+    Empty subtrees are not saved. The subtrees of a tree built lazily from a
+    snapshot that have not been built yet are copied from that snapshot.
+    The file is written under a temporary name and then renamed, so that
+    programs that have the previous version of the snapshot open (including
+    this one) are not affected.
+
+    @type tree: FileSystemTree
+    @type path: str
+    @rtype: None
+    """
+    nodes = [tree]
+    parent = array('q', [-1])
+    first_child = array('q')
+    # breadth-first traversal; <nodes> doubles as the queue
+    index = 0
+    while index < len(nodes):
+        first_child.append(len(nodes))
+        subtrees = _saved_subtrees(nodes[index])
+        nodes.extend(subtrees)
+        parent.extend([index] * len(subtrees))
+        index += 1
+    first_child.append(len(nodes))
+
+    names, sizes, mtimes, lazy = zip(*map(_saved_fields, nodes))
+    sizes = array('q', sizes)
+    mtimes = array('q', [-1 if mtime is None else mtime for mtime in mtimes])
+    lazy = bytes(lazy)
+    names = [name.encode('utf-8', 'surrogateescape') for name in names]
+    name_offsets = array('q', [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    root_path = tree._path.encode('utf-8', 'surrogateescape')
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, _BYTE_ORDERS.index(sys.byteorder),
+                             len(nodes), name_offsets[-1], len(root_path)))
+        for values in (parent, sizes, mtimes, first_child, name_offsets):
+            values.tofile(f)
+        f.write(lazy)
+        f.write(b''.join(names))
+        f.write(root_path)
+    os.replace(temporary_path, path)
+
+
+def _saved_subtrees(node):
+    """Return the subtrees of <node> to save, as used by save_snapshot.
+
+    <node> is either a tree, or a (snapshot, index) pair for a node of a
+    snapshot that has not been built.
+
+    @type node: FileSystemTree | (Snapshot, int)
+    @rtype: list[FileSystemTree | (Snapshot, int)]
+    """
+    saved = node if isinstance(node, tuple) else node._get_extra('snapshot')
+    if saved is not None:
+        snapshot, index = saved
+        return [(snapshot, child) for child in snapshot.children(index)]
+    return [subtree for subtree in node._subtrees if not subtree.is_empty()]
+
+
+def _saved_fields(node):
+    """Return the name, data_size, modification time, and whether it is a
+    placeholder, of a node to save, given as in _saved_subtrees.
+
+    @type node: FileSystemTree | (Snapshot, int)
+    @rtype: (str, int, int | None, bool)
+    """
+    if isinstance(node, tuple):
+        snapshot, index = node
+        return (snapshot.name(index), snapshot.size(index),
+                snapshot.mtime(index), snapshot.is_lazy(index))
+    # a placeholder for saved subtrees is saved as the folder it stands for
+    lazy = node._lazy and node._get_extra('snapshot') is None
+    return node._root, node.data_size, node._mtime, lazy
+
+
+class Snapshot:
+    """A snapshot file, mapped into memory.
+
+    === Public Attributes ===
+    @type node_count: int
+        The number of nodes in the snapshot.
+    @type root_path: str
+        The path the saved tree was read from.
+
+    === Private Attributes ===
+    @type _map: mmap.mmap
+        The memory map of the file.
+    @type _parent: memoryview
+    @type _sizes: memoryview
+    @type _mtimes: memoryview
+    @type _first_child: memoryview
+    @type _name_offsets: memoryview
+    @type _lazy: memoryview
+    @type _names: memoryview
+        Views of the sections of the file, as described in the module
+        docstring.
+    """
+    def __init__(self, path):
+        """Open the snapshot file at <path>.
+
+        Raise ValueError if the file is not a snapshot, or was written on a
+        computer with a different byte order.
+
+        @type self: Snapshot
+        @type path: str
+        @rtype: None
+        """
+        # the map keeps the file open for as long as it is needed
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, count, names_size, path_size = \
+            _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('Not a treemap snapshot: {}'.format(path))
+        if _BYTE_ORDERS[byte_order] != sys.byteorder:
+            self.close()
+            raise ValueError('Snapshot has the wrong byte order: {}'
+                             .format(path))
+        self.node_count = count
+
+        view = memoryview(self._map)
+        offset = _HEADER.size
+        sections = []
+        for length in (count, count, count, count + 1, count + 1):
+            end = offset + 8 * length
+            sections.append(view[offset:end].cast('q'))
+            offset = end
+        (self._parent, self._sizes, self._mtimes, self._first_child,
+         self._name_offsets) = sections
+        self._lazy = view[offset:offset + count]
+        offset += count
+        self._names = view[offset:offset + names_size]
+        offset += names_size
+        self.root_path = bytes(view[offset:offset + path_size]).decode(
+            'utf-8', 'surrogateescape')
+        view.release()
+
+    def name(self, index):
+        """Return the name of node <index>.
+
+        @type self: Snapshot
+        @type index: int
+        @rtype: str
+        """
+        start, end = self._name_offsets[index], self._name_offsets[index + 1]
+        return bytes(self._names[start:end]).decode('utf-8', 'surrogateescape')
+
+    def size(self, index):
+        """Return the data_size of node <index>.
+
+        @type self: Snapshot
+        @type index: int
+        @rtype: int
+        """
+        return self._sizes[index]
+
+    def mtime(self, index):
+        """Return the folder modification time of node <index>.
+
+        Return None if the node is a file.
+
+        @type self: Snapshot
+        @type index: int
+        @rtype: int | None
+        """
+        mtime = self._mtimes[index]
+        return None if mtime == -1 else mtime
+
+    def is_lazy(self, index):
+        """Return whether node <index> is a placeholder for a folder that has
+        not been read yet.
+
+        @type self: Snapshot
+        @type index: int
+        @rtype: bool
+        """
+        return self._lazy[index] != 0
+
+    def parent(self, index):
+        """Return the index of the parent of node <index>, or -1 for the root.
+
+        @type self: Snapshot
+        @type index: int
+        @rtype: int
+        """
+        return self._parent[index]
+
+    def children(self, index):
+        """Return the indices of the subtrees of node <index>.
+
+        @type self: Snapshot
+        @type index: int
+        @rtype: range
+        """
+        return range(self._first_child[index], self._first_child[index + 1])
+
+    def to_tree(self, lazy=False):
+        """Return a new FileSystemTree with the contents of this snapshot.
+
+        If <lazy> is True, only the root and its subtrees are built, and
+        every folder with subtrees of its own is a placeholder, built from
+        this snapshot rather than from the disk when it is expanded (see
+        subtrees). This takes the same short time whatever the size of the
+        tree, but this snapshot must not be closed while the tree is in use.
+
+        @type self: Snapshot
+        @type lazy: bool
+        @rtype: FileSystemTree
+        """
+        if lazy:
+            subtrees = self.subtrees(0)
+            # the data_size of a folder is computed from its subtrees
+            size = 0 if subtrees else self.size(0)
+            root = FileSystemTree._make_node(self.name(0), subtrees, size,
+                                             self.mtime(0), self.is_lazy(0))
+            root._path = self.root_path
+            return root
+        built = [None] * self.node_count
+        # subtrees always come after their parent, so build from the end
+        for index in range(self.node_count - 1, -1, -1):
+            subtrees = []
+            for child in self.children(index):
+                subtrees.append(built[child])
+                built[child] = None
+            # the data_size of a folder is computed from its subtrees
+            size = 0 if subtrees else self.size(index)
+            built[index] = FileSystemTree._make_node(
+                self.name(index), subtrees, size, self.mtime(index),
+                self.is_lazy(index))
+        root = built[0]
+        root._path = self.root_path
+        return root
+
+    def subtrees(self, index):
+        """Return new FileSystemTree nodes for the subtrees of node
+        <index>.
+
+        Files become leaves. A folder with subtrees of its own becomes a
+        placeholder of its saved size, which remembers this snapshot and its
+        index in it (as its 'snapshot' setting, see AbstractTree._extras),
+        so that FileSystemTree.expand builds its subtrees with this method.
+
+        @type self: Snapshot
+        @type index: int
+        @rtype: list[FileSystemTree]
+        """
+        subtrees = []
+        for child in self.children(index):
+            saved = self._first_child[child] != self._first_child[child + 1]
+            subtree = FileSystemTree._make_node(
+                self.name(child), [], self.size(child), self.mtime(child),
+                saved or self.is_lazy(child))
+            if saved:
+                subtree._set_extra('snapshot', (self, child))
+            subtrees.append(subtree)
+        return subtrees
+
+    def changed_folders(self, index, path):
+        """Return the indices of the folders at or below node <index>,
+        saved from the folder at <path>, that have changed since: those
+        whose modification time on the disk is not the saved one (or that
+        no longer exist), and all of their ancestors up to <index>.
+
+        The folders are checked in the snapshot, without building any node.
+
+        @type self: Snapshot
+        @type index: int
+        @type path: str
+        @rtype: set[int]
+        """
+        changed = set()
+        pending = [(index, path)]
+        while pending:
+            folder, folder_path = pending.pop()
+            try:
+                mtime = os.stat(folder_path).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                mtime = None
+            if mtime != self._mtimes[folder]:
+                # mark the path from <index> down to this folder
+                marked = folder
+                while marked not in changed:
+                    changed.add(marked)
+                    if marked == index:
+                        break
+                    marked = self._parent[marked]
+            if mtime is not None:
+                pending.extend(
+                    (child, os.path.join(folder_path, self.name(child)))
+                    for child in self.children(folder)
+                    if self._mtimes[child] != -1)
+        return changed
+
+    def close(self):
+        """Release the memory map and close the snapshot file.
+
+        @type self: Snapshot
+        @rtype: None
+        """
+        for name in ('_parent', '_sizes', '_mtimes', '_first_child',
+                     '_name_offsets', '_lazy', '_names'):
+            if hasattr(self, name):
+                getattr(self, name).release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_snapshot(path):
+    """Return the FileSystemTree saved in the snapshot file at <path>.
+
+    @type path: str
+    @rtype: FileSystemTree
+    """
+    with Snapshot(path) as snapshot:
+        return snapshot.to_tree()
@@ -0,0 +1,231 @@
+"""Assignment 2: Treemap Hit-Testing
+
+=== Module Description ===
+This module contains a spatial index used to find the leaf of a treemap
+that contains a given point (e.g., the position of a mouse click), without
+recomputing the whole layout for every query.
+
+The index descends from the root of the tree towards the selected leaf.
+The first time it passes through a node, the rectangles of that node's
+subtrees are taken from the node's cached layout (computing it if needed),
+along with the rows the layout (see layouts) placed them in. The
+slice-and-dice layout puts all of a node's subtrees in one row; the other
+layouts fill the node's rectangle with several rows, each cut from the left
+or top of what is left of it.
+
+At every later visit, the row containing the point is found by a binary
+search on what was left when each row was placed (these rectangles are
+nested), and the subtree containing the point by a binary search on the
+far edges of the rectangles of the row. A query therefore costs
+O(depth * log(fan-out)) once the nodes on its path have been cached.
+
+The descent stops at subtrees too small to show their leaves (see
+AbstractTree.set_lod_area), which are drawn as a single rectangle.
+
+An index describes one layout of one tree: it must be rebuilt when the tree
+changes, or when it is laid out in a different rectangle, with a different
+layout or with a different LOD area.
+"""
+from bisect import bisect_left
+
+from instrumentation import STATS
+
+
+class TreemapIndex:
+    """A spatial index over the leaves of the treemap of a tree.
+
+    === Public Attributes ===
+    @type tree: AbstractTree
+        The tree that was indexed.
+    @type rect: (int, int, int, int)
+        The rectangle the tree was laid out in.
+    @type version: int
+        The version of <tree> at the time the index was built.
+    @type layout: SliceAndDiceLayout | SquarifiedLayout | StripLayout
+        The layout of <tree> at the time the index was built.
+    @type lod_area: int
+        The LOD area of <tree> at the time the index was built.
+
+    === Private Attributes ===
+    @type _partitions: dict[AbstractTree, _NodeIndex]
+        The index of each internal node visited so far.
+    """
+    def __init__(self, tree, rect):
+        """Initialize an index of <tree> laid out in <rect>.
+
+        @type self: TreemapIndex
+        @type tree: AbstractTree
+        @type rect: (int, int, int, int)
+        @rtype: None
+        """
+        self.tree = tree
+        self.rect = tuple(rect)
+        self.version = tree._version
+        self.layout = tree.get_layout()
+        self.lod_area = tree.get_lod_area()
+        self._partitions = {}
+
+    def is_current(self, tree, rect):
+        """Return True if this index describes the layout of <tree> in <rect>.
+
+        @type self: TreemapIndex
+        @type tree: AbstractTree
+        @type rect: (int, int, int, int)
+        @rtype: bool
+        """
+        return (tree is self.tree and tuple(rect) == self.rect and
+                tree._version == self.version and
+                tree.get_layout() is self.layout and
+                tree.get_lod_area() == self.lod_area)
+
+    def query(self, point):
+        """Return the leaf whose rectangle contains <point>, or the subtree
+        if the leaf is part of a subtree drawn as a whole.
+
+        Rectangles include all four of their edges. When a point lies on an
+        edge shared by several rectangles, the leaf that comes first in the
+        order of generate_treemap is returned.
+
+        Return None if no leaf contains the point. The number of levels
+        descended is counted as 'hit test depth' (see instrumentation).
+
+        @type self: TreemapIndex
+        @type point: (int, int)
+        @rtype: AbstractTree | None
+        """
+        tree, rect = self.tree, self.rect
+        if not _contains(rect, point):
+            return None
+        if tree.is_empty() or tree.data_size == 0:
+            return None
+
+        depth = 0
+        while tree._subtrees != [] and rect[2] * rect[3] >= self.lod_area:
+            tree, rect = self._partition(tree, rect).find(point)
+            depth += 1
+        STATS.count('hit test depth', depth)
+        return tree
+
+    def _partition(self, tree, rect):
+        """Return the index of the partition of <tree>, computing it if
+        needed.
+
+        @type self: TreemapIndex
+        @type tree: AbstractTree
+        @type rect: (int, int, int, int)
+        @rtype: _NodeIndex
+        """
+        if tree not in self._partitions:
+            self._partitions[tree] = _NodeIndex(
+                rect, tree._cached_partition(rect, self.layout))
+        return self._partitions[tree]
+
+
+class _NodeIndex:
+    """An index of the rectangles of the subtrees of one node.
+
+    === Private Attributes ===
+    @type _rows: list[(bool, list[int], list[AbstractTree],
+                       list[(int, int, int, int)])]
+        The rows of non-empty subtrees, in order: whether the rectangles of
+        the row are side by side along the x-axis (rather than the y-axis),
+        the far edge of each rectangle along that axis, the subtrees, and
+        their rectangles.
+    @type _regions: list[(int, int, int, int)]
+        What was left of the node's rectangle when each row was placed.
+    @type _column_edges: list[int]
+    @type _column_rows: list[int]
+        The right edge and the index of each row that is a column down the
+        left side of its region, in order.
+    @type _band_edges: list[int]
+    @type _band_rows: list[int]
+        The bottom edge and the index of each row that is a band across the
+        top of its region, in order.
+    """
+    def __init__(self, rect, children):
+        """Initialize the index of the (subtree, rectangle) pairs
+        <children>, as returned by AbstractTree._cached_partition for a node
+        laid out in <rect>.
+
+        @type self: _NodeIndex
+        @type rect: (int, int, int, int)
+        @type children: _Partition
+        @rtype: None
+        """
+        self._rows, self._regions = [], []
+        self._column_edges, self._column_rows = [], []
+        self._band_edges, self._band_rows = [], []
+        region = rect
+        start = 0
+        for end, across in children.rows:
+            x, y, width, height = region
+            first = children[start][1]
+            if across:
+                far_edge = y + first[3]
+                next_region = (x, far_edge, width, height - first[3])
+            else:
+                far_edge = x + first[2]
+                next_region = (far_edge, y, width - first[2], height)
+            subtrees = [subtree for subtree, _ in children[start:end]
+                        if not subtree.is_empty() and subtree.data_size != 0]
+            rects = [subtree_rect for subtree, subtree_rect
+                     in children[start:end]
+                     if not subtree.is_empty() and subtree.data_size != 0]
+            if subtrees:
+                if across:
+                    self._band_edges.append(far_edge)
+                    self._band_rows.append(len(self._rows))
+                else:
+                    self._column_edges.append(far_edge)
+                    self._column_rows.append(len(self._rows))
+                ends = [r[0] + r[2] if across else r[1] + r[3]
+                        for r in rects]
+                self._rows.append((across, ends, subtrees, rects))
+                self._regions.append(region)
+            region = next_region
+            start = end
+
+    def find(self, point):
+        """Return the first subtree whose rectangle contains <point>, and
+        its rectangle.
+
+        Precondition: <point> is inside the rectangle of the node.
+
+        @type self: _NodeIndex
+        @type point: (int, int)
+        @rtype: (AbstractTree, (int, int, int, int))
+        """
+        found = 0
+        if len(self._rows) > 1:
+            # the regions are nested, so the point is in the region of
+            # every row up to the last one containing it
+            low, high = 0, len(self._regions) - 1
+            while low < high:
+                middle = (low + high + 1) // 2
+                if _contains(self._regions[middle], point):
+                    low = middle
+                else:
+                    high = middle - 1
+            found = low
+            # it is also in any earlier row whose far edge it lies on
+            index = bisect_left(self._column_edges, point[0])
+            if index < len(self._column_rows):
+                found = min(found, self._column_rows[index])
+            index = bisect_left(self._band_edges, point[1])
+            if index < len(self._band_rows):
+                found = min(found, self._band_rows[index])
+        across, ends, subtrees, rects = self._rows[found]
+        # the first subtree whose far edge is not before the point
+        index = bisect_left(ends, point[0] if across else point[1])
+        return subtrees[index], rects[index]
+
+
+def _contains(rect, point):
+    """Return True if <point> is inside <rect> or on one of its edges.
+
+    @type rect: (int, int, int, int)
+    @type point: (int, int)
+    @rtype: bool
+    """
+    return (rect[0] <= point[0] <= rect[0] + rect[2] and
+            rect[1] <= point[1] <= rect[1] + rect[3])
@@ -0,0 +1,102 @@
+"""Assignment 2: Text Rendering
+
+=== Module Description ===
+This module draws the text of the treemap visualiser: the status line at
+the bottom of the window, and the labels drawn inside the rectangles of the
+treemap.
+
+Looking up a system font is slow, and so is rendering a string into a
+surface, so both are cached: each font is created once, and the most
+recently rendered strings are kept (up to TEXT_CACHE_SIZE of them), so
+redrawing the same labels after a click or a key press costs only a blit
+each.
+
+Only leaves whose rectangle is at least LABEL_MIN_SIZE are considered for a
+label, and the treemap traversal skips whole subtrees below that size, so
+the cost of labelling a frame depends on the number of labels that fit on
+the screen rather than on the number of leaves in the tree.
+"""
+from functools import lru_cache
+
+import pygame
+
+
+# The number of rendered strings kept for reuse.
+TEXT_CACHE_SIZE = 2048
+
+# The font size of the labels inside the treemap rectangles.
+LABEL_FONT_SIZE = 12
+
+# The smallest (width, height) of a rectangle that may get a label.
+LABEL_MIN_SIZE = (24, 16)
+
+# The space between a label and the edges of its rectangle.
+LABEL_PADDING = 2
+
+
+@lru_cache(maxsize=None)
+def get_font(family, size):
+    """Return the system font <family> at <size>, creating it only once.
+
+    Precondition: pygame.font has been initialized.
+
+    @type family: str
+    @type size: int
+    @rtype: pygame.font.Font
+    """
+    return pygame.font.SysFont(family, size)
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text, family, size, colour):
+    """Return a surface with <text> rendered in <colour>.
+
+    The returned surface is shared with every other caller asking for the
+    same text, so it must not be modified. Characters that cannot be
+    encoded (e.g., undecodable bytes in a file name) are replaced.
+
+    @type text: str
+    @type family: str
+    @type size: int
+    @type colour: (int, int, int)
+    @rtype: pygame.Surface
+    """
+    text = text.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
+    return get_font(family, size).render(text, 1, colour)
+
+
+def label_colour(colour):
+    """Return the colour that stands out best against <colour>.
+
+    @type colour: (int, int, int)
+    @rtype: (int, int, int)
+    """
+    red, green, blue = colour
+    if 299 * red + 587 * green + 114 * blue > 128000:
+        return 0, 0, 0
+    return 255, 255, 255
+
+
+def draw_labels(screen, leaves, family, only=None):
+    """Draw the name of each leaf in <leaves> inside its rectangle.
+
+    <leaves> contains (rectangle, leaf) tuples, as yielded by
+    AbstractTree.iter_leaves. A label is only drawn if it fits inside its
+    rectangle; names are never cut short. If <only> is given, only the
+    leaves whose rectangle is in <only> are labelled.
+
+    @type screen: pygame.Surface
+    @type leaves: iterable[((int, int, int, int), AbstractTree)]
+    @type family: str
+    @type only: set[(int, int, int, int)] | None
+    @rtype: None
+    """
+    for rect, leaf in leaves:
+        if only is not None and rect not in only:
+            continue
+        label = render_text(leaf._root, family, LABEL_FONT_SIZE,
+                            label_colour(leaf.colour))
+        if label.get_width() <= rect[2] - 2 * LABEL_PADDING and \
+                label.get_height() <= rect[3] - 2 * LABEL_PADDING:
+            screen.blit(label, (rect[0] + LABEL_PADDING,
+                                rect[1] + LABEL_PADDING))
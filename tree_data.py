@@ -10,36 +10,131 @@ This module contains the basic tree interface required by the treemap
 visualiser. You will both add to the abstract class, and complete a
 concrete implementation of a subclass to represent files and folders on your
 computer's file system.
+
+=== Memory Use ===
+Trees are built out of tens of millions of nodes for large volumes, so
+nodes are kept small: every class in the hierarchy declares __slots__, all
+leaves share a single empty _subtrees list, colours are packed into a
+single int, and FileSystemTree names are interned, so that names that occur
+in many folders (e.g., '__init__.py') are stored only once.
+
+Measured with tracemalloc on 64-bit CPython 3.11, for folders of 100 files
+with sizes of up to 1 GB, a FileSystemTree uses about 236 bytes per node,
+including its name and data_size, and about 393 bytes per node once it has
+been laid out (the layout cache stores a rectangle for every node, and a
+list of subtree rectangles for every folder). Before these changes, the
+same trees used about 390 and 550 bytes per node. CompactNodeTest in
+a2_test checks these figures, so that a new attribute on every node is not
+added unnoticed.
 """
+import heapq
 import os
+import sys
 from random import randint
 import math
 
+import fs_scan
+from instrumentation import STATS
+from layouts import SLICE_AND_DICE
+from path_index import PathIndex
+from spatial_index import TreemapIndex
+
+
+# The layout engines accepted by AbstractTree.generate_treemap.
+# 'python' is the recursive implementation below; 'numpy' is the vectorised
+# implementation in numpy_layout, which requires NumPy to be installed.
+LAYOUT_ENGINES = ('python', 'numpy')
+
+# Placeholder leaves (see FileSystemTree) are expanded into their real
+# subtrees when they are laid out in a rectangle of at least this many pixels.
+LAZY_EXPAND_AREA = 400
+
+
+class _NoSubtrees(list):
+    """The type of NO_SUBTREES, the _subtrees list shared by all leaves.
+
+    It is an empty list that can't be added to. Use AbstractTree.add_subtree
+    to give a leaf a subtree; it replaces NO_SUBTREES with a list of its own.
+    """
+    __slots__ = ()
+
+    def _refuse(self, *args):
+        raise TypeError('NO_SUBTREES is shared by all leaves and must not '
+                        'be modified; use AbstractTree.add_subtree')
+
+    append = extend = insert = __setitem__ = __iadd__ = __imul__ = _refuse
+
+
+NO_SUBTREES = _NoSubtrees()
+
+
+class _Partition(list):
+    """The type of AbstractTree._layout_children: the (subtree, rectangle)
+    pairs of a cached layout, in the order they are drawn in.
+
+    Its layout attribute is the layout that computed them, and its rows
+    attribute holds the rows they were placed in, as returned by the
+    layout's partition method (see layouts).
+    """
+    __slots__ = ('layout', 'rows')
+
 
 class AbstractTree:
     """A tree that is compatible with the treemap visualiser.
 
     This is an abstract class that should not be instantiated directly.
 
-    You may NOT add any attributes, public or private, to this class.
-    However, part of this assignment will involve you adding and implementing
-    new public *methods* for this interface.
-
     === Public Attributes ===
     @type data_size: int
         The total size of all leaves of this tree.
     @type colour: (int, int, int)
         The RGB colour value of the root of this tree.
         Note: only the colours of leaves will influence what the user sees.
+        This is a property, stored in _colour.
 
     === Private Attributes ===
     @type _root: obj | None
         The root value of this tree, or None if this tree is empty.
     @type _subtrees: list[AbstractTree]
-        The subtrees of this tree.
+        The subtrees of this tree. This is NO_SUBTREES for every tree
+        without subtrees.
+    @type _colour: int
+        The colour of this tree, packed as 0xRRGGBB.
     @type _parent_tree: AbstractTree | None
         The parent tree of this tree; i.e., the tree that contains this tree
         as a subtree, or None if this tree is not part of a larger tree.
+    @type _version: int
+        A counter that is incremented whenever this tree, or any tree below
+        it, changes through offset_size or delete_node.
+    @type _hit_index: TreemapIndex | None
+        The index used by return_selected_tree, or None if it has not
+        been built yet.
+    @type _layout_rect: (int, int, int, int) | None
+        The rectangle this tree was last laid out in, or None if this tree
+        has not been laid out since it (or its parent) last changed, or has
+        been off screen since. If it is None, the cached layouts of the
+        subtrees of this tree are out of date too.
+    @type _layout_version: int
+        The value of _version when this tree was last laid out. This tree
+        is dirty (its cached layout is out of date) if the two differ.
+    @type _layout_children: list[(AbstractTree, (int, int, int, int))]
+        The subtrees of this tree and their rectangles, as computed by the
+        last layout of this tree in _layout_rect (see _Partition), or
+        NO_SUBTREES if it was drawn as a whole (see set_lod_area).
+    @type _tombstones: int
+        The number of deleted (empty) trees left in _subtrees. Deleting a
+        subtree leaves it in place, so that deletion takes O(1) time; the
+        deleted trees are dropped once they make up half of _subtrees.
+    @type _summary: (int, int, int) | None
+        The _version of this tree when its leaf statistics were last
+        computed, with the size of its largest leaf and its number of leaves
+        at that time (see get_max_leaf_size), or None if they have not been
+        computed yet.
+    @type _extras: dict[str, object] | None
+        The settings and caches of this tree that most trees do not have
+        (e.g., its LOD area, or its path index), by name, or None if it has
+        none. They live on the tree itself, so that they are freed along
+        with it.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -55,6 +150,15 @@ class AbstractTree:
 
     - if _parent_tree is not empty, then self is in _parent_tree._subtrees
     """
+    __slots__ = ('_root', '_subtrees', '_parent_tree', '_colour', 'data_size',
+                 '_version', '_hit_index', '_layout_rect', '_layout_version',
+                 '_layout_children', '_tombstones', '_summary', '_extras')
+
+    # True for placeholder leaves, which stand in for subtrees that have
+    # not been built yet. Subclasses that support placeholders replace
+    # this with a slot of the same name, and override expand.
+    _lazy = False
+
     def __init__(self, root, subtrees, data_size=0):
         """Initialize a new AbstractTree.
 
@@ -79,10 +183,18 @@ class AbstractTree:
         """
         # initialise class attributes
         self._root = root
-        self._subtrees = subtrees
+        self._subtrees = subtrees if subtrees else NO_SUBTREES
         self._parent_tree = None
+        self._version = 0
+        self._hit_index = None
+        self._layout_rect = None
+        self._layout_version = 0
+        self._layout_children = NO_SUBTREES
+        self._tombstones = 0
+        self._summary = None
+        self._extras = None
         # initialise colour attribute as random RBG colour
-        self.colour = (randint(0, 255), randint(0, 255), randint(0, 255))
+        self._colour = randint(0, 0xFFFFFF)
         # initialise data size
         # if this object is a leaf, <data_size> attribute = <data_size> parameter
         # else, <data_size> starts at 0 and is the sum of its subtrees' data size attributes
@@ -94,6 +206,29 @@ class AbstractTree:
                 self.data_size += subtree.data_size
 
 
+    @property
+    def colour(self):
+        """The RGB colour value of the root of this tree.
+
+        @type self: AbstractTree
+        @rtype: (int, int, int)
+        """
+        return (self._colour >> 16, (self._colour >> 8) & 0xFF,
+                self._colour & 0xFF)
+
+    @colour.setter
+    def colour(self, colour):
+        """
+        The treemaps of this tree and of its ancestors are out of date once
+        its colour changes.
+
+        @type self: AbstractTree
+        @type colour: (int, int, int)
+        @rtype: None
+        """
+        self._colour = (colour[0] << 16) | (colour[1] << 8) | colour[2]
+        self._touch()
+
     def is_empty(self):
         """Return True if this tree is empty.
 
@@ -102,102 +237,357 @@ class AbstractTree:
         """
         return self._root is None
 
-    def generate_treemap(self, rect):
+    def set_layout(self, layout):
+        """Use <layout> for the treemaps of this tree, and to find the leaf
+        at a point of them.
+
+        The layout applies to this tree as a whole; a subtree laid out on
+        its own uses its own layout.
+
+        @type self: AbstractTree
+        @type layout: SliceAndDiceLayout | SquarifiedLayout | StripLayout
+        @rtype: None
+        """
+        self._set_extra('layout', layout, SLICE_AND_DICE)
+
+    def get_layout(self):
+        """Return the layout used for the treemaps of this tree.
+
+        @type self: AbstractTree
+        @rtype: SliceAndDiceLayout | SquarifiedLayout | StripLayout
+        """
+        return self._get_extra('layout', SLICE_AND_DICE)
+
+    def set_lod_area(self, min_area):
+        """Draw the subtrees of this tree whose rectangle covers less than
+        <min_area> pixels as a single rectangle, in their own colour.
+
+        Such a subtree takes the place of its leaves in the treemaps of this
+        tree, and its leaves are not visited at all, so the cost of a layout
+        no longer grows with the number of leaves too small to be seen.
+        return_selected_tree returns the subtree itself for a point inside
+        its rectangle. A <min_area> of 0 (the default) turns this off; 1
+        only combines subtrees whose rectangle has no pixels at all, which
+        does not change the picture.
+
+        @type self: AbstractTree
+        @type min_area: int
+        @rtype: None
+        """
+        if min_area != self.get_lod_area():
+            # which subtrees are drawn whole may change anywhere, so the
+            # whole treemap is laid out again
+            self._layout_rect = None
+        self._set_extra('lod area', min_area, 0)
+
+    def get_lod_area(self):
+        """Return the smallest area, in pixels, of a subtree whose leaves are
+        drawn separately in the treemaps of this tree.
+
+        @type self: AbstractTree
+        @rtype: int
+        """
+        return self._get_extra('lod area', 0)
+
+    def _get_extra(self, name, default=None):
+        """Return the setting <name> of this tree (see _extras), or
+        <default> if it has not been set.
+
+        @type self: AbstractTree
+        @type name: str
+        @type default: object
+        @rtype: object
+        """
+        if self._extras is None:
+            return default
+        return self._extras.get(name, default)
+
+    def _set_extra(self, name, value, default=None):
+        """Set the setting <name> of this tree (see _extras) to <value>.
+
+        Nothing is kept for a setting equal to <default>.
+
+        @type self: AbstractTree
+        @type name: str
+        @type value: object
+        @type default: object
+        @rtype: None
+        """
+        if value != default:
+            if self._extras is None:
+                self._extras = {}
+            self._extras[name] = value
+        elif self._extras is not None:
+            self._extras.pop(name, None)
+            if not self._extras:
+                self._extras = None
+
+    def generate_treemap(self, rect, engine='python'):
         """Run the treemap algorithm on this tree and return the rectangles.
 
         Each returned tuple contains a pygame rectangle and a colour:
         ((x, y, width, height), (r, g, b)).
 
-        One tuple should be returned per non-empty leaf in this tree.
+        One tuple should be returned per non-empty leaf in this tree, or
+        per subtree too small to show its leaves (see set_lod_area).
+
+        <engine> selects the layout engine (one of LAYOUT_ENGINES). Every
+        engine returns exactly the same rectangles. The rectangles are
+        computed with the layout of this tree (see set_layout); the 'numpy'
+        engine only supports the slice-and-dice layout.
 
         @type self: AbstractTree
         @type rect: (int, int, int, int)
             Input is in the pygame format: (x, y, width, height)
+        @type engine: str
         @rtype: list[((int, int, int, int), (int, int, int))]
         """
-        # rectangle_list is a list of rectangles that represent non-empty leaves
-        # all objects in the list take the form ((x, y, width, height), (r, g, b))
-        rectangle_list = []
-        if self.is_empty():
-            # empty leaf. 0 non-empty leaves to add to the list.
-            return rectangle_list
-        elif self.data_size == 0:
-            # node with 0 data size. Can assume all subtrees of that node has 0 data size
-            pass
-        elif self._subtrees == []:
-            # non-empty leaf. Take 100% of the available rectangle.
-            return [(rect, self.colour)]
-        else:
-            # internal node with data size > 0
-            last_index = self._get_last_nonempty_tree_index()
-            if rect[2] > rect[3]:
-                # width > height: split vertically
-                rectangle_list += self\
-                    ._partition_rectangle_vertically(rect, last_index)
-            else:
-                # height >= width: split horizontally
-                rectangle_list += self\
-                    ._partition_rectangle_horizontally(rect, last_index)
+        if engine not in LAYOUT_ENGINES:
+            raise ValueError('Unknown layout engine: {}'.format(engine))
+        with STATS.timer('generate_treemap'):
+            if engine == 'python':
+                return list(self.iter_treemap(rect))
+            # imported here so that NumPy is only needed by this engine
+            from numpy_layout import layout_tree
+            flat_tree, leaves, rects = layout_tree(self, rect)
+            colours = flat_tree.colours[leaves]
+            # one tuple per row, built by zip from the columns, rather
+            # than a list and then a tuple per row
+            return list(zip(zip(*rects.T.tolist()),
+                            zip(*colours.T.tolist())))
+
+    def iter_treemap(self, rect, engine='python'):
+        """Run the treemap algorithm on this tree, yielding the rectangles.
+
+        Yield the same ((x, y, width, height), (r, g, b)) tuples as
+        generate_treemap, in the same order, but one at a time, so that they
+        can be used before the whole layout has been computed.
+
+        With the 'python' engine the tree is traversed with an explicit
+        stack, so the depth of the tree is not limited by the recursion
+        limit, and memory use is proportional to the depth of the tree.
 
-        return rectangle_list
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @type engine: str
+        @rtype: iterator[((int, int, int, int), (int, int, int))]
+        """
+        if engine != 'python':
+            yield from self.generate_treemap(rect, engine)
+            return
+        for leaf_rect, leaf in self._iter_leaves(rect):
+            yield leaf_rect, leaf.colour
+
+    def iter_treemap_changes(self, rect):
+        """Yield the treemap rectangles that changed since the last layout.
+
+        Yield a ((x, y, width, height), (r, g, b)) tuple for every leaf of
+        this tree whose rectangle may differ from the one it was given the
+        last time this tree was laid out (by any of the treemap methods).
+        Subtrees that are not dirty and are laid out in the same rectangle
+        as last time are skipped without being visited, so after a single
+        offset_size or delete_node this costs O(depth * fan-out) plus the
+        number of leaves whose rectangles really moved.
+
+        Drawing the yielded rectangles over the previous treemap produces
+        the new treemap, unless this tree now has no non-empty leaves at
+        all, in which case nothing is yielded and <rect> must be cleared.
+
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @rtype: iterator[((int, int, int, int), (int, int, int))]
+        """
+        for leaf_rect, leaf in self._iter_leaves(rect, True):
+            yield leaf_rect, leaf.colour
+
+    def iter_leaves(self, rect, min_size=(0, 0)):
+        """Yield the non-empty leaves of the treemap of this tree.
 
-    def _get_last_nonempty_tree_index(self):
-        """ Get highest index for a non-empty tree in subtrees
+        Each yielded tuple contains the rectangle of a leaf and the leaf
+        itself, in the same order as the tuples of generate_treemap. Leaves
+        whose rectangle is narrower or shorter than <min_size> are skipped,
+        and so are the subtrees containing only such leaves, without being
+        visited; e.g., labelling the leaves that are large enough to hold a
+        label costs time proportional to the number of such leaves, not to
+        the size of the tree.
 
         @type self: AbstractTree
-        @rtype: int
+        @type rect: (int, int, int, int)
+        @type min_size: (int, int)
+        @rtype: iterator[((int, int, int, int), AbstractTree)]
         """
-        # precondition: at least one subtree is non-empty
-        # <index> is the index of the last non-empty subtree
-        index = len(self._subtrees) - 1
-        while index >= 0:
-            if self._subtrees[index].data_size == 0:
-                index -= 1
+        return self._iter_leaves(rect, False, min_size)
+
+    def _iter_leaves(self, rect, changes_only=False, min_size=(0, 0)):
+        """Yield the rectangle of every non-empty leaf in this tree.
+
+        Each yielded tuple contains the rectangle and the leaf itself. Leaves
+        are yielded in the same order as the tuples of generate_treemap.
+
+        If <changes_only> is True, subtrees whose cached layout is still
+        current are skipped. Subtrees whose rectangle is smaller than
+        <min_size> in either dimension are always skipped. Subtrees whose
+        rectangle is smaller than the LOD area of this tree (see
+        set_lod_area) are yielded in place of their leaves.
+
+        Once every rectangle has been yielded, the nodes visited and the
+        rectangles yielded are counted as 'nodes visited' and
+        'rects emitted' (see instrumentation).
+
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @type changes_only: bool
+        @type min_size: (int, int)
+        @rtype: iterator[((int, int, int, int), AbstractTree)]
+        """
+        min_width, min_height = min_size
+        layout = self.get_layout()
+        min_area = self.get_lod_area()
+        # each stack entry iterates over the (subtree, rectangle) pairs of
+        # one node on the path from self to the current node
+        stack = [iter([(self, rect)])]
+        visited = emitted = 0
+        while stack:
+            for tree, tree_rect in stack[-1]:
+                visited += 1
+                if tree.is_empty() or tree.data_size == 0:
+                    # no non-empty leaves to yield
+                    continue
+                elif tree_rect[2] < min_width or tree_rect[3] < min_height:
+                    # every leaf below is at most as large as this subtree
+                    continue
+                elif tree._subtrees != [] and \
+                        tree_rect[2] * tree_rect[3] < min_area:
+                    # too small to show its leaves: draw it as a whole
+                    if changes_only and tree._layout_rect == tree_rect and \
+                            tree._layout_version == tree._version and \
+                            tree._layout_children is NO_SUBTREES:
+                        continue
+                    # the leaves it hides are no longer on screen
+                    for subtree, _ in tree._layout_children:
+                        subtree._layout_rect = None
+                    tree._layout_children = NO_SUBTREES
+                    tree._layout_rect = tree_rect
+                    tree._layout_version = tree._version
+                    emitted += 1
+                    yield tree_rect, tree
+                elif changes_only and \
+                        tree._is_layout_current(tree_rect, layout):
+                    # nothing in this subtree has moved
+                    continue
+                elif tree._subtrees == [] and \
+                        not (tree._lazy and
+                             tree._expand_to_fit(tree_rect, min_area)):
+                    # non-empty leaf. Take 100% of the available rectangle.
+                    tree._layout_rect = tree_rect
+                    tree._layout_version = tree._version
+                    emitted += 1
+                    yield tree_rect, tree
+                else:
+                    # internal node with data size > 0: descend into it
+                    stack.append(iter(tree._cached_partition(tree_rect,
+                                                             layout)))
+                    break
             else:
-                # subtree at current index has a data size > 0
-                break
-        # since at least one subtree is non-empty, can assume index >= 0
-        return index
+                # every pair of the top entry has been visited
+                stack.pop()
+        STATS.count('nodes visited', visited)
+        STATS.count('rects emitted', emitted)
 
-    def _partition_rectangle_vertically(self, rect, last_index):
-        """ Partition current rectangle vertically between subtrees of the current tree.
+    def expand(self):
+        """Replace this placeholder leaf with its real subtrees.
+
+        Does nothing if this tree is not a placeholder.
+
+        @type self: AbstractTree
+        @rtype: None
+        """
+        pass
+
+    def _expand_to_fit(self, rect, min_area=0):
+        """Expand this placeholder if <rect> is large enough to show its
+        subtrees, and return True if it now has subtrees to lay out.
+
+        <rect> must cover at least LAZY_EXPAND_AREA pixels, and at least
+        <min_area>, the LOD area below which the subtrees would not be shown
+        anyway (see set_lod_area).
 
         @type self: AbstractTree
         @type rect: (int, int, int, int)
-            Input is in the pygame format: (x, y, width, height)
-        @type last_index: int
-            The last index of self.subtrees that has datasize > 0.
-        @rtype: list[((int, int, int, int), (int, int, int))]
+        @type min_area: int
+        @rtype: bool
         """
-        rect_list = []
-        x = rect[0]
-        for subtree in self._subtrees[:last_index]:
-            rect_width = int(rect[2] * subtree.data_size / self.data_size)
-            rect_list += subtree.\
-                generate_treemap((x, rect[1], rect_width, rect[3]))
-            x += rect_width
-        rect_list += self._subtrees[last_index].\
-            generate_treemap((x, rect[1], rect[2] - x + rect[0], rect[3]))
-        return rect_list
+        if rect[2] * rect[3] >= max(LAZY_EXPAND_AREA, min_area):
+            self.expand()
+        return self._subtrees != [] and self.data_size > 0
 
-    def _partition_rectangle_horizontally(self, rect, last_index):
-        """Partition current rectangle horizontally between subtrees of the current tree
+    def _is_layout_current(self, rect, layout=SLICE_AND_DICE):
+        """Return True if this tree is clean and was last laid out in rect,
+        using <layout> if it has subtrees.
+
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @type layout: SliceAndDiceLayout | SquarifiedLayout | StripLayout
+        @rtype: bool
+        """
+        return self._layout_rect == rect and \
+            self._layout_version == self._version and \
+            (self._subtrees == [] or
+             getattr(self._layout_children, 'layout', None) is layout)
+
+    def _cached_partition(self, rect, layout=SLICE_AND_DICE):
+        """Return the partition of rect between the subtrees of this tree.
+
+        The result of _partition_rectangle is cached, and reused as long as
+        this tree is clean and is laid out in the same rectangle, with the
+        same layout.
+
+        Precondition: self is an internal node with data_size > 0.
+
+        @type self: AbstractTree
+        @type rect: (int, int, int, int)
+        @type layout: SliceAndDiceLayout | SquarifiedLayout | StripLayout
+        @rtype: list[(AbstractTree, (int, int, int, int))]
+        """
+        if not self._is_layout_current(rect, layout):
+            # if this tree was off screen, so were its subtrees, whatever
+            # their cached layouts say
+            off_screen = self._layout_rect is None
+            children = self._partition_rectangle(rect, layout)
+            self._layout_children = children
+            self._layout_rect = rect
+            self._layout_version = self._version
+            if off_screen:
+                for subtree, _ in children:
+                    subtree._layout_rect = None
+            if len(children) < len(self._subtrees):
+                # subtrees that got no rectangle this time are no longer on
+                # screen, so their cached layouts are out of date
+                placed = {subtree for subtree, _ in children}
+                for subtree in self._subtrees:
+                    if subtree not in placed:
+                        subtree._layout_rect = None
+        return self._layout_children
+
+    def _partition_rectangle(self, rect, layout=SLICE_AND_DICE):
+        """Partition rect between the subtrees of the current tree.
+
+        Return the subtrees that get a rectangle from <layout>, with their
+        rectangles, in the order they are drawn in.
+
+        Precondition: self is an internal node with data_size > 0.
 
         @type self: AbstractTree
         @type rect: (int, int, int, int)
             Input is in the pygame format: (x, y, width, height)
-        @rtype: list[((int, int, int, int), (int, int, int))]
+        @type layout: SliceAndDiceLayout | SquarifiedLayout | StripLayout
+        @rtype: _Partition
         """
-        rect_list = []
-        y = rect[1]
-        for subtree in self._subtrees[:last_index]:
-            rect_height = int(rect[3] * subtree.data_size / self.data_size)
-            rect_list += subtree.\
-                generate_treemap((rect[0], y, rect[2], rect_height))
-            y += rect_height
-        rect_list += self._subtrees[last_index].\
-            generate_treemap((rect[0], y, rect[2], rect[3] - y + rect[1]))
-        return rect_list
+        cells, rows = layout.partition(self._subtrees, self.data_size, rect)
+        children = _Partition(cells)
+        children.layout = layout
+        children.rows = rows
+        return children
 
     def get_separator(self):
         """Return the string used to separate nodes in the string
@@ -214,6 +604,70 @@ class AbstractTree:
         """
         raise NotImplementedError
 
+    def get_path(self):
+        """Return the path from the root of the whole tree to this tree:
+        the names of the trees along it, joined by get_separator.
+
+        This takes O(depth) time.
+
+        @type self: AbstractTree
+        @rtype: str
+        """
+        names = []
+        tree = self
+        while tree is not None:
+            names.append(str(tree._root))
+            tree = tree._parent_tree
+        names.reverse()
+        return self.get_separator().join(names)
+
+    def find_path(self, path):
+        """Return the tree at <path> below this tree, or None if there is
+        no such tree.
+
+        <path> starts with the name of this tree, and is either a string of
+        names joined by get_separator, as returned by get_path, or a list of
+        names (which may contain the separator). Placeholder leaves (see
+        FileSystemTree) are not expanded.
+
+        The first lookup builds an index of the whole tree this tree is part
+        of (see path_index), which is then kept up to date as trees are
+        added and deleted; every later lookup costs one dictionary lookup
+        per name in <path>.
+
+        @type self: AbstractTree
+        @type path: str | list[object]
+        @rtype: AbstractTree | None
+        """
+        if isinstance(path, str):
+            path = path.split(self.get_separator())
+        root = self._tree_root()
+        index = root._get_extra('path index')
+        if index is None:
+            index = PathIndex(root)
+            root._set_extra('path index', index)
+        return index.find(self, path)
+
+    def _tree_root(self):
+        """Return the root of the whole tree this tree is part of.
+
+        @type self: AbstractTree
+        @rtype: AbstractTree
+        """
+        tree = self
+        while tree._parent_tree is not None:
+            tree = tree._parent_tree
+        return tree
+
+    def _path_index(self):
+        """Return the path index of the whole tree this tree is part of, or
+        None if it has not been built.
+
+        @type self: AbstractTree
+        @rtype: PathIndex | None
+        """
+        return self._tree_root()._get_extra('path index')
+
     def return_selected_tree(self, coordinates, screen):
         """
         @type coordinates: tuple
@@ -222,12 +676,146 @@ class AbstractTree:
         Coordinates of rectangle to be rendered on.
         @rtype: Tree
         Returns the selected leaf.
+
+        The spatial index used to answer the query is kept between calls,
+        and is only rebuilt when this tree changes or <screen> is different.
+        """
+        with STATS.timer('return_selected_tree'):
+            if self._hit_index is None or \
+                    not self._hit_index.is_current(self, screen):
+                self._hit_index = TreemapIndex(self, screen)
+            return self._hit_index.query(coordinates)
+
+    def get_max_leaf_size(self):
+        """Return the data_size of the largest leaf of this tree, or 0 if
+        it has no leaves.
+
+        Placeholder leaves (see FileSystemTree) stand for folders, and are
+        not counted as leaves by this method or by get_leaf_count.
+
+        The statistics of every subtree are cached, along with the _version
+        they were computed at. Since offset_size and delete_node change the
+        _version of every ancestor of the trees they change, only the
+        statistics of those ancestors are computed again, each from the
+        cached statistics of its subtrees.
+
+        @type self: AbstractTree
+        @rtype: int
         """
-        leaf_dict = self.leaf_dictionary(screen)
-        for leaf in leaf_dict:
-            if (leaf[0] + leaf[2]) >= coordinates[0] >= leaf[0]:
-                if (leaf[1] + leaf[3]) >= coordinates[1] >= leaf[1]:
-                        return leaf_dict[leaf]
+        return self._leaf_summary()[1]
+
+    def get_leaf_count(self):
+        """Return the number of leaves of this tree.
+
+        @type self: AbstractTree
+        @rtype: int
+        """
+        return self._leaf_summary()[2]
+
+    def _leaf_summary(self):
+        """Return the cached leaf statistics of this tree (see _summary),
+        computing those of the trees below it that are out of date first.
+
+        @type self: AbstractTree
+        @rtype: (int, int, int)
+        """
+        if self._summary is not None and self._summary[0] == self._version:
+            return self._summary
+        # post-order: a tree is summarised once its subtrees are up to date
+        stack = [self]
+        while stack:
+            tree = stack[-1]
+            stale = [subtree for subtree in tree._subtrees
+                     if subtree._summary is None or
+                     subtree._summary[0] != subtree._version]
+            if stale:
+                stack.extend(stale)
+                continue
+            stack.pop()
+            if tree.is_empty() or tree._lazy:
+                max_leaf, leaves = 0, 0
+            elif tree._subtrees == []:
+                max_leaf, leaves = tree.data_size, 1
+            else:
+                max_leaf, leaves = 0, 0
+                for subtree in tree._subtrees:
+                    max_leaf = max(max_leaf, subtree._summary[1])
+                    leaves += subtree._summary[2]
+            tree._summary = (tree._version, max_leaf, leaves)
+        return self._summary
+
+    def largest_leaves(self, k):
+        """Return the <k> largest leaves of this tree, largest first.
+
+        Subtrees are visited in order of the size of their largest leaf
+        (see get_max_leaf_size), and the search stops once <k> leaves have
+        been found, so the subtrees whose largest leaf is too small are
+        never visited. Once the statistics are up to date, this visits
+        O(k * depth) trees and their subtrees, rather than the whole tree.
+        The number of trees visited is counted as 'top-k visited' (see
+        instrumentation).
+
+        @type self: AbstractTree
+        @type k: int
+        @rtype: list[AbstractTree]
+        """
+        return self._largest(k, lambda tree: tree._leaf_summary()[2] > 0,
+                             lambda tree: tree._leaf_summary()[1],
+                             lambda tree: tree._subtrees == [])
+
+    def largest_subtrees(self, k):
+        """Return the <k> largest subtrees of this tree that are not leaves
+        (e.g., folders), largest first.
+
+        Placeholder leaves count as subtrees. This tree itself is not
+        included. A subtree is never larger than the tree it is part of, so
+        the search visits the subtrees of the largest ones only, as
+        largest_leaves does.
+
+        @type self: AbstractTree
+        @type k: int
+        @rtype: list[AbstractTree]
+        """
+        def is_folder(tree):
+            return not tree.is_empty() and (tree._subtrees != [] or
+                                            tree._lazy)
+        if k <= 0 or not is_folder(self):
+            return []
+        return self._largest(k + 1, is_folder, lambda tree: tree.data_size,
+                             lambda tree: True)[1:]
+
+    def _largest(self, k, include, bound, is_result):
+        """Return the <k> trees of this tree with the largest <bound> that
+        are results, largest first.
+
+        Only trees for which <include> is True are visited. <bound> of a
+        tree must be at least <bound> of every result below it, and equal
+        to its own size if it is a result; <is_result> tells results from
+        the trees that are only visited to reach them.
+
+        @type self: AbstractTree
+        @type k: int
+        @type include: (AbstractTree) -> bool
+        @type bound: (AbstractTree) -> int
+        @type is_result: (AbstractTree) -> bool
+        @rtype: list[AbstractTree]
+        """
+        result = []
+        if k <= 0 or not include(self):
+            return result
+        # ties are broken by the order in which trees were reached
+        heap = [(-bound(self), 0, self)]
+        reached = 1
+        while heap and len(result) < k:
+            _, _, tree = heapq.heappop(heap)
+            if is_result(tree):
+                result.append(tree)
+            for subtree in tree._subtrees:
+                if include(subtree):
+                    heapq.heappush(heap, (-bound(subtree), reached, subtree))
+                    reached += 1
+        STATS.count('top-k visited', reached)
+        return result
 
     def leaf_dictionary(self, rect):
         """
@@ -238,102 +826,418 @@ class AbstractTree:
             A dictionary containing the coordinates of the different rectangles
             and the tree residing in it
         """
-        leaf_dictionary = {}
-        if self.is_empty():
-            return leaf_dictionary
-        elif self.data_size == 0:
-            pass
-        elif self._subtrees == []:
-            leaf_dictionary[rect] = self
-            return leaf_dictionary
-        else:
-            # internal node with data size > 0
-            last_index = self._get_last_nonempty_tree_index()
-            if rect[2] > rect[3]:
-                # width > height: split vertically
-                leaf_dictionary.\
-                    update(self._leaf_dictionary_vertical(rect, last_index))
-            else:
-                leaf_dictionary.\
-                    update(self._leaf_dictionary_horizontal(rect, last_index))
-        return leaf_dictionary
+        return {leaf_rect: leaf for leaf_rect, leaf in self._iter_leaves(rect)}
 
-    def _leaf_dictionary_vertical(self, rect, last_index):
-        """ Partition current rectangle vertically between subtrees of the current tree.
+    def delete_node(self):
+        """
+        Deletes a node when called by treemap visualizer.
 
-        @type self: AbstractTree
-        @type rect: (int, int, int, int)
-            Input is in the pygame format: (x, y, width, height)
-        @type last_index: int
-            The last index of self.subtrees that has datasize > 0.
-        @rtype: list[((int, int, int, int), (int, int, int))]
+        The node becomes an empty tree, and is left in the subtrees of its
+        parent as a tombstone (see _tombstones), so this takes O(1) time
+        besides updating the sizes of its ancestors.
         """
-        leaf_dict = {}
-        x = rect[0]
-        for subtree in self._subtrees[:last_index]:
-            rect_width = int(rect[2] * subtree.data_size / self.data_size)
-            leaf_dict.update(subtree.leaf_dictionary(
-                (x, rect[1], rect_width, rect[3])))
-            x += rect_width
-        leaf_dict.update(self._subtrees[last_index].leaf_dictionary(
-            (x, rect[1], rect[2] - x + rect[0], rect[3])))
-        return leaf_dict
+        parent = self._parent_tree
+        if parent is not None:
+            parent.offset_size(-self.data_size)
+        index = self._path_index()
+        if index is not None:
+            index.remove(self)
+        self._make_empty()
+        if parent is not None:
+            parent._add_tombstone()
 
-    def _leaf_dictionary_horizontal(self, rect, last_index):
-        """Partition current rectangle horizontally between subtrees of the current tree
+    def delete_child(self, child):
+        """
+        Delete's child node when called by delete_node
 
         @type self: AbstractTree
-        @type rect: (int, int, int, int)
-            Input is in the pygame format: (x, y, width, height)
-        @rtype: list[((int, int, int, int), (int, int, int))]
+        @type child: AbstractTree
+        @rtype: None
         """
-        leaf_dict = {}
-        y = rect[1]
-        for subtree in self._subtrees[:last_index]:
-            rect_height = int(rect[3] * subtree.data_size / self.data_size)
-            leaf_dict.update(subtree.leaf_dictionary(
-                (rect[0], y, rect[2], rect_height)))
-            y += rect_height
-        leaf_dict.update(self._subtrees[last_index].leaf_dictionary(
-            (rect[0], y, rect[2], rect[3] - y + rect[1])))
-        return leaf_dict
+        if child._parent_tree is self:
+            child.delete_node()
 
+    def delete_nodes(self, nodes):
+        """Delete every tree in <nodes> from this tree.
 
-    def delete_node(self):
+        The total change in size of every ancestor of the deleted trees is
+        added up first, and every ancestor is then updated once, so this
+        takes time proportional to the number of distinct ancestors rather
+        than to the number of deleted trees times the depth of the tree.
+        Trees in <nodes> that are below another tree in <nodes>, or that
+        are already empty, are deleted along with it.
+
+        Precondition: every tree in <nodes> is part of this tree.
+
+        @type self: AbstractTree
+        @type nodes: iterable[AbstractTree]
+        @rtype: None
         """
-        Deletes a node when called by treemap visualizer.
+        deleted = {node for node in nodes if not node.is_empty()}
+        _apply_size_changes({}, deleted)
+
+        index = self._path_index()
+        for node in deleted:
+            parent = node._parent_tree
+            if index is not None:
+                index.remove(node)
+            node._make_empty()
+            if parent is not None:
+                parent._add_tombstone()
+
+    def _make_empty(self):
+        """Turn this tree into an empty tree.
+
+        @type self: AbstractTree
+        @rtype: None
         """
-        if self._parent_tree:
-            self._parent_tree.delete_child(self)
         self._root = None
-        self._subtrees = []
+        self._subtrees = NO_SUBTREES
         self.data_size = 0
         self._parent_tree = None
+        self._tombstones = 0
+        self._version += 1
 
-    def delete_child(self, child):
+    def _add_tombstone(self):
+        """Record that one more subtree of this tree has been deleted.
+
+        Once half of the subtrees are deleted ones, they are all dropped.
+
+        @type self: AbstractTree
+        @rtype: None
         """
-        Delete's child node when called by delete_node
+        self._tombstones += 1
+        if 2 * self._tombstones >= len(self._subtrees):
+            self._compact()
+
+    def _compact(self):
+        """Drop the deleted trees from the subtrees of this tree.
+
+        @type self: AbstractTree
+        @rtype: None
+        """
+        if self._tombstones > 0:
+            subtrees = [subtree for subtree in self._subtrees
+                        if not subtree.is_empty()]
+            self._subtrees = subtrees if subtrees else NO_SUBTREES
+            self._tombstones = 0
+            self._version += 1
+
+    def add_subtree(self, subtree, index=None):
+        """
+        Adds <subtree> as a subtree of this tree, at position <index> of
+        _subtrees (or at the end if <index> is None), and adds its data_size
+        to this tree and all of its ancestors.
+
+        Deleted subtrees that have not been dropped yet (see _tombstones)
+        count towards <index>.
+
+        Precondition: this tree is not empty, is not a leaf with
+        data_size > 0, and <subtree> is not part of another tree.
+
+        @type self: AbstractTree
+        @type subtree: AbstractTree
+        @type index: int | None
+        @rtype: None
+        """
+        if self._subtrees is NO_SUBTREES:
+            self._subtrees = []
+        if index is None:
+            self._subtrees.append(subtree)
+        else:
+            self._subtrees.insert(index, subtree)
+        subtree._parent_tree = self
+        index = self._path_index()
+        if index is not None:
+            index.add(subtree)
+        self.offset_size(subtree.data_size)
+
+    def batch(self):
+        """Return a SizeBatch for this tree, to be used in a with statement.
+
+        While the batch is open, size changes made to this tree or below it
+        through offset_size (and so through increase_size, decrease_size,
+        delete_node, add_subtree and FileSystemTree.refresh) are collected,
+        and the ancestors of the
+        changed trees are updated only once the batch ends, each once. The
+        listeners of this tree are then notified of the whole batch at once.
+
+        @type self: AbstractTree
+        @rtype: SizeBatch
+        """
+        return SizeBatch(self)
+
+    def add_listener(self, listener):
+        """Call <listener> with every SizeBatch begun on this tree, once the
+        batch has been applied.
+
+        The listener is kept until remove_listener is called, or until this
+        tree is freed.
+
+        @type self: AbstractTree
+        @type listener: (SizeBatch) -> object
+        @rtype: None
+        """
+        self._set_extra('listeners',
+                        self._get_extra('listeners', []) + [listener], [])
+
+    def remove_listener(self, listener):
+        """Stop calling <listener> for the batches of this tree.
+
+        @type self: AbstractTree
+        @type listener: (SizeBatch) -> object
+        @rtype: None
         """
-        self._subtrees.remove(child)
-        self.offset_size(-child.data_size)
+        listeners = list(self._get_extra('listeners', []))
+        if listener in listeners:
+            listeners.remove(listener)
+        self._set_extra('listeners', listeners, [])
+
+    def _touch(self):
+        """Mark the cached layouts and leaf statistics of this tree and of
+        all of its ancestors as out of date, without changing any size.
+
+        @type self: AbstractTree
+        @rtype: None
+        """
+        tree = self
+        while tree is not None and not tree.is_empty():
+            tree._version += 1
+            tree = tree._parent_tree
+
+    def _open_batch(self):
+        """Return the innermost open SizeBatch begun on this tree or on one
+        of its ancestors, or None if there is none.
+
+        The open batches are kept on the root of the whole tree (see
+        SizeBatch), so that a batch never collects the changes of another
+        tree.
+
+        @type self: AbstractTree
+        @rtype: SizeBatch | None
+        """
+        batches = self._tree_root()._get_extra('batches', [])
+        if not batches:
+            return None
+        ancestors = set()
+        tree = self
+        while tree is not None:
+            ancestors.add(id(tree))
+            tree = tree._parent_tree
+        for batch in reversed(batches):
+            if id(batch.tree) in ancestors:
+                return batch
+        return None
 
     def offset_size(self, size_change):
         # precondition: self is either a leaf or the sum of all subtree data_size != self.data_size
         # postcondition: data_size is the sum of all subtree data_size
         # negative offset decreases size
-        self.data_size += size_change
-        if self._parent_tree:
-            self._parent_tree.offset_size(size_change)
+        batch = self._open_batch()
+        if batch is not None:
+            # the ancestors are updated when the batch ends
+            batch.offset_size(self, size_change)
+            return
+        # walk up to the root, updating every ancestor along the way; a
+        # deleted (empty) ancestor means this tree is no longer on screen
+        tree = self
+        while tree is not None and not tree.is_empty():
+            tree.data_size += size_change
+            tree._version += 1
+            tree = tree._parent_tree
+
+    def increase_size(self, times=1):
+        """Grow this leaf by 1% (rounded up), <times> times in a row.
+
+        The sizes of the ancestors are updated once, by the total change.
+        Does nothing if this tree is empty or is not a leaf.
 
-    def increase_size(self):
+        @type self: AbstractTree
+        @type times: int
+        @rtype: None
+        """
         if not self.is_empty() and not self._subtrees:
-            size_offset = math.ceil(self.data_size * 0.01)
-            self.offset_size(size_offset)
+            size = self.data_size
+            for _ in range(times):
+                size += math.ceil(size * 0.01)
+            if size != self.data_size:
+                self.offset_size(size - self.data_size)
+
+    def decrease_size(self, times=1):
+        """Shrink this leaf by 1% (rounded up), <times> times in a row.
+
+        The size never goes below 1, and the sizes of the ancestors are
+        updated once, by the total change. Does nothing if this tree is
+        empty or is not a leaf.
+
+        @type self: AbstractTree
+        @type times: int
+        @rtype: None
+        """
+        if not self.is_empty() and not self._subtrees:
+            size = self.data_size
+            for _ in range(times):
+                if size <= 1:
+                    break
+                size -= math.ceil(size * 0.01)
+            if size != self.data_size:
+                self.offset_size(size - self.data_size)
+
+
+class SizeBatch:
+    """A batch of size changes, applied to their ancestors all at once.
+
+    Use it through AbstractTree.batch:
+
+        with tree.batch() as batch:
+            for leaf, size in new_sizes:
+                leaf.offset_size(size - leaf.data_size)
+
+    Inside the with statement, a change to the data_size of a tree takes
+    effect at once, but the data_size of its ancestors is left as it was;
+    the changes of every tree below each ancestor are added up, and applied
+    bottom-up when the batch ends, so every ancestor is updated (and made
+    dirty) once, whatever the number of changes below it. Don't lay out the
+    tree while the batch is open.
+
+    Once applied, the batch serves as the change notification passed to the
+    listeners of its tree (see AbstractTree.add_listener).
+
+    === Public Attributes ===
+    @type tree: AbstractTree
+        The tree the batch was begun on.
+    @type resized: dict[AbstractTree, int]
+        The total change in data_size of every tree offset_size was called
+        on during the batch.
+    @type updated: list[AbstractTree]
+        The ancestors whose data_size was updated when the batch ended,
+        deepest first. Empty until then.
+
+    While its with statement runs, the batch is kept in the 'batches'
+    setting of the root of the whole tree (see AbstractTree._extras), with
+    the other open batches of that tree, innermost last.
+
+    === Private Attributes ===
+    @type _pending: dict[AbstractTree, int]
+        The total size change waiting to be added to each parent of a
+        resized tree.
+    @type _root: AbstractTree | None
+        The root the batch is kept on while it is open, or None.
+    """
+    def __init__(self, tree):
+        """Initialize a new, empty SizeBatch for <tree>.
+
+        @type self: SizeBatch
+        @type tree: AbstractTree
+        @rtype: None
+        """
+        self.tree = tree
+        self.resized = {}
+        self.updated = []
+        self._pending = {}
+        self._root = None
+
+    def __enter__(self):
+        self._root = self.tree._tree_root()
+        batches = self._root._get_extra('batches', [])
+        self._root._set_extra('batches', batches + [self], [])
+        return self
+
+    def __exit__(self, *exc_info):
+        batches = list(self._root._get_extra('batches', []))
+        batches.remove(self)
+        self._root._set_extra('batches', batches, [])
+        self._root = None
+        # even if the with statement failed, the changes made so far must
+        # reach the ancestors, or their sizes would be wrong
+        self.apply()
+
+    def offset_size(self, tree, size_change):
+        """Change the data_size of <tree> now, and that of its ancestors
+        when the batch is applied.
 
-    def decrease_size(self):
-        if self.data_size > 1 and not self.is_empty() and not self._subtrees:
-            size_offset = -math.ceil(self.data_size * 0.01)
-            self.offset_size(size_offset)
+        @type self: SizeBatch
+        @type tree: AbstractTree
+        @type size_change: int
+        @rtype: None
+        """
+        if tree.is_empty():
+            return
+        tree.data_size += size_change
+        tree._version += 1
+        self.resized[tree] = self.resized.get(tree, 0) + size_change
+        parent = tree._parent_tree
+        if parent is not None:
+            self._pending[parent] = self._pending.get(parent, 0) + \
+                size_change
+
+    def apply(self):
+        """Update the ancestors of the resized trees, and notify the
+        listeners of this batch's tree.
+
+        @type self: SizeBatch
+        @rtype: None
+        """
+        pending, self._pending = self._pending, {}
+        self.updated.extend(_apply_size_changes(pending))
+        if self.resized or self.updated:
+            for listener in self.tree._get_extra('listeners', []):
+                listener(self)
+
+
+def _apply_size_changes(size_changes, deleted=()):
+    """Add size changes to trees and to all of their ancestors.
+
+    <size_changes> maps trees to the change of their own data_size. The
+    trees in <deleted> have their data_size taken away from their
+    ancestors instead, and any change below them goes no further. Every
+    ancestor is visited once, deepest first, so the cost is proportional to
+    the number of distinct ancestors rather than to the number of changes
+    times the depth of the tree.
+
+    Return the trees whose data_size changed, deepest first.
+
+    @type size_changes: dict[AbstractTree, int]
+    @type deleted: collection[AbstractTree]
+    @rtype: list[AbstractTree]
+    """
+    # the depth of every changed tree and of all of their ancestors
+    depth = {}
+    for node in list(size_changes) + list(deleted):
+        path = []
+        while node is not None and node not in depth:
+            path.append(node)
+            node = node._parent_tree
+        known = -1 if node is None else depth[node]
+        for ancestor in reversed(path):
+            known += 1
+            depth[ancestor] = known
+
+    # push the size changes up, one level at a time, deepest first
+    change_below = dict.fromkeys(depth, 0)
+    change_below.update(size_changes)
+    updated = []
+    for node in sorted(depth, key=depth.get, reverse=True):
+        parent = node._parent_tree
+        if node in deleted:
+            # changes inside a deleted tree do not go any further
+            change = -node.data_size
+        elif node.is_empty():
+            # a tree that was deleted before
+            continue
+        elif change_below[node] != 0:
+            change = change_below[node]
+            node.data_size += change
+            node._version += 1
+            updated.append(node)
+        else:
+            # the changes below cancel out, but the trees below have still
+            # changed, so the layout and statistics of this one are stale
+            node._version += 1
+            continue
+        if parent is not None:
+            change_below[parent] += change
+    return updated
 
 
 class FileSystemTree(AbstractTree):
@@ -347,14 +1251,65 @@ class FileSystemTree(AbstractTree):
 
     The data_size attribute for regular files as simply the size of the file,
     as reported by os.path.getsize.
+
+    A tree can be read lazily, in which case the folders below a given depth
+    are not read at first. Each is represented by a placeholder: a leaf whose
+    data_size is the total size of the files in the folder. A placeholder is
+    replaced by the folder's contents (with placeholders for its subfolders)
+    when expand is called, or when the treemap algorithm lays it out in a
+    rectangle of at least LAZY_EXPAND_AREA pixels (and no smaller than the
+    LOD area, see set_lod_area).
+
+    === Private Attributes ===
+    @type _path: str | None
+        The full path this tree was read from, if it is the root of the
+        tree; None for every other node.
+    @type _mtime: int | None
+        The modification time, in nanoseconds, of the folder this node
+        represents, as of the last time it was read; None for files.
+    @type _lazy: bool
+        True if this node is a placeholder for a folder that has not been
+        read yet.
     """
-    def __init__(self, path):
+    __slots__ = ('_path', '_mtime', '_lazy')
+
+    def __init__(self, path, workers=1, lazy_depth=None,
+                 one_file_system=False, budget=None):
         """Store the file tree structure contained in the given file or folder.
 
-        Precondition: <path> is a valid path for this computer.
+        The folder is read by up to <workers> threads at once (see fs_scan).
+        The subtrees of every folder are sorted by name, whatever the
+        number of workers.
+
+        If <lazy_depth> is not None, only the folders at most <lazy_depth>
+        levels below <path> are read; the folders one level further down
+        become placeholders, whose sizes are added up without building any
+        nodes for their contents.
+
+        Each file is sized only once, however many hard links it has, and
+        each folder is read only once, however many symbolic links lead to
+        it (see fs_scan). If <one_file_system> is True, folders on other
+        file systems than <path> are left empty. Both hold for the folders
+        read later by expand and refresh too: the device and the files and
+        folders already counted are kept with the tree.
+
+        If <budget> is not None, reading stops once it is exhausted (see
+        fs_scan.ScanBudget), and budget.exhausted tells whether it did. The
+        tree is then partial: the folders left unread become placeholders
+        of size 0, which are read by expand and sized by refresh.
+
+        The time spent reading the disk and building the nodes is recorded
+        as the 'scan' and 'build tree' phases (see instrumentation).
+
+        Precondition: <path> is a valid path for this computer, and
+        workers >= 1.
 
         @type self: FileSystemTree
         @type path: str
+        @type workers: int
+        @type lazy_depth: int | None
+        @type one_file_system: bool
+        @type budget: fs_scan.ScanBudget | None
         @rtype: None
 
         >>> c = FileSystemTree('C:/Users/Isaac/Desktop/A2Test')
@@ -374,27 +1329,409 @@ class FileSystemTree(AbstractTree):
         '234.txt'
 
         """
-        # if path exists, create a list of names of entries in the directory
-        # check if each entry is a directory
-        # if not directory, then it must be a file. If it is a file,
-        # then it is a leaf, extract name for this leaf and the datasize and
-        # then create the tree object
-        # if it is a dir, append the subtrees recursively into final tree.
-        root = os.path.basename(path)
+        # if the path is a file, this tree is a single leaf.
+        # otherwise, read every folder below the path, then build the
+        # subtrees from the listings, deepest folders first.
+        root = sys.intern(os.path.basename(path))
         if os.path.isdir(path):
-            directories = os.listdir(path)
-            subtrees = []
-            for directory in directories:
-                subtrees.append(FileSystemTree(os.path.join(path, directory)))
-            super().__init__(root, subtrees)
+            device = os.stat(path).st_dev if one_file_system else None
+            # the files and folders already counted, shared by both passes
+            # and by every later read
+            seen = {}
+            with STATS.timer('scan'):
+                listings = fs_scan.scan(path, workers, lazy_depth, device,
+                                        budget, seen)
+                unread = [subfolder for listing in listings.values()
+                          for subfolder in listing.subdirectories()
+                          if subfolder not in listings]
+                summaries = fs_scan.summarize(unread, workers, device,
+                                              budget, seen)
+            with STATS.timer('build tree'):
+                super().__init__(root, self._build_subtrees(path, listings,
+                                                            summaries))
+            self._mtime = listings[path].mtime
+            self._set_extra('device', device)
+            self._set_extra('seen', seen)
         else:
             super().__init__(root, [], os.path.getsize(path))
+            self._mtime = None
+        self._path = path
+        self._lazy = False
+
+    @classmethod
+    def _make_node(cls, name, subtrees, data_size=0, mtime=None, lazy=False):
+        """Return a new node of this class without reading from the disk.
+
+        @type cls: type
+        @type name: str
+        @type subtrees: list[FileSystemTree]
+        @type data_size: int
+        @type mtime: int | None
+        @type lazy: bool
+        @rtype: FileSystemTree
+        """
+        node = cls.__new__(cls)
+        AbstractTree.__init__(node, sys.intern(name), subtrees, data_size)
+        node._path = None
+        node._mtime = mtime
+        node._lazy = lazy
+        return node
+
+    @classmethod
+    def _build_subtrees(cls, path, listings, summaries=None):
+        """Return the subtrees of the folder at <path>.
+
+        <listings> contains the listing of <path> and of folders below it,
+        as returned by fs_scan.scan. Every folder below <path> without a
+        listing becomes a placeholder, sized according to its entry in
+        <summaries>, as returned by fs_scan.summarize.
+
+        @type cls: type
+        @type path: str
+        @type listings: dict[str, fs_scan.DirectoryListing]
+        @type summaries: dict[str, (int, int)] | None
+        @rtype: list[FileSystemTree]
+        """
+        # order the folders so that every folder comes before its parent
+        order = []
+        pending = [path]
+        while pending:
+            folder = pending.pop()
+            order.append(folder)
+            pending.extend(subfolder for subfolder
+                           in listings[folder].subdirectories()
+                           if subfolder in listings)
+
+        built = {}
+        for folder in reversed(order):
+            subtrees = []
+            for name, is_directory, size in listings[folder].entries:
+                subfolder = os.path.join(folder, name)
+                if is_directory and subfolder in listings:
+                    subtrees.append(cls._make_node(
+                        name, built.pop(subfolder), 0,
+                        listings[subfolder].mtime))
+                elif is_directory:
+                    size, mtime = summaries[subfolder]
+                    subtrees.append(cls._make_node(name, [], size, mtime,
+                                                   True))
+                else:
+                    subtrees.append(cls._make_node(name, [], size))
+            built[folder] = subtrees
+        return built[path]
+
+    def refresh(self, changed=None):
+        """Bring this tree up to date with the file or folder it was read from.
+
+        If <changed> is None, the modification time of every folder in this
+        tree is checked, and only the folders whose modification time has
+        changed since they were last read are read again.
+
+        Otherwise, <changed> contains the paths of the folders known to have
+        changed (e.g., as reported by fs_watch.InotifyWatcher), and only those
+        folders are read again; the cost of the refresh is then proportional
+        to the number of changes rather than to the size of the tree.
+
+        Files and folders that have appeared are read and added, ones that
+        have disappeared are deleted, and files in the folders read again
+        are resized, using add_subtree, delete_node and offset_size.
+
+        Note: writing to a file does not change the modification time of its
+        folder, so without <changed> a file that grows in place is only seen
+        once something else in its folder changes.
+
+        Precondition: this tree is the root of a FileSystemTree.
+
+        @type self: FileSystemTree
+        @type changed: collection[str] | None
+        @rtype: None
+        """
+        # all the size changes reach the ancestors at once, and listeners
+        # are notified of the whole refresh
+        with self.batch():
+            self._refresh(changed)
+
+    def _refresh(self, changed):
+        """Do the work of refresh, inside its batch.
+
+        @type self: FileSystemTree
+        @type changed: collection[str] | None
+        @rtype: None
+        """
+        if self._mtime is None:
+            # this tree is a single file
+            self.offset_size(os.path.getsize(self._path) - self.data_size)
+        elif changed is None:
+            # the (snapshot, index) of every saved folder that has changed
+            # (see snapshot.Snapshot.changed_folders); the saved folders
+            # below a checked one are only expanded if they are in it
+            opened = set()
+            pending = [(self, self._path, False)]
+            while pending:
+                folder, path, checked = pending.pop()
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    # deleted after its parent was checked
+                    continue
+                saved = folder._get_extra('snapshot')
+                if saved is not None:
+                    snapshot, index = saved
+                    if not checked:
+                        opened.update((snapshot, changed_index)
+                                      for changed_index in
+                                      snapshot.changed_folders(index, path))
+                        checked = True
+                    if saved not in opened:
+                        # nothing below it has changed: leave it unbuilt
+                        continue
+                    folder.expand()
+                if folder._lazy:
+                    # placeholders are only resized when their folder's
+                    # own entries change
+                    if mtime != folder._mtime:
+                        folder._resummarize(path)
+                    continue
+                if mtime != folder._mtime:
+                    folder._reread(path)
+                pending.extend((subtree, os.path.join(path, subtree._root),
+                                checked)
+                               for subtree in folder._subtrees
+                               if subtree._mtime is not None and
+                               not subtree.is_empty())
+        else:
+            # parents come before their subfolders
+            for path in sorted(changed):
+                folder = self._find_folder(path)
+                if folder is not None and folder._lazy:
+                    folder._resummarize(folder._full_path())
+                elif folder is not None:
+                    folder._reread(path)
+
+    def expand(self):
+        """Replace this placeholder with the contents of its folder.
+
+        Files in the folder become leaves, and subfolders become new
+        placeholders. If the total size of the folder has changed since the
+        placeholder was created, the sizes of its ancestors are adjusted.
+
+        A placeholder for subtrees saved in a snapshot (see
+        snapshot.Snapshot.to_tree) is expanded from the snapshot instead,
+        as it was when the snapshot was saved.
 
-        # Remember that you should recursively go through the file system
-        # and create new FileSystemTree objects for each file and folder
-        # encountered.
-        #
-        # Also remember to make good use of the superclass constructor!
+        Does nothing if this node is not a placeholder.
+
+        @type self: FileSystemTree
+        @rtype: None
+        """
+        if not self._lazy:
+            return
+        saved = self._get_extra('snapshot')
+        if saved is not None:
+            snapshot, index = saved
+            self._set_extra('snapshot', None)
+            subtrees = snapshot.subtrees(index)
+        else:
+            path = self._full_path()
+            device, seen = self._scan_state()
+            listings = fs_scan.scan(path, 1, 0, device, None, seen)
+            listing = listings[path]
+            summaries = fs_scan.summarize(listing.subdirectories(), 1,
+                                          device, None, seen)
+            subtrees = self._build_subtrees(path, listings, summaries)
+            self._mtime = listing.mtime
+
+        self._lazy = False
+        if subtrees:
+            self._subtrees = subtrees
+            index = self._path_index()
+            for subtree in subtrees:
+                subtree._parent_tree = self
+                if index is not None:
+                    index.add(subtree)
+        # the layouts and statistics of this node and of its ancestors are
+        # out of date, even if its size has not changed
+        self._touch()
+        size_change = sum(subtree.data_size for subtree in subtrees) - \
+            self.data_size
+        if size_change != 0:
+            self.offset_size(size_change)
+
+    def find_path(self, path):
+        """Return the tree at <path> below this tree, or None if there is
+        no such tree.
+
+        <path> is either a path as returned by get_path, starting with the
+        name of this tree, or, if this tree is the root of a FileSystemTree,
+        the path of a file or folder on the disk (e.g., '/var/log/syslog').
+
+        @type self: FileSystemTree
+        @type path: str | list[str]
+        @rtype: FileSystemTree | None
+        """
+        if isinstance(path, str) and self._path is not None and \
+                os.path.isabs(path):
+            relative = os.path.relpath(path, os.path.abspath(self._path))
+            if relative == os.pardir or \
+                    relative.startswith(os.pardir + os.sep):
+                return None
+            path = [self._root]
+            if relative != os.curdir:
+                path.extend(relative.split(os.sep))
+        return super().find_path(path)
+
+    def _scan_state(self):
+        """Return the device the whole tree this node is part of is kept to
+        (or None), and the files and folders counted in it so far, to read
+        more of it with fs_scan.
+
+        @type self: FileSystemTree
+        @rtype: (int | None, dict[(int, int), str])
+        """
+        root = self._tree_root()
+        seen = root._get_extra('seen')
+        if seen is None:
+            # e.g., a tree loaded from a snapshot
+            seen = {}
+            root._set_extra('seen', seen)
+        return root._get_extra('device'), seen
+
+    def _full_path(self):
+        """Return the full path of the file or folder this node represents.
+
+        @type self: FileSystemTree
+        @rtype: str
+        """
+        names = []
+        node = self
+        while node._parent_tree is not None:
+            names.append(node._root)
+            node = node._parent_tree
+        names.append(node._path)
+        return os.path.join(*reversed(names))
+
+    def _resummarize(self, path):
+        """Add up the size of this placeholder's folder again.
+
+        If the folder no longer exists, this node is deleted.
+
+        Precondition: this node is a placeholder for the folder at <path>.
+
+        @type self: FileSystemTree
+        @type path: str
+        @rtype: None
+        """
+        try:
+            device, seen = self._scan_state()
+            size, mtime = fs_scan.summarize([path], 1, device, None,
+                                            seen)[path]
+        except (FileNotFoundError, NotADirectoryError):
+            self.delete_node()
+            return
+        self._mtime = mtime
+        if size != self.data_size:
+            self.offset_size(size - self.data_size)
+
+    def _find_folder(self, path):
+        """Return the node of this tree for the folder at <path>.
+
+        If <path> is inside a placeholder, return the placeholder. Return
+        None if <path> is not a folder in this tree. Placeholders for
+        subtrees saved in a snapshot are expanded on the way, as that does
+        not read from the disk.
+
+        @type self: FileSystemTree
+        @type path: str
+        @rtype: FileSystemTree | None
+        """
+        relative = os.path.relpath(path, self._path)
+        if relative == os.curdir:
+            return self
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return None
+        folder = self
+        for name in relative.split(os.sep):
+            if folder._get_extra('snapshot') is not None:
+                folder.expand()
+            if folder._lazy:
+                # the changes are somewhere inside this placeholder
+                return folder
+            for subtree in folder._subtrees:
+                if subtree._root == name and subtree._mtime is not None:
+                    folder = subtree
+                    break
+            else:
+                return None
+        if folder._get_extra('snapshot') is not None:
+            folder.expand()
+        return folder
+
+    def _reread(self, path):
+        """Read the folder at <path> again, and update this node to match it.
+
+        Subfolders that already existed are left as they are. If the folder
+        no longer exists, this node is deleted.
+
+        Precondition: this node is a folder, read from <path>.
+
+        @type self: FileSystemTree
+        @type path: str
+        @rtype: None
+        """
+        device, seen = self._scan_state()
+        try:
+            listing = fs_scan.scan(path, 1, 0, device, None, seen)[path]
+        except (FileNotFoundError, NotADirectoryError):
+            if self._parent_tree is None:
+                raise
+            self.delete_node()
+            return
+
+        entries = {name: is_directory
+                   for name, is_directory, _ in listing.entries}
+        existing = {}
+        for subtree in list(self._subtrees):
+            if entries.get(subtree._root) == (subtree._mtime is not None):
+                existing[subtree._root] = subtree
+            else:
+                # removed, or replaced by an entry of the other type
+                subtree.delete_node()
+        # so that the indices in the listing match those of _subtrees
+        self._compact()
+
+        # the surviving subtrees are still sorted by name, so inserting each
+        # new entry at its index in the listing keeps them sorted
+        for index, (name, is_directory, size) in enumerate(listing.entries):
+            subtree = existing.get(name)
+            if subtree is None:
+                self.add_subtree(self._read_entry(path, name, is_directory,
+                                                  size, device, seen), index)
+            elif not is_directory and subtree.data_size != size:
+                subtree.offset_size(size - subtree.data_size)
+        self._mtime = listing.mtime
+
+    @classmethod
+    def _read_entry(cls, folder, name, is_directory, size, device=None,
+                    seen=None):
+        """Return a new node for the entry <name> of the folder at <folder>.
+
+        <device> and <seen> are used to read a folder, as by fs_scan.scan.
+
+        @type cls: type
+        @type folder: str
+        @type name: str
+        @type is_directory: bool
+        @type size: int
+        @type device: int | None
+        @type seen: dict[(int, int), str] | None
+        @rtype: FileSystemTree
+        """
+        if not is_directory:
+            return cls._make_node(name, [], size)
+        path = os.path.join(folder, name)
+        listings = fs_scan.scan(path, 1, None, device, None, seen)
+        return cls._make_node(name, cls._build_subtrees(path, listings), 0,
+                              listings[path].mtime)
 
     def get_separator(self):
         """Return the string used to separate nodes in the string
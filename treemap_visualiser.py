@@ -12,8 +12,16 @@ concrete subclass, of course), rendering it to the user using pygame,
 and detecting user events like mouse clicks and key presses and responding
 to them.
 """
+import os
+import time
+
 import pygame
-from tree_data import FileSystemTree
+import text_render
+from instrumentation import STATS
+from fs_scan import ScanBudget
+from layouts import LAYOUTS
+from tree_data import FileSystemTree, NO_SUBTREES
+from snapshot import Snapshot, save_snapshot
 from population import PopulationTree
 
 
@@ -27,22 +35,112 @@ TREEMAP_HEIGHT = HEIGHT - FONT_HEIGHT  # The height of the treemap display.
 # Font to use for the treemap program.
 FONT_FAMILY = 'Consolas'
 
-
-def run_visualisation(tree):
+# Whether to draw the names of the leaves inside their rectangles.
+SHOW_LABELS = True
+
+# Layout engine used to compute the treemap; see tree_data.LAYOUT_ENGINES.
+# Only the 'python' engine fills the layout caches that render_changes and
+# the hit tests rely on (see AbstractTree.iter_treemap_changes). With
+# 'numpy', render_display is faster, but the first repaint after an edit
+# lays out the whole tree again in Python, and redraws every rectangle;
+# later repaints only redraw what changed. Filling the caches from the
+# numpy layout would take a Python loop over every node, which is what the
+# 'numpy' engine avoids.
+LAYOUT_ENGINE = 'python'
+
+# Layout algorithm used to draw the treemap and to find the leaf under the
+# mouse; see layouts.LAYOUTS. Only 'slice-and-dice' works with the 'numpy'
+# LAYOUT_ENGINE.
+LAYOUT = 'slice-and-dice'
+
+# Subtrees whose rectangle covers fewer pixels than this are drawn as a
+# single rectangle, without visiting their leaves; see
+# AbstractTree.set_lod_area. 1 only skips subtrees that cover no pixels at
+# all; larger values trade detail for speed on very large trees.
+LOD_AREA = 1
+
+# How render_display draws the treemap: 'raster' fills an offscreen pixel
+# buffer in bulk (see raster; requires NumPy), 'draw' makes one
+# pygame.draw.rect call per rectangle.
+RENDERER = 'raster'
+
+# Number of threads used to read folders from the disk.
+SCAN_WORKERS = 8
+
+# Whether to leave out folders on other file systems than the one scanned
+# (e.g., network mounts), like du -x.
+ONE_FILE_SYSTEM = False
+
+# Stop scanning after this many entries or seconds (None for no limit); the
+# folders left unread are shown at size 0 until they are expanded or the
+# tree is refreshed. See fs_scan.ScanBudget.
+SCAN_MAX_ENTRIES = None
+SCAN_MAX_SECONDS = None
+
+# The most frames drawn per second; events arriving faster are combined.
+MAX_FPS = 60
+
+# Holding an arrow key repeats it every KEY_REPEAT_INTERVAL milliseconds,
+# after KEY_REPEAT_DELAY milliseconds. The size step doubles every
+# KEY_ACCELERATION repeats, up to KEY_MAX_STEPS steps of 1% at once.
+KEY_REPEAT_DELAY = 300
+KEY_REPEAT_INTERVAL = 50
+KEY_ACCELERATION = 10
+KEY_MAX_STEPS = 64
+
+# The area of the screen the treemap is drawn in.
+TREEMAP_RECT = (0, 0, WIDTH, TREEMAP_HEIGHT)
+
+# The key that shows or hides the statistics overlay: the time taken by the
+# last frame and by each of its phases, and the numbers of nodes visited and
+# rectangles drawn (see instrumentation). Statistics are only kept while the
+# overlay is shown, or when STATS_FILE is set.
+STATS_KEY = pygame.K_F3
+SHOW_STATS = False
+STATS_FONT_SIZE = 14
+
+# The key that outlines the TOP_K largest leaves of the tree (see
+# AbstractTree.largest_leaves), or removes the outlines, and their colour.
+TOP_KEY = pygame.K_t
+TOP_K = 10
+TOP_COLOUR = (255, 255, 255)
+
+# If not None, statistics are kept for the whole run, and saved to this JSON
+# file when the window is closed.
+STATS_FILE = None
+
+# When more rectangles than this change at once, the screen is updated in
+# one piece (their bounding box) rather than rectangle by rectangle.
+DIRTY_RECT_LIMIT = 64
+
+
+def run_visualisation(tree, on_start=None):
     """Display an interactive graphical display of the given tree's treemap.
 
+    If <on_start> is given, it is called once the first frame is on screen,
+    and the changes it makes to <tree> are drawn like any other (e.g., to
+    refresh a tree loaded from a snapshot without delaying the first frame).
+
     @type tree: AbstractTree
+    @type on_start: (() -> object) | None
     @rtype: None
     """
     # Setup pygame
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    tree.set_layout(LAYOUTS[LAYOUT])
+    tree.set_lod_area(LOD_AREA)
+    STATS.enabled = SHOW_STATS or STATS_FILE is not None
 
     # Render the initial display of the static treemap.
     render_display(screen, tree, '')
 
     # Start an event loop to respond to events.
-    event_loop(screen, tree)
+    try:
+        event_loop(screen, tree, on_start)
+    finally:
+        if STATS_FILE is not None:
+            STATS.dump(STATS_FILE)
 
 
 def render_display(screen, tree, text):
@@ -61,14 +159,102 @@ def render_display(screen, tree, text):
     pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
                      (0, 0, WIDTH, HEIGHT))
 
-    rect_list = tree.generate_treemap((0, 0, WIDTH, TREEMAP_HEIGHT))
-    for rect in rect_list:
-        pygame.draw.rect(screen, rect[1], rect[0])
+    if RENDERER == 'raster':
+        _rasterise_treemap(screen, tree)
+    else:
+        # Draw each rectangle as soon as the layout produces it.
+        with STATS.timer('draw'):
+            for rect, colour in tree.iter_treemap(TREEMAP_RECT,
+                                                  LAYOUT_ENGINE):
+                pygame.draw.rect(screen, colour, rect)
+
+    if SHOW_LABELS:
+        with STATS.timer('labels'):
+            text_render.draw_labels(
+                screen,
+                tree.iter_leaves(TREEMAP_RECT, text_render.LABEL_MIN_SIZE),
+                FONT_FAMILY)
 
     _render_text(screen, text)
 
     # This must be called *after* all other pygame functions have run.
-    pygame.display.flip()
+    with STATS.timer('flip'):
+        pygame.display.flip()
+
+
+def _rasterise_treemap(screen, tree):
+    """Draw the treemap of <tree> onto <screen> with a single blit.
+
+    @type screen: pygame.Surface
+    @type tree: AbstractTree
+    @rtype: None
+    """
+    from raster import rasterise_tree
+    pixels = rasterise_tree(tree, TREEMAP_RECT, LAYOUT_ENGINE)
+
+    with STATS.timer('blit'):
+        buffer = pygame.Surface(TREEMAP_RECT[2:], depth=24)
+        pygame.surfarray.blit_array(buffer, pixels)
+        screen.blit(buffer, TREEMAP_RECT[:2])
+
+
+def render_changes(screen, tree, text, changes=()):
+    """Update the display after <tree> has been modified.
+
+    Only the rectangles whose position, size or colour changed since the
+    treemap was last drawn are repainted (see
+    AbstractTree.iter_treemap_changes), and only those areas of the screen,
+    together with the text display, are sent to the window. The cost of a
+    frame therefore depends on the size of the change rather than on the
+    number of leaves in the tree.
+
+    The screen must already show the treemap of <tree> as it was before the
+    modification, drawn by render_display or render_changes, and <tree> must
+    not have been laid out since (return_selected_tree lays out the nodes it
+    passes through, so call it after this function, not before), except
+    for the changes already collected in <changes> by _collect_changes,
+    which are drawn first.
+
+    @type screen: pygame.Surface
+    @type tree: AbstractTree
+    @type text: str
+        The text to render.
+    @type changes: list[list[((int, int, int, int), (int, int, int))]]
+    @rtype: None
+    """
+    dirty = []
+    with STATS.timer('draw changes'):
+        # later changes are drawn over earlier ones
+        drawn = [change for group in changes for change in group]
+        drawn.extend(tree.iter_treemap_changes(TREEMAP_RECT))
+        for rect, colour in drawn:
+            pygame.draw.rect(screen, colour, rect)
+            dirty.append(rect)
+    if tree.is_empty() or tree.data_size == 0:
+        # no leaves are left to cover the previous treemap
+        pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
+                         TREEMAP_RECT)
+        dirty = [TREEMAP_RECT]
+    else:
+        if SHOW_LABELS:
+            # the repainted rectangles lost their labels
+            with STATS.timer('labels'):
+                text_render.draw_labels(
+                    screen,
+                    tree.iter_leaves(TREEMAP_RECT,
+                                     text_render.LABEL_MIN_SIZE),
+                    FONT_FAMILY, set(dirty))
+        if len(dirty) > DIRTY_RECT_LIMIT:
+            dirty = [pygame.Rect(dirty[0]).unionall(dirty[1:])]
+
+    text_rect = (0, TREEMAP_HEIGHT, WIDTH, FONT_HEIGHT)
+    pygame.draw.rect(screen, pygame.color.THECOLORS['black'], text_rect)
+    _render_text(screen, text)
+    dirty.append(text_rect)
+
+    # push only the repainted areas to the window, instead of flipping
+    with STATS.timer('update'):
+        pygame.display.update(dirty)
 
 
 def _render_text(screen, text):
@@ -78,16 +264,40 @@ def _render_text(screen, text):
     @type text: str
     @rtype: None
     """
-    # The font we want to use
-    font = pygame.font.SysFont(FONT_FAMILY, FONT_HEIGHT - 8)
-    text_surface = font.render(text, 1, pygame.color.THECOLORS['white'])
+    with STATS.timer('text'):
+        # The font is looked up once, and recent texts are rendered only once
+        text_surface = text_render.render_text(text, FONT_FAMILY,
+                                               FONT_HEIGHT - 8,
+                                               (255, 255, 255))
+
+        # Where to render the text_surface
+        text_pos = (0, HEIGHT - FONT_HEIGHT + 4)
+        screen.blit(text_surface, text_pos)
 
-    # Where to render the text_surface
-    text_pos = (0, HEIGHT - FONT_HEIGHT + 4)
-    screen.blit(text_surface, text_pos)
 
+def _render_stats(screen):
+    """Draw the statistics overlay in the top right corner of the treemap,
+    and return the rectangle it covers.
 
-def event_loop(screen, tree):
+    @type screen: pygame.Surface
+    @rtype: (int, int, int, int)
+    """
+    surfaces = [text_render.render_text(line, FONT_FAMILY, STATS_FONT_SIZE,
+                                        (255, 255, 255))
+                for line in STATS.summary()]
+    width = max([surface.get_width() for surface in surfaces] + [0]) + 8
+    height = min(sum(surface.get_height() for surface in surfaces) + 8,
+                 TREEMAP_HEIGHT)
+    rect = (WIDTH - width, 0, width, height)
+    pygame.draw.rect(screen, pygame.color.THECOLORS['black'], rect)
+    y = 4
+    for surface in surfaces:
+        screen.blit(surface, (rect[0] + 4, y))
+        y += surface.get_height()
+    return rect
+
+
+def event_loop(screen, tree, on_start=None):
     """Respond to events (mouse clicks, key presses) and update the display.
 
     Note that the event loop is an *infinite loop*: it continually waits for
@@ -95,8 +305,28 @@ def event_loop(screen, tree):
     of the visualisation or the tree itself, updating the display if necessary.
     This loop ends when the user closes the window.
 
+    The loop sleeps until an event arrives, and then handles every event
+    that is waiting at once. The size changes requested by the arrow keys
+    are added up and applied in one batch (see AbstractTree.batch). The
+    changes to the tree made while handling the events (e.g., a burst of
+    right-clicks) are collected by a listener on the tree, and drawn once
+    at the end of the frame; at most MAX_FPS frames are drawn per second,
+    and events arriving in between are handled together with the next
+    frame. Holding an arrow key repeats it,
+    changing the size in larger and larger steps (see _key_steps).
+
+    TOP_KEY outlines the largest leaves, or removes the outlines; the
+    outlines follow the largest leaves as the tree changes. STATS_KEY shows
+    or hides the statistics overlay, which is redrawn after every frame.
+    The time taken to handle the events of a frame is recorded as the
+    'frame' phase.
+
+    <on_start> is called before the first event is handled, as described in
+    run_visualisation.
+
     @type screen: pygame.Surface
     @type tree: AbstractTree
+    @type on_start: (() -> object) | None
     @rtype: None
     """
     # We strongly recommend using a variable to keep track of the currently-
@@ -104,35 +334,202 @@ def event_loop(screen, tree):
     # But feel free to remove it, and/or add new variables, to help keep
     # track of the state of the program.
     selected_leaf = None
+    # the arrow key being held down, and the number of times it repeated
+    held_key, repeats = None, 0
+    show_stats = SHOW_STATS
+    # the outlined leaves, or None if the largest leaves are not outlined
+    outlined = None
+
+    # only wake up for the events handled below
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.QUIT, pygame.MOUSEBUTTONUP,
+                              pygame.KEYDOWN, pygame.KEYUP,
+                              pygame.VIDEOEXPOSE])
+    pygame.key.set_repeat(KEY_REPEAT_DELAY, KEY_REPEAT_INTERVAL)
+    clock = pygame.time.Clock()
+    # the changes to the tree not drawn yet (see _collect_changes)
+    changes = []
+
+    def repaint(batch):
+        _collect_changes(tree, changes)
+
+    def draw_changes():
+        # draw every change collected in this frame at once
+        if changes:
+            render_changes(screen, tree, _tree_to_text(selected_leaf),
+                           changes)
+            del changes[:]
+
+    tree.add_listener(repaint)
+    try:
+        if on_start is not None:
+            on_start()
+            draw_changes()
+        while True:
+            # Sleep until an event arrives, then take every waiting event
+            events = [pygame.event.wait()]
+            events.extend(pygame.event.get())
+            start = time.perf_counter()
+
+            # net number of 1% steps requested for the selected leaf
+            steps = 0
+            for event in events:
+                if event.type == pygame.QUIT:
+                    # If window is closed, stop event loop
+                    return
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    # apply the size changes so far to the leaf they were for
+                    _resize(tree, selected_leaf, steps)
+                    steps = 0
+                    with STATS.timer('mouse event'):
+                        selected_leaf = _mouse_event(screen, event, tree,
+                                                     selected_leaf, changes)
+                elif event.type == pygame.KEYDOWN and \
+                        event.key in (pygame.K_UP, pygame.K_DOWN):
+                    if event.key == held_key:
+                        repeats += 1
+                    else:
+                        held_key, repeats = event.key, 0
+                    direction = 1 if event.key == pygame.K_UP else -1
+                    steps += direction * _key_steps(repeats)
+                elif event.type == pygame.KEYUP and event.key == held_key:
+                    held_key, repeats = None, 0
+                elif event.type == pygame.KEYDOWN and event.key == TOP_KEY:
+                    if outlined is None:
+                        outlined = []
+                    else:
+                        # remove the outlines
+                        outlined = None
+                        render_display(screen, tree,
+                                       _tree_to_text(selected_leaf))
+                elif event.type == pygame.KEYDOWN and event.key == STATS_KEY:
+                    show_stats = not show_stats
+                    STATS.enabled = show_stats or STATS_FILE is not None
+                    if not show_stats:
+                        # uncover the treemap under the overlay
+                        render_display(screen, tree,
+                                       _tree_to_text(selected_leaf))
+                elif event.type == pygame.VIDEOEXPOSE:
+                    pygame.display.flip()
+
+            _resize(tree, selected_leaf, steps)
+            draw_changes()
+            if outlined is not None:
+                outlined = _outline_largest(screen, tree, outlined,
+                                            _tree_to_text(selected_leaf))
+            STATS.record('frame', (time.perf_counter() - start) * 1000)
+            if show_stats:
+                pygame.display.update(_render_stats(screen))
+            # Leave at least 1 / MAX_FPS seconds between frames
+            clock.tick(MAX_FPS)
+    finally:
+        tree.remove_listener(repaint)
+
+
+def _outline_largest(screen, tree, outlined, text):
+    """Outline the rectangles of the TOP_K largest leaves of <tree>, and
+    return those leaves.
+
+    If they are not the leaves in <outlined>, which were outlined before,
+    the whole display is rendered again first, with <text>, to remove the
+    old outlines.
+
+    @type screen: pygame.Surface
+    @type tree: AbstractTree
+    @type outlined: list[AbstractTree]
+    @type text: str
+    @rtype: list[AbstractTree]
+    """
+    largest = tree.largest_leaves(TOP_K)
+    if outlined and not (len(largest) == len(outlined) and
+                         all(a is b for a, b in zip(largest, outlined))):
+        render_display(screen, tree, text)
+    rects = [rect for rect in map(_drawn_rect, largest)
+             if rect is not None]
+    for rect in rects:
+        pygame.draw.rect(screen, TOP_COLOUR, rect, 2)
+    pygame.display.update(rects)
+    return largest
+
+
+def _drawn_rect(leaf):
+    """Return the rectangle <leaf> was drawn in the last time the treemap
+    was drawn, or None if it was not drawn on its own (e.g., it is part of a
+    subtree too small to show its leaves).
+
+    @type leaf: AbstractTree
+    @rtype: (int, int, int, int) | None
+    """
+    tree = leaf._parent_tree
+    while tree is not None:
+        if tree._layout_rect is None or tree._layout_children is NO_SUBTREES:
+            return None
+        tree = tree._parent_tree
+    rect = leaf._layout_rect
+    if rect is None or rect[2] == 0 or rect[3] == 0:
+        return None
+    return rect
+
+
+def _key_steps(repeats):
+    """Return the number of 1% steps for an arrow key that has repeated
+    <repeats> times.
+
+    The number of steps doubles every KEY_ACCELERATION repeats, up to
+    KEY_MAX_STEPS.
+
+    @type repeats: int
+    @rtype: int
+    """
+    return min(2 ** (repeats // KEY_ACCELERATION), KEY_MAX_STEPS)
+
 
-    while True:
-        # Wait for an event
-        event = pygame.event.poll()
-        if event.type == pygame.QUIT:
-            # If window is closed, stop event loop
-            return
-        elif event.type == pygame.MOUSEBUTTONUP:
-            # left mouse button
-            selected_leaf = _mouse_event(screen, event, tree, selected_leaf)
-        if event.type == pygame.KEYUP:
-            _keyboard_event(screen, event, tree, selected_leaf)
+def _resize(tree, selected_leaf, steps):
+    """Grow (or shrink, if <steps> is negative) the selected leaf by <steps>
+    steps of 1%.
+
+    The change is made in a batch, whose listener in event_loop collects
+    the changes to draw at the end of the frame. Does nothing if <steps> is
+    0 or no leaf is selected.
+
+    @type tree: AbstractTree
+    @type selected_leaf: AbstractTree | None
+    @type steps: int
+    @rtype: None
+    """
+    if selected_leaf is None or steps == 0:
+        return
+    with STATS.timer('resize'), tree.batch():
+        if steps > 0:
+            selected_leaf.increase_size(steps)
+        else:
+            selected_leaf.decrease_size(-steps)
+
+
+def _collect_changes(tree, changes):
+    """Add the rectangles of <tree> that changed since it was last drawn to
+    <changes>, to be drawn later by render_changes.
+
+    This lets <tree> be laid out again (e.g., by return_selected_tree)
+    before the changes are drawn, so that several changes made in the same
+    frame are drawn at once.
+
+    @type tree: AbstractTree
+    @type changes: list[list[((int, int, int, int), (int, int, int))]]
+    @rtype: None
+    """
+    changes.append(list(tree.iter_treemap_changes(TREEMAP_RECT)))
 
 
 def render_text_update(screen, text):
-    pygame.draw.rect(screen, pygame.color.THECOLORS['black'],
-                     (0, TREEMAP_HEIGHT, WIDTH, FONT_HEIGHT))
+    text_rect = (0, TREEMAP_HEIGHT, WIDTH, FONT_HEIGHT)
+    pygame.draw.rect(screen, pygame.color.THECOLORS['black'], text_rect)
     _render_text(screen, text)
-    pygame.display.flip()
+    pygame.display.update(text_rect)
 
 
 def get_hierachy(selected_leaf):
-    directory = [selected_leaf._root]
-    current_leaf = selected_leaf
-    while current_leaf._parent_tree is not None:
-            current_leaf = current_leaf._parent_tree
-            directory.insert(0, current_leaf._root)
-    a = selected_leaf.get_separator()
-    return a.join(directory)
+    return selected_leaf.get_path()
 
 
 
@@ -143,7 +540,12 @@ def _tree_to_text(selected_leaf):
     else:
         return ""
 
-def _mouse_event(screen, event, tree, selected_leaf):
+def _mouse_event(screen, event, tree, selected_leaf, changes):
+    """Handle the mouse click <event>, and return the selected leaf.
+
+    The changes it makes to <tree> are collected in <changes> (see
+    _collect_changes), to be drawn at the end of the frame.
+    """
 
     if event.pos[0] < 0 or event.pos[0] > WIDTH or event.pos[1] < 0 or \
                     event.pos[1] > TREEMAP_HEIGHT or tree.data_size == 0:
@@ -154,9 +556,15 @@ def _mouse_event(screen, event, tree, selected_leaf):
         return selected_leaf
 
     # tree_at_position must exist
-    tree_at_position = tree.return_selected_tree(event.pos, (0, 0, WIDTH, TREEMAP_HEIGHT))
-
-    if event.button == 1:
+    tree_at_position = tree.return_selected_tree(event.pos, TREEMAP_RECT)
+
+    if event.button == 1 and getattr(tree_at_position, '_lazy', False):
+        # left click on a folder that has not been read yet: read it, and
+        # select the leaf that is now under the mouse
+        tree_at_position.expand()
+        _collect_changes(tree, changes)
+        selected_leaf = tree.return_selected_tree(event.pos, TREEMAP_RECT)
+    elif event.button == 1:
         # left click
         if tree_at_position == selected_leaf:
             selected_leaf = None
@@ -169,31 +577,68 @@ def _mouse_event(screen, event, tree, selected_leaf):
         if tree_at_position == selected_leaf:
             selected_leaf = None
         tree_at_position.delete_node()
-        render_display(screen, tree, _tree_to_text(selected_leaf))
+        _collect_changes(tree, changes)
     return selected_leaf
 
 
-def _keyboard_event(screen, event, tree, selected_leaf):
-    if selected_leaf:
-        if event.key == pygame.K_UP:
-            selected_leaf.increase_size()
-        if event.key == pygame.K_DOWN:
-            selected_leaf.decrease_size()
-        render_display(screen, tree, _tree_to_text(selected_leaf))
-
-
-def run_treemap_file_system(path):
+def run_treemap_file_system(path, snapshot_path=None):
     """Run a treemap visualisation for the given path's file structure.
 
+    If <snapshot_path> is given and a snapshot of <path> was saved there,
+    the tree is loaded from it and shown at once, instead of scanning the
+    whole folder again; it is then refreshed, and the changes drawn, once
+    the first frame is on screen. A snapshot of another path, or one that
+    cannot be read, is ignored. The (refreshed or newly scanned) tree is
+    then saved to <snapshot_path> for the next run.
+
     Precondition: <path> is a valid path to a file or folder.
 
     @type path: str
+    @type snapshot_path: str | None
     @rtype: None
     """
-    file_tree = FileSystemTree(path)
+    file_tree = _open_snapshot(path, snapshot_path)
+    if file_tree is not None:
+        def on_start():
+            file_tree.refresh()
+            save_snapshot(file_tree, snapshot_path)
+        run_visualisation(file_tree, on_start)
+        return
+    file_tree = FileSystemTree(
+        path, SCAN_WORKERS, one_file_system=ONE_FILE_SYSTEM,
+        budget=ScanBudget(SCAN_MAX_ENTRIES, SCAN_MAX_SECONDS))
+    if snapshot_path is not None:
+        save_snapshot(file_tree, snapshot_path)
     run_visualisation(file_tree)
 
 
+def _open_snapshot(path, snapshot_path):
+    """Return the tree saved in the snapshot file at <snapshot_path>.
+
+    The tree is built lazily (see Snapshot.to_tree), so only the folders
+    drawn large enough to show their contents are built.
+
+    Return None if <snapshot_path> is None, there is no such file, it is
+    not a snapshot that can be read here, or it is a snapshot of another
+    path than <path>.
+
+    @type path: str
+    @type snapshot_path: str | None
+    @rtype: FileSystemTree | None
+    """
+    if snapshot_path is None or not os.path.isfile(snapshot_path):
+        return None
+    try:
+        snapshot = Snapshot(snapshot_path)
+    except ValueError:
+        return None
+    if os.path.abspath(snapshot.root_path) != os.path.abspath(path):
+        snapshot.close()
+        return None
+    # the snapshot stays open, for the tree to expand its placeholders from
+    return snapshot.to_tree(lazy=True)
+
+
 def run_treemap_population():
     """Run a treemap visualisation for World Bank population data.
 